@@ -2,15 +2,20 @@
 import cv2
 import numpy as np
 import os
+import time
+
+from halva_detector import (
+    color_green, PYRAMID_SCALE, find_and_draw_largest_ellipses, draw_ellipse_centers, locate_ellipses,
+    compare_ellipses, white_mask_outside_ellipses, detect_black_spot,
+)
 
 # === Глобальные константы ===
-color_red = (0, 0, 255)     # Красный цвет для отметки ошибок
-color_green = (0, 255, 0)   # Зелёный цвет для выделения зон 
 image_folder = "C:/Users/admin/Documents/foto1080/"  # Путь к изображениям
 max_images = 999  # Максимальное количество изображений для перебора
 PORT = 8000           # порт сервера (http://localhost:8000)
 CAM_INDEX = 0         # 0 — первая камера, 1 — вторая и т.д.
 JPEG_QUALITY = 80     # качество сжатия (0–100)
+REPORT_EVERY = 50     # раз во сколько кадров печатать отчёт по режиму пирамиды
 
 # === Вспомогательная функция: ничего не делает (нужна для трекбаров) ===
 def nothing(x=None):
@@ -61,6 +66,9 @@ def create_trackbars() -> None:
     # Переключатель отображения зон
     cv2.createTrackbar('Show Zones', 'Detection Zones', 1, 1, nothing)
 
+    # Режим пирамиды: эллипсы ищутся на кадре, уменьшенном в PYRAMID_SCALE раз
+    cv2.createTrackbar('Pyramid', 'Detection Zones', 0, 1, nothing)
+
     # HSV диапазон для поиска чёрных пятен
     for name, val in [('LHBlack', 0), ('LSBlack', 0), ('LVBlack', 8),
                       ('UHBlack', 24), ('USBlack', 121), ('UVBlack', 73)]:
@@ -90,6 +98,7 @@ def get_trackbar_values() -> dict:
 
     # Переключатель отображения зон
     vals['Show Zones'] = cv2.getTrackbarPos('Show Zones', 'Detection Zones')
+    vals['Pyramid'] = cv2.getTrackbarPos('Pyramid', 'Detection Zones')
 
     # Диапазон HSV для чёрных пятен
     for name in ['LHBlack', 'LSBlack', 'LVBlack', 'UHBlack', 'USBlack', 'UVBlack']:
@@ -98,86 +107,6 @@ def get_trackbar_values() -> dict:
     return vals
 
 
-# === Поиск и отрисовка эллипсов в заданных зонах ===
-def find_and_draw_largest_ellipses(
-    img: np.ndarray,
-    img_clean: np.ndarray,
-    mask: np.ndarray,
-    zones: list[tuple[int, int]],
-    zone_radius: int,
-    min_r: int = 110,
-    max_r: int = 160,
-    max_circles: int = 3
-) -> tuple[np.ndarray, list[tuple[int, int, int, int, int]]]:
-    """
-    Находит эллипсы в заданных зонах по маске и рисует центры на изображении.
-    Возвращает обновлённое изображение и список найденных эллипсов.
-    """
-
-    ellipses = []
-    # Поиск контуров на бинарной маске
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    for cnt in contours:
-        if len(cnt) < 5:
-            continue  # Недостаточно точек для аппроксимации эллипса
-
-        (cx, cy), axes, angle = cv2.fitEllipse(cnt)  # Аппроксимация контуров эллипсом
-    
-        # Проверка попадания центра в одну из зон
-        for zx, zy in zones:
-            if (cx - zx) ** 2 + (cy - zy) ** 2 <= zone_radius ** 2:
-                ellipses.append((int(cx), int(cy), int(axes[0] * 0.65), int(axes[1] * 0.7), int(angle)))
-                break
-
-    # Сортировка по размеру и выбор максимальных N эллипсов
-    ellipses = sorted(ellipses, key=lambda c: c[3], reverse=True)[:max_circles]
-
-    # Отрисовка центров эллипсов
-    for (cx, cy, axes1, axes2, angle) in ellipses:
-        cv2.circle(img_clean, (cx, cy), 2, color_green, -1)
-        cv2.putText(img_clean, "cen", (cx - 25, cy - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color_green, 2)
-
-    return img_clean, ellipses
-
-
-# === Белая заливка области вне найденных эллипсов ===
-def white_mask_outside_ellipses(img: np.ndarray, ellipses: list[tuple[int, int, int, int, int]]) -> np.ndarray:
-    """
-    Оставляет внутри эллипсов исходное изображение, остальное заменяет белым цветом.
-    """
-    mask = np.full(img.shape[:2], 255, dtype=np.uint8)
-    for (cx, cy, ax, ay, angle) in ellipses:
-        cv2.ellipse(mask, (cx, cy), (ax, ay), angle, 0, 360, 0, -1)
-
-    mask_inv = cv2.bitwise_not(mask)
-    result_ellipses = cv2.bitwise_and(img, img, mask=mask_inv)
-
-    white_background = np.full_like(img, 255)
-    result = np.where(result_ellipses == 0, white_background, result_ellipses)
-    return result
-
-
-# === Обнаружение чёрных пятен ===
-def detect_black_spot(img: np.ndarray, lower_black: np.ndarray, upper_black: np.ndarray) -> np.ndarray:
-    """
-    Ищет чёрные пятна на изображении в заданном HSV диапазоне.
-    Отмечает прямоугольники вокруг найденных пятен.
-    """
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, lower_black, upper_black)
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > 10:  # Фильтр по минимальной площади
-            x, y, w, h = cv2.boundingRect(cnt)
-            cv2.rectangle(img, (x, y), (x + w, y + h), color_red, 2)
-            cv2.putText(img, f"{int(area)}", (x, y - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color_red, 1)
-    return img
-
-
 # === Визуализация диапазона HSV ===
 def draw_hsv_display(lh, ls, lv, uh, us, uv, title: str, label: str) -> None:
     """Отображает плавный градиент HSV диапазона для наглядности."""
@@ -198,11 +127,49 @@ def draw_hsv_display(lh, ls, lv, uh, us, uv, title: str, label: str) -> None:
     cv2.imshow(title, color_display)
 
 
+# === Отчёт по режиму пирамиды ===
+def new_pyramid_stats() -> dict:
+    """Пустой накопитель статистики сравнения полного разрешения и пирамиды."""
+    return {'frames': 0, 't_full': 0.0, 't_pyr': 0.0, 'ellipses': 0,
+            'matched': 0, 'missed': 0, 'extra': 0, 'center_err_max': 0.0, 'axis_err_max': 0}
+
+
+def update_pyramid_stats(stats: dict, t_full: float, t_pyr: float,
+                         full: list, pyr: list) -> None:
+    """Добавляет в статистику время обоих путей и результат сравнения эллипсов."""
+    cmp = compare_ellipses(full, pyr)
+    stats['frames'] += 1
+    stats['t_full'] += t_full
+    stats['t_pyr'] += t_pyr
+    stats['ellipses'] += len(full)
+    for key in ('matched', 'missed', 'extra'):
+        stats[key] += cmp[key]
+    stats['center_err_max'] = max(stats['center_err_max'], cmp['center_err_max'])
+    stats['axis_err_max'] = max(stats['axis_err_max'], cmp['axis_err_max'])
+
+
+def print_pyramid_report(stats: dict) -> None:
+    """Печатает ускорение и потерю совпадения пирамиды относительно полного разрешения."""
+    n = stats['frames']
+    if n == 0:
+        return
+    t_full = stats['t_full'] / n * 1000
+    t_pyr = stats['t_pyr'] / n * 1000
+    speedup = t_full / t_pyr if t_pyr > 0 else 0.0
+    agree = 100.0 * stats['matched'] / stats['ellipses'] if stats['ellipses'] else 100.0
+    print(f"Пирамида 1/{PYRAMID_SCALE}, кадров {n}: полное {t_full:.2f} мс, "
+          f"пирамида {t_pyr:.2f} мс, ускорение x{speedup:.1f}; "
+          f"совпало {stats['matched']}/{stats['ellipses']} ({agree:.1f}%), "
+          f"пропущено {stats['missed']}, лишних {stats['extra']}, "
+          f"ошибка центра до {stats['center_err_max']:.1f} px, осей до {stats['axis_err_max']} px")
+
+
 # === Главный цикл программы ===
 def main():
     """Основной цикл обработки изображений."""
     create_trackbars()
     i = 0
+    pyramid_stats = new_pyramid_stats()
 
     while True:
         vals = get_trackbar_values()
@@ -254,6 +221,21 @@ def main():
 
         # Поиск эллипсов и чёрных пятен
         figure_img, figure = find_and_draw_largest_ellipses(img_masked, img.copy(), mask, zones, zone_r, min_r, max_r)
+
+        # === Режим пирамиды: эллипсы по уменьшенному кадру, пятна — в полном разрешении ===
+        if vals['Pyramid']:
+            t0 = time.perf_counter()
+            full = locate_ellipses(img, hsv_min, hsv_max, zones, zone_r)
+            t1 = time.perf_counter()
+            pyr = locate_ellipses(img, hsv_min, hsv_max, zones, zone_r, scale=PYRAMID_SCALE)
+            t2 = time.perf_counter()
+            update_pyramid_stats(pyramid_stats, t1 - t0, t2 - t1, full, pyr)
+            if pyramid_stats['frames'] >= REPORT_EVERY:
+                print_pyramid_report(pyramid_stats)
+                pyramid_stats = new_pyramid_stats()
+            figure = pyr
+            figure_img = draw_ellipse_centers(img.copy(), figure)
+
         white_img = white_mask_outside_ellipses(figure_img, figure)
         img_result = detect_black_spot(white_img, hsv_min_Black, hsv_max_Black)
 
@@ -273,6 +255,7 @@ def main():
         if cv2.waitKey(10) & 0xFF == 27:
             break
 
+    print_pyramid_report(pyramid_stats)
     cv2.destroyAllWindows()
 
 
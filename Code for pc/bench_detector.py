@@ -0,0 +1,242 @@
+"""
+bench_detector.py
+Микробенчмарки и контроль регрессий горячего пути анализа.
+
+- Генерирует синтетические кадры с известными эллипсами и пятнами
+  (камера и фото не нужны)
+- Замеряет каждую стадию: cv_handling, analyze_product (анализ кадра, как в
+  itog prog.py — сама программа не загружается, её лог и метрики не трогаются),
+  find_and_draw_largest_ellipses, white_mask_outside_ellipses,
+  detect_black_spot, locate_ellipses (пирамида), frame_quality
+  (проверка качества кадра), поиск пятен по эталону (halva_reference),
+  cv2.imencode
+  на нескольких разрешениях и уровнях шума
+- Проверяет, что на синтетике найдены все заложенные пятна
+- Сравнивает медианы с сохранённой базой и завершается с кодом 1,
+  если стадия стала медленнее порога. База снимается на целевом ПК
+  (--save) и в репозиторий не кладётся; без базы сравнивать не с чем —
+  код 2, а не «регрессий нет»
+
+Запуск:
+    python bench_detector.py            # сравнить с базой
+    python bench_detector.py --save     # записать новую базу (на целевом ПК)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from halva_detector import (
+    DEFAULT_PARAMS, PYRAMID_SCALE, analyze_product, crop_zone, cv_handling, detect_black_spot,
+    detection_zones, find_and_draw_largest_ellipses, frame_quality, hsv_bounds, locate_ellipses,
+    verdict_of, white_mask_outside_ellipses,
+)
+from halva_reference import ReferenceModel, align_patch, inner_disk, level_gain
+
+# ---------- НАСТРОЙКИ ----------
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "bench_baseline.json")
+RESOLUTIONS = {"1080p": (1920, 1080), "720p": (1280, 720)}
+NOISE_LEVELS = {"clean": 0, "noise8": 8, "noise25": 25}
+REPEAT = 30                # замеров на стадию
+THRESHOLD = 0.25           # допустимое замедление медианы (25 %)
+MIN_DELTA_MS = 0.2         # разницу меньше этого не считаем регрессией (шум таймера)
+JPEG_QUALITY = 80
+
+PRODUCT_BGR = (150, 200, 230)   # цвет изделия (попадает в LH..UV по умолчанию)
+BELT_BGR = (255, 0, 0)          # фон: не изделие и не пятно
+SPOT_BGR = (10, 10, 10)         # чёрное пятно
+
+
+# ---------- СИНТЕТИЧЕСКИЕ КАДРЫ ----------
+
+def scaled_params(params: dict, k: float) -> dict:
+    """Параметры детектора для кадра, уменьшенного в 1/k раз относительно 1080p."""
+    out = dict(params)
+    for name in ('Zone X', 'Zone Y', 'Zone Width', 'Zone Height', 'Min Radius', 'Max Radius',
+                 'X1', 'Y1', 'X2', 'Y2', 'X3', 'Y3', 'X4', 'Y4', 'Zone Radius'):
+        out[name] = int(round(params[name] * k))
+    return out
+
+
+def make_frame(size: tuple[int, int], params: dict, noise: int, seed: int = 0) -> tuple[np.ndarray, list]:
+    """
+    Кадр с изделиями в центрах зон и по одному пятну в первых трёх изделиях.
+    Возвращает кадр и список пятен (x, y, радиус) в координатах обрезанного кадра.
+    """
+    w, h = size
+    k = h / 1080
+    rng = np.random.default_rng(seed)
+    frame = np.full((h, w, 3), BELT_BGR, dtype=np.uint8)
+    x0, y0 = params['Zone X'], params['Zone Y']
+    zones = detection_zones(params)
+
+    spots = []
+    for i, (zx, zy) in enumerate(zones):
+        axes = (int(120 * k), int(100 * k))
+        cv2.ellipse(frame, (x0 + zx, y0 + zy), axes, 20, 0, 360, PRODUCT_BGR, -1)
+        if i < 3:
+            r = max(2, int(6 * k))
+            sx, sy = zx + int(rng.integers(-30, 30) * k), zy + int(rng.integers(-30, 30) * k)
+            cv2.circle(frame, (x0 + sx, y0 + sy), r, SPOT_BGR, -1)
+            spots.append((sx, sy, r))
+
+    if noise > 0:
+        noisy = frame.astype(np.int16) + rng.normal(0, noise, frame.shape).astype(np.int16)
+        frame = noisy.clip(0, 255).astype(np.uint8)
+    return frame, spots
+
+
+def make_reference(img: np.ndarray, params: dict) -> ReferenceModel:
+    """Эталон из четвёртого изделия синтетического кадра (на нём нет пятна), разброс нулевой."""
+    hsv_min, hsv_max = hsv_bounds(params)
+    zones = detection_zones(params)
+    ellipses = locate_ellipses(img, hsv_min, hsv_max, zones, params['Zone Radius'], 4, PYRAMID_SCALE)
+    clean = min(ellipses, key=lambda e: (e[0] - zones[3][0]) ** 2 + (e[1] - zones[3][1]) ** 2)
+    patch, _ = align_patch(img, clean)
+    mean = patch.astype(np.float32) * np.float32(level_gain(patch, inner_disk()))
+    return ReferenceModel(mean, np.zeros_like(mean))
+
+
+# ---------- ЗАМЕРЫ ----------
+
+def analyze_and_decide(frame: np.ndarray, params: dict) -> int:
+    """Анализ кадра и решение по пятнам — то, что делает программа на каждое изделие."""
+    return verdict_of(analyze_product(frame, params, PYRAMID_SCALE))
+
+
+def timeit(fn, setup=None, repeat: int = REPEAT) -> float:
+    """Медиана времени fn(*setup()) в мс; подготовка аргументов в замер не входит."""
+    args = setup() if setup else ()
+    fn(*args)  # прогрев
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times) * 1000)
+
+
+def bench_case(size: tuple[int, int], noise: int) -> tuple[dict, list[str], str]:
+    """
+    Замеры всех стадий на одном разрешении и уровне шума + проверка результата.
+    Пропуск пятна считается ошибкой только на чистом кадре: на шумном
+    пятно законно распадается, там лишь печатается доля найденных.
+    """
+    params = scaled_params(DEFAULT_PARAMS, size[1] / 1080)
+    frame, spots = make_frame(size, params, noise)
+
+    img = crop_zone(frame, params).copy()
+    zones = detection_zones(params)
+    zone_r = params['Zone Radius']
+    hsv_min, hsv_max = hsv_bounds(params)
+    black_min, black_max = hsv_bounds(params, 'Black')
+    mask = cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), hsv_min, hsv_max)
+    img_masked = cv2.bitwise_and(img, img, mask=mask)
+    _, ellipses = find_and_draw_largest_ellipses(img_masked, img.copy(), mask, zones, zone_r)
+    white_img = white_mask_outside_ellipses(img, ellipses)
+    reference = make_reference(img, params)
+
+    times = {
+        "cv_handling": timeit(cv_handling, lambda: (frame,)),
+        "analyze_product": timeit(analyze_and_decide, lambda: (frame, params)),
+        "find_and_draw_largest_ellipses": timeit(
+            find_and_draw_largest_ellipses, lambda: (img_masked, img.copy(), mask, zones, zone_r)),
+        "locate_ellipses_pyramid": timeit(
+            locate_ellipses, lambda: (img, hsv_min, hsv_max, zones, zone_r, 3, PYRAMID_SCALE)),
+        "white_mask_outside_ellipses": timeit(white_mask_outside_ellipses, lambda: (img, ellipses)),
+        "detect_black_spot": timeit(detect_black_spot, lambda: (white_img.copy(), black_min, black_max)),
+        "frame_quality": timeit(frame_quality, lambda: (frame, params)),
+        "reference_defects": timeit(reference.extract_defects, lambda: (img, ellipses, zones, zone_r)),
+        "imencode": timeit(cv2.imencode, lambda: (".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])),
+    }
+
+    # проверка: каждое заложенное пятно найдено (в эллипсах, которые нашёл детектор)
+    errors = []
+    result = analyze_product(frame, params)
+    found = result["defects"]["centroid"]
+    ref_found = reference.extract_defects(crop_zone(frame, params), result["ellipses"], zones, zone_r)["centroid"]
+    expected = hit = ref_hit = 0
+    for (sx, sy, r) in spots:
+        inside = any((cx - sx) ** 2 + (cy - sy) ** 2 <= (ax ** 2) for (cx, cy, ax, ay, ang) in result["ellipses"])
+        if not inside:
+            continue  # изделие вне max_circles — пятно не проверяется
+        expected += 1
+        if any(np.hypot(fx - sx, fy - sy) <= r + 2 for (fx, fy) in ref_found):
+            ref_hit += 1
+        if any(np.hypot(fx - sx, fy - sy) <= r + 2 for (fx, fy) in found):
+            hit += 1
+        elif noise == 0:
+            errors.append(f"пятно ({sx}, {sy}) не найдено")
+    if not result["ellipses"]:
+        errors.append("эллипсы не найдены")
+    return times, errors, (f"пятен найдено {hit}/{expected}, всего компонент {len(found)}, "
+                           f"по эталону {ref_hit}/{expected}")
+
+
+# ---------- ОСНОВНАЯ ЛОГИКА ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячего пути анализа халвы")
+    parser.add_argument("--save", action="store_true", help="записать результаты как новую базу")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="файл базы (JSON)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="допустимое замедление, доля")
+    args = parser.parse_args()
+
+    results, failed = {}, []
+
+    for res_name, size in RESOLUTIONS.items():
+        for noise_name, noise in NOISE_LEVELS.items():
+            case = f"{res_name}/{noise_name}"
+            times, errors, info = bench_case(size, noise)
+            print(f"{case}: {info}")
+            for stage, ms in times.items():
+                results[f"{case}/{stage}"] = round(ms, 3)
+            for err in errors:
+                failed.append(f"{case}: {err}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    print(f"\n{'стадия':<58} {'мс':>9} {'база':>9} {'изм.':>7}")
+    for key, ms in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<58} {ms:>9.3f} {'—':>9} {'':>7}")
+            continue
+        change = (ms - base) / base if base > 0 else 0.0
+        mark = ""
+        if change > args.threshold and ms - base > MIN_DELTA_MS:
+            mark = " ❌"
+            failed.append(f"{key}: {base:.3f} → {ms:.3f} мс (+{change * 100:.0f} %)")
+        print(f"{key:<58} {ms:>9.3f} {base:>9.3f} {change * 100:>+6.0f}%{mark}")
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "cv2": cv2.__version__, "cpu_count": os.cpu_count(),
+                       "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 База сохранена: {args.baseline}")
+
+    if failed:
+        print("\n❌ Регрессии / ошибки:")
+        for line in failed:
+            print("   " + line)
+        sys.exit(1)
+    if not baseline and not args.save:
+        print(f"\n⚠ Базы {args.baseline} нет — сравнивать не с чем, запусти с --save на целевом ПК")
+        sys.exit(2)
+    print("\n✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+halva_bus.py
+Многопроцессный режим: общая память для кадров и присмотр за процессами.
+
+- FrameRing — кольцо из N кадров в multiprocessing.shared_memory.
+  Процесс камеры пишет кадр в следующий слот, остальные процессы
+  читают последний кадр без копирования (numpy-вид на общую память).
+  У каждого слота свой номер кадра (seqlock): после работы с видом
+  читатель проверяет valid(seq) — не перезаписан ли слот за это время
+- Channel — канал «один писатель → один читатель» на Pipe. В отличие от
+  multiprocessing.Queue, у него нет общих блокировок: процесс, убитый
+  посреди get(), не вешает очередь для своего перезапущенного преемника
+- Supervisor — запускает процессы по ролям (camera, analysis, plc, web),
+  перезапускает упавший с нарастающей паузой, не трогая остальные.
+  Состояние процессов (pid, время запуска/готовности, перезапуски)
+  лежит в общем массиве — его видит веб (/api/status)
+"""
+
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+META_FIELDS = 5             # номер кадра, высота, ширина, время съёмки, время получения
+STATE_FIELDS = 4            # pid, запущен (unix-время), готов (unix-время, 0 — нет), перезапусков
+RESTART_DELAY = (1.0, 30.0) # пауза перед перезапуском: начальная и наибольшая, с
+READER_POLL_S = 0.5         # читатель канала отмечается живым не реже этого, с
+READER_TIMEOUT_S = 10.0     # читатель не ждал записей дольше — мёртв, записи ему не отправляются
+                            # (больше наибольшего бюджета изделия: анализ между get() не дольше)
+STABLE_S = 30.0             # процесс, проживший дольше, считается стабильным (пауза сбрасывается)
+
+
+# ============================================================
+#  КОЛЬЦО КАДРОВ
+# ============================================================
+
+class FrameRing:
+    """
+    Кольцо кадров в общей памяти.
+    create=True — создать (главный процесс), иначе подключиться по имени.
+    Кадры — uint8 BGR не больше max_shape.
+    """
+
+    def __init__(self, name: str, slots: int, max_shape: tuple, create: bool = False):
+        self.name = name
+        self.slots = slots
+        self.max_shape = tuple(max_shape)
+        self.slot_bytes = int(np.prod(max_shape))
+        self.created = create
+        if create:
+            self._cleanup_stale(name)
+            self.data_shm = shared_memory.SharedMemory(f"{name}_data", create=True, size=slots * self.slot_bytes)
+            self.meta_shm = shared_memory.SharedMemory(f"{name}_meta", create=True, size=(slots + 1) * META_FIELDS * 8)
+        else:
+            self.data_shm = shared_memory.SharedMemory(f"{name}_data")
+            self.meta_shm = shared_memory.SharedMemory(f"{name}_meta")
+        self.data = np.ndarray((slots, self.slot_bytes), dtype=np.uint8, buffer=self.data_shm.buf)
+        # строки 0..slots-1: [номер кадра, высота, ширина, время съёмки, время получения (мкс)];
+        # последняя строка: [номер последнего записанного кадра, 0, ...]
+        self.meta = np.ndarray((slots + 1, META_FIELDS), dtype=np.int64, buffer=self.meta_shm.buf)
+        if create:
+            self.meta[:] = 0
+
+    @staticmethod
+    def _cleanup_stale(name: str):
+        """Сегменты, оставшиеся от аварийно завершённого запуска."""
+        for suffix in ("_data", "_meta"):
+            try:
+                old = shared_memory.SharedMemory(f"{name}{suffix}")
+            except FileNotFoundError:
+                continue
+            old.close()
+            old.unlink()
+
+    def write(self, frame: np.ndarray, ts: float, t_recv: float) -> int:
+        """
+        Записать кадр в следующий слот: ts — время съёмки, t_recv — получения (time.time()).
+        Возвращает номер кадра (0 — кадр больше max_shape, не записан).
+        """
+        h, w = frame.shape[:2]
+        size = frame.size
+        if frame.dtype != np.uint8 or size > self.slot_bytes:
+            return 0
+        seq = int(self.meta[self.slots, 0]) + 1
+        i = seq % self.slots
+        row = self.meta[i]
+        row[0] = -seq                      # слот пишется — читатели его не берут
+        self.data[i, :size] = frame.reshape(-1)
+        row[1], row[2], row[3], row[4] = h, w, int(ts * 1e6), int(t_recv * 1e6)
+        row[0] = seq
+        self.meta[self.slots, 0] = seq     # публикуем последним
+        return seq
+
+    def latest_seq(self) -> int:
+        return int(self.meta[self.slots, 0])
+
+    def view(self, seq: int) -> tuple[np.ndarray | None, float | None, float | None]:
+        """
+        Вид (без копии) на кадр seq, время съёмки и получения;
+        (None, None, None), если слот уже перезаписан.
+        """
+        if seq <= 0:
+            return None, None, None
+        i = seq % self.slots
+        row = self.meta[i]
+        if row[0] != seq:
+            return None, None, None
+        h, w, ts, t_recv = int(row[1]), int(row[2]), row[3] / 1e6, row[4] / 1e6
+        frame = self.data[i, :h * w * 3].reshape(h, w, 3)
+        return frame, ts, t_recv
+
+    def latest(self) -> tuple[int, np.ndarray | None, float | None, float | None]:
+        """(номер, вид на кадр, время съёмки, время получения) последнего кадра."""
+        seq = self.latest_seq()
+        return (seq,) + self.view(seq)
+
+    def valid(self, seq: int) -> bool:
+        """Кадр seq всё ещё в своём слоте (вид на него не испорчен записью)."""
+        return seq > 0 and self.meta[seq % self.slots, 0] == seq
+
+    def copy(self, seq: int) -> np.ndarray | None:
+        """Устойчивая копия кадра seq (None, если уже перезаписан)."""
+        frame = self.view(seq)[0]
+        if frame is None:
+            return None
+        out = frame.copy()
+        return out if self.valid(seq) else None
+
+    def close(self):
+        del self.data, self.meta
+        self.data_shm.close()
+        self.meta_shm.close()
+        if self.created:
+            for shm in (self.data_shm, self.meta_shm):
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+# ============================================================
+#  КАНАЛ МЕЖДУ ПРОЦЕССАМИ
+# ============================================================
+
+class Channel:
+    """
+    Pipe в одну сторону. put() никогда не блокирует: запись идёт в локальную
+    очередь, в трубу её переносит фоновый поток. get(timeout) — как у queue.Queue.
+    Читатель, пока ждёт в get(), отмечается в общей памяти (last_read) не реже
+    READER_POLL_S. Если он молчит дольше READER_TIMEOUT_S (процесс упал), записи
+    отбрасываются, а не отправляются: поток отправки не повисает на полной трубе
+    мёртвого читателя. До первого get() (читатель ещё запускается) записи ждут в трубе.
+    dropped — сколько записей отброшено (буфер полон или читатель мёртв).
+    """
+
+    def __init__(self, ctx, maxsize: int = 1000):
+        self.reader, self.writer = ctx.Pipe(duplex=False)
+        self.maxsize = maxsize
+        self.last_read = ctx.Value("d", 0.0, lock=False)
+        self.dropped = 0
+        self._buf = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # в дочерний процесс передаются только концы трубы и отметка читателя
+        return {"reader": self.reader, "writer": self.writer, "maxsize": self.maxsize,
+                "last_read": self.last_read}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.dropped = 0
+        self._buf = None
+        self._lock = threading.Lock()
+
+    def reader_alive(self) -> bool:
+        """Читатель ждёт записи (или ещё ни разу не ждал — запускается)."""
+        last = self.last_read.value
+        return last == 0 or time.time() - last <= READER_TIMEOUT_S
+
+    def put(self, item) -> bool:
+        """Поставить запись на отправку. False — буфер полон, запись отброшена."""
+        if self._buf is None:
+            with self._lock:
+                if self._buf is None:
+                    buf = queue.Queue(maxsize=self.maxsize)
+                    threading.Thread(target=self._send_loop, args=(buf,), daemon=True,
+                                     name="halva-channel").start()
+                    self._buf = buf
+        try:
+            self._buf.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _send_loop(self, buf: queue.Queue):
+        while True:
+            item = buf.get()
+            if not self.reader_alive():
+                self.dropped += 1
+                continue
+            try:
+                self.writer.send(item)
+            except Exception:
+                time.sleep(0.1)
+
+    def get(self, timeout: float | None = None):
+        """Следующая запись; queue.Empty — за timeout ничего не пришло (или запись испорчена)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                self.last_read.value = time.time()
+                wait = READER_POLL_S if deadline is None else min(READER_POLL_S, deadline - time.monotonic())
+                if self.reader.poll(max(wait, 0)):
+                    return self.reader.recv()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise queue.Empty
+        except queue.Empty:
+            raise
+        except Exception:
+            raise queue.Empty
+
+
+# ============================================================
+#  ПРИСМОТР ЗА ПРОЦЕССАМИ
+# ============================================================
+
+def mark_ready(state, index: int) -> None:
+    """Вызывается в дочернем процессе, когда его роль готова к работе."""
+    if state is not None and index >= 0 and state[index * STATE_FIELDS + 2] == 0:
+        state[index * STATE_FIELDS + 2] = time.time()
+
+
+def read_state(state, roles: tuple) -> dict:
+    """Состояние процессов из общего массива: роль -> словарь."""
+    out = {}
+    for i, role in enumerate(roles):
+        pid, started, ready, restarts = state[i * STATE_FIELDS:(i + 1) * STATE_FIELDS]
+        out[role] = {"pid": int(pid), "started": round(started, 3),
+                     "ready_s": round(ready - started, 3) if ready else None, "restarts": int(restarts)}
+    return out
+
+
+class Supervisor:
+    """
+    Дочерние процессы по ролям. check() раз в секунду: упавший процесс
+    перезапускается (пауза растёт, если он падает сразу после запуска),
+    остальные продолжают работу.
+    """
+
+    def __init__(self, roles: tuple, ctx=None):
+        self.roles = tuple(roles)
+        self.ctx = ctx or mp.get_context("spawn")   # как на Windows
+        self.state = self.ctx.Array("d", len(self.roles) * STATE_FIELDS, lock=False)
+        self.specs = {}
+        self.procs = {}
+        self.delay = {role: RESTART_DELAY[0] for role in self.roles}
+        self.restart_at = {}
+
+    def add(self, role: str, target, *args) -> None:
+        """target(*args) — функция верхнего уровня модуля (нужно для spawn)."""
+        self.specs[role] = (target, args)
+
+    def _spawn(self, role: str) -> None:
+        i = self.roles.index(role)
+        target, args = self.specs[role]
+        proc = self.ctx.Process(target=target, args=args, name=f"halva-{role}", daemon=True)
+        self.state[i * STATE_FIELDS + 1] = time.time()
+        self.state[i * STATE_FIELDS + 2] = 0
+        proc.start()
+        self.state[i * STATE_FIELDS] = proc.pid
+        self.procs[role] = proc
+
+    def start(self) -> None:
+        for role in self.roles:
+            if role in self.specs:
+                self._spawn(role)
+
+    def check(self) -> list[str]:
+        """Перезапуск упавших процессов. Возвращает сообщения для лога."""
+        messages = []
+        now = time.time()
+        for role, proc in list(self.procs.items()):
+            if proc.is_alive():
+                continue
+            i = self.roles.index(role)
+            if role not in self.restart_at:
+                lived = now - self.state[i * STATE_FIELDS + 1]
+                if lived >= STABLE_S:
+                    self.delay[role] = RESTART_DELAY[0]
+                self.restart_at[role] = now + self.delay[role]
+                messages.append(f"💥 Процесс {role} (pid {proc.pid}) завершился с кодом {proc.exitcode} "
+                                f"через {lived:.0f} с, перезапуск через {self.delay[role]:.0f} с")
+                self.delay[role] = min(self.delay[role] * 2, RESTART_DELAY[1])
+            elif now >= self.restart_at[role]:
+                del self.restart_at[role]
+                self.state[i * STATE_FIELDS + 3] += 1
+                self._spawn(role)
+                messages.append(f"🔁 Процесс {role} перезапущен (pid {self.procs[role].pid})")
+        return messages
+
+    def status(self) -> dict:
+        return read_state(self.state, self.roles)
+
+    def stop(self, timeout: float = 3.0) -> None:
+        for proc in self.procs.values():
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self.procs.values():
+            proc.join(timeout)
@@ -0,0 +1,367 @@
+"""
+halva_classifier.py
+Обученное решение ОК/брак по признакам детектора (cv2.ml).
+
+- product_features() — компактный вектор на каждый эллипс изделия:
+  оси эллипса, число и гистограмма площадей пятен, цвет внутри эллипса
+  (тон — круговым средним: cos/sin угла и его разброс, т. к. H замкнут
+  и 179 соседствует с 0; S и V — среднее и разброс), доля тёмных
+  пикселей. Пятна берутся из результата
+  analyze_product — на изделие добавляется только HSV-статистика ROI
+  (по каждому второму пикселю)
+- Признаки каждого кадра кешируются (FeatureCache, JSONL): ключ — файл,
+  его размер и время изменения, параметры детектора и версия признаков.
+  Переобучение с другой моделью или разметкой детектор заново не гоняет
+- Модель cv2.ml (RTrees или SVM) сохраняется в .yml, рядом .json:
+  признаки, нормировка, детектор пятен, точность на отложенных кадрах
+- В рабочей программе LearnedClassifier.verdict() оценивает все эллипсы
+  кадра одним predict(): брак, если модель отклонила хотя бы один.
+  Признаки и predict() идут в том же бюджете изделия (deadline)
+- Классы — коды ПЛК: 1 — ОК, 2 — брак
+
+Разметка: папки --ok (все изделия годные) и --reject. Если в кадре брака
+бракованы не все изделия, в папке кладётся labels.csv (frame,zones):
+    12.png,1 4
+— номера зон (1..4) бракованных изделий, остальные изделия кадра считаются годными.
+
+Обучение:
+    python halva_classifier.py --ok good/ --reject bad/ -o halva_classifier.yml
+    python halva_classifier.py --ok good/ --reject bad/ --model svm --params halva_params.json
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from halva_detector import (
+    DEFAULT_PARAMS, MIN_SPOT_AREA, Deadline, analyze_product, crop_zone, detection_zones, ellipse_roi,
+    ellipse_zone, hsv_bounds,
+)
+from halva_params import read_params_file
+from halva_reference import ReferenceModel, list_images
+
+OK, REJECT = 1, 2                       # классы = коды iPcResult
+FEATURE_VERSION = 2                     # менять при изменении признаков (сбрасывает кеш)
+HSV_STEP = 2                            # HSV-статистика по каждому N-му пикселю ROI (пятна — по полной маске детектора)
+AREA_BINS = (MIN_SPOT_AREA, 20, 50, 100, 200, np.inf)   # границы гистограммы площадей пятен, px
+FEATURE_NAMES = (
+    ["axis_major", "axis_minor", "axis_ratio", "spots", "spot_area_total", "spot_area_max"]
+    + [f"spots_{int(lo)}_{hi if np.isinf(hi) else int(hi)}" for lo, hi in zip(AREA_BINS[:-1], AREA_BINS[1:])]
+    + ["h_cos", "h_sin", "h_spread", "s_mean", "v_mean", "s_std", "v_std", "dark_fraction"]
+)
+# тон OpenCV 0..179 — это угол 0..358° с шагом 2°
+HUE_COS = np.cos(np.arange(180) * np.pi / 90)
+HUE_SIN = np.sin(np.arange(180) * np.pi / 90)
+LABELS_FILE = "labels.csv"              # разметка по зонам в папке кадров брака
+HOLDOUT = 0.2                           # доля кадров для проверки точности
+CACHE_FILE = "halva_features.jsonl"
+
+
+# ============================================================
+#  ПРИЗНАКИ
+# ============================================================
+
+def product_features(img: np.ndarray, result: dict, params: dict, deadline: Deadline | None = None
+                     ) -> np.ndarray:
+    """
+    Признаки каждого эллипса результата analyze_product (N x len(FEATURE_NAMES), float32).
+    img — обрезанный кадр (crop_zone), в нём же координаты результата.
+    deadline — проверяется перед каждым эллипсом (AnalysisTimeout "features").
+    """
+    ellipses = result["ellipses"]
+    out = np.zeros((len(ellipses), len(FEATURE_NAMES)), dtype=np.float32)
+    if not ellipses:
+        return out
+    black_min, black_max = hsv_bounds(params, 'Black')
+    areas, owners = result["defects"]["area"], result["defects"]["ellipse"]
+
+    for k, ellipse in enumerate(ellipses):
+        if deadline is not None:
+            deadline.check("features")
+        cx, cy, ax, ay, angle = ellipse
+        spot_areas = areas[owners == k]
+        hist = np.bincount(np.searchsorted(AREA_BINS[1:-1], spot_areas, side="right"), minlength=len(AREA_BINS) - 1)
+
+        # ROI уменьшается в HSV_STEP раз (INTER_NEAREST — каждый N-й пиксель без смешивания цветов)
+        x, y, w, h = ellipse_roi(ellipse, img.shape)
+        size = (max(w // HSV_STEP, 1), max(h // HSV_STEP, 1))
+        roi = cv2.resize(img[y:y + h, x:x + w], size, interpolation=cv2.INTER_NEAREST)
+        inside = np.zeros((size[1], size[0]), dtype=np.uint8)
+        cv2.ellipse(inside, ((cx - x) // HSV_STEP, (cy - y) // HSV_STEP),
+                    (ax // HSV_STEP, ay // HSV_STEP), angle, 0, 360, 255, -1)
+        pixels = max(cv2.countNonZero(inside), 1)
+        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+        mean, std = cv2.meanStdDev(hsv, mask=inside)
+        dark = cv2.countNonZero(cv2.bitwise_and(cv2.inRange(hsv, black_min, black_max), inside))
+        # круговое среднее тона: по гистограмме H внутри эллипса (180 значений) — без cos/sin на пиксель
+        hue = np.bincount(hsv[..., 0][inside > 0], minlength=180)[:180] / pixels
+        h_cos, h_sin = float(hue @ HUE_COS), float(hue @ HUE_SIN)
+
+        major, minor = max(ax, ay), min(ax, ay)
+        out[k] = ([major, minor, minor / max(major, 1), len(spot_areas),
+                   float(spot_areas.sum()), float(spot_areas.max()) if len(spot_areas) else 0.0]
+                  + hist.tolist() + [h_cos, h_sin, 1.0 - float(np.hypot(h_cos, h_sin))]
+                  + mean.ravel()[1:].tolist() + std.ravel()[1:].tolist() + [dark / pixels])
+    return out
+
+
+class FeatureCache:
+    """
+    Признаки кадров (JSONL: строка — кадр). Запись годна, пока не изменились
+    файл кадра, параметры детектора, эталон и версия признаков.
+    """
+
+    def __init__(self, path: str, context: dict):
+        self.path = path
+        self.context = hashlib.sha1(json.dumps(context, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        self.entries = {}
+        self.hits = self.misses = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+                    except Exception:
+                        continue  # недописанная строка (обучение прервали)
+        self.file = None
+
+    def key(self, image_path: str) -> str:
+        st = os.stat(image_path)
+        return f"{os.path.abspath(image_path)}|{st.st_size}|{st.st_mtime_ns}|{self.context}"
+
+    def get(self, image_path: str, compute) -> tuple[np.ndarray, list[int]]:
+        """(признаки эллипсов, зоны эллипсов) кадра — из кеша или compute(image_path)."""
+        key = self.key(image_path)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return np.array(entry["features"], dtype=np.float32).reshape(-1, len(FEATURE_NAMES)), entry["zones"]
+        self.misses += 1
+        features, zones = compute(image_path)
+        entry = {"key": key, "features": features.tolist(), "zones": zones}
+        self.entries[key] = entry
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(json.dumps(entry) + "\n")
+        return features, zones
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# ============================================================
+#  МОДЕЛЬ В РАБОЧЕЙ ПРОГРАММЕ
+# ============================================================
+
+def meta_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+class LearnedClassifier:
+    """Модель cv2.ml + нормировка признаков. verdict() — решение по кадру."""
+
+    def __init__(self, model, meta: dict):
+        self.model = model
+        self.meta = meta
+        self.mean = np.array(meta["mean"], dtype=np.float32)
+        self.scale = np.array(meta["scale"], dtype=np.float32)
+
+    @classmethod
+    def load(cls, path: str) -> "LearnedClassifier":
+        with open(meta_path(path), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("feature_version") != FEATURE_VERSION or meta.get("features") != FEATURE_NAMES:
+            raise ValueError("модель обучена на других признаках — переобучите её")
+        loader = cv2.ml.SVM_load if meta["model"] == "svm" else cv2.ml.RTrees_load
+        return cls(loader(path), meta)
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Классы (OK / REJECT) для строк признаков — один вызов модели на все эллипсы."""
+        if len(features) == 0:
+            return np.zeros(0, dtype=np.int32)
+        _, out = self.model.predict((features - self.mean) / self.scale)
+        return out.ravel().astype(np.int32)
+
+    def verdict(self, img: np.ndarray, result: dict, params: dict, deadline: Deadline | None = None) -> int:
+        """
+        Код для ПЛК: 0 — эллипсов нет, 2 — модель отклонила хотя бы один, иначе 1.
+        Индексы отклонённых эллипсов кладутся в result["rejected"].
+        deadline — бюджет изделия: признаки и predict() не начинаются после него (AnalysisTimeout).
+        """
+        if not result["ellipses"]:
+            result["rejected"] = []
+            return 0
+        features = product_features(img, result, params, deadline)
+        if deadline is not None:
+            deadline.check("classifier")
+        labels = self.predict(features)
+        result["rejected"] = np.flatnonzero(labels == REJECT).tolist()
+        return REJECT if result["rejected"] else OK
+
+
+# ============================================================
+#  ОБУЧЕНИЕ (офлайн)
+# ============================================================
+
+def read_labels(folder: str) -> dict:
+    """labels.csv папки брака: имя кадра -> номера бракованных зон (0..3)."""
+    path = os.path.join(folder, LABELS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {r["frame"]: {int(z) - 1 for z in r["zones"].split()} for r in csv.DictReader(f)}
+
+
+def collect(folders: list[tuple[str, int]], params: dict, reference, cache: FeatureCache
+            ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Признаки, классы и номер кадра (для разбиения) всех эллипсов размеченных папок."""
+    zones = detection_zones(params)
+
+    def compute(path: str) -> tuple[np.ndarray, list[int]]:
+        frame = cv2.imread(path)
+        if frame is None:
+            return np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32), []
+        result = analyze_product(frame, params, reference=reference)
+        return (product_features(crop_zone(frame, params), result, params),
+                [ellipse_zone(e, zones, params['Zone Radius']) for e in result["ellipses"]])
+
+    xs, ys, groups = [], [], []
+    image = 0
+    for folder, label in folders:
+        labels = read_labels(folder) if label == REJECT else {}
+        for path in list_images([folder]):
+            features, ell_zones = cache.get(path, compute)
+            marked = labels.get(os.path.basename(path))
+            for row, zone in zip(features, ell_zones):
+                xs.append(row)
+                ys.append(label if marked is None else (REJECT if zone in marked else OK))
+                groups.append(image)
+            image += 1
+    if not xs:
+        return np.zeros((0, len(FEATURE_NAMES)), np.float32), np.zeros(0, np.int32), np.zeros(0, np.int32)
+    return np.array(xs, dtype=np.float32), np.array(ys, dtype=np.int32), np.array(groups, dtype=np.int32)
+
+
+def create_model(kind: str):
+    if kind == "svm":
+        model = cv2.ml.SVM_create()
+        model.setType(cv2.ml.SVM_C_SVC)
+        model.setKernel(cv2.ml.SVM_RBF)
+        return model
+    model = cv2.ml.RTrees_create()
+    model.setMaxDepth(8)
+    model.setMinSampleCount(2)
+    model.setTermCriteria((cv2.TERM_CRITERIA_MAX_ITER + cv2.TERM_CRITERIA_EPS, 100, 0.01))
+    return model
+
+
+def train(kind: str, x: np.ndarray, y: np.ndarray, mean: np.ndarray, scale: np.ndarray):
+    model = create_model(kind)
+    samples, responses = (x - mean) / scale, y.reshape(-1, 1)
+    if kind == "svm":
+        model.trainAuto(samples, cv2.ml.ROW_SAMPLE, responses)   # подбор C и gamma кросс-валидацией
+    else:
+        model.train(samples, cv2.ml.ROW_SAMPLE, responses)
+    return model
+
+
+def evaluate(model, x: np.ndarray, y: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> dict:
+    """Точность и ошибки по изделиям: годное в брак (false_reject) и брак в годные (missed)."""
+    if len(x) == 0:
+        return {}
+    _, out = model.predict((x - mean) / scale)
+    pred = out.ravel().astype(np.int32)
+    return {"n": int(len(y)), "accuracy": round(float((pred == y).mean()), 4),
+            "false_reject": int(((pred == REJECT) & (y == OK)).sum()),
+            "missed": int(((pred == OK) & (y == REJECT)).sum())}
+
+
+# ---------- ОСНОВНАЯ ЛОГИКА ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение классификатора ОК/брак халвы (cv2.ml)")
+    parser.add_argument("--ok", action="append", default=[], help="папка кадров с годными изделиями")
+    parser.add_argument("--reject", action="append", default=[], help="папка кадров с браком (+ labels.csv)")
+    parser.add_argument("-o", "--output", default="halva_classifier.yml", help="файл модели")
+    parser.add_argument("--model", choices=("rtrees", "svm"), default="rtrees")
+    parser.add_argument("--params", help="параметры детектора (halva_params.json рабочей программы)")
+    parser.add_argument("--reference", help="эталон (halva_reference.npy), если пятна ищутся по нему")
+    parser.add_argument("--cache", default=CACHE_FILE, help="кеш признаков (JSONL)")
+    args = parser.parse_args()
+    if not args.ok or not args.reject:
+        parser.error("нужны и --ok, и --reject")
+    if not hasattr(cv2, "ml"):
+        print(f"❌ В OpenCV {cv2.__version__} нет модуля ml (в OpenCV 5 он в opencv-contrib-python)")
+        sys.exit(1)
+
+    params = dict(DEFAULT_PARAMS)
+    if args.params:
+        # только чтение: файл и журнал версий рабочей программы не трогаем
+        try:
+            params = read_params_file(args.params)[1]
+        except (OSError, ValueError) as e:
+            print(f"❌ Параметры {args.params} не прочитаны: {e}")
+            sys.exit(1)
+    reference = None
+    context = {"features": FEATURE_VERSION, "params": params, "reference": None}
+    if args.reference:
+        reference = ReferenceModel.load(args.reference)
+        context["reference"] = [os.path.abspath(args.reference), os.stat(args.reference).st_mtime_ns]
+
+    t0 = time.perf_counter()
+    cache = FeatureCache(args.cache, context)
+    try:
+        x, y, groups = collect([(f, OK) for f in args.ok] + [(f, REJECT) for f in args.reject],
+                               params, reference, cache)
+    finally:
+        cache.close()
+    print(f"🧮 Признаки: изделий {len(y)} (годных {int((y == OK).sum())}, брака {int((y == REJECT).sum())}), "
+          f"кадров из кеша {cache.hits}, посчитано {cache.misses}, {time.perf_counter() - t0:.1f} с")
+    if len(set(y.tolist())) < 2:
+        print("❌ Нужны изделия обоих классов")
+        sys.exit(1)
+
+    mean = x.mean(axis=0)
+    scale = np.where(x.std(axis=0) > 1e-6, x.std(axis=0), 1.0).astype(np.float32)
+
+    # проверка на отложенных кадрах (все изделия кадра — в одной части)
+    rng = np.random.default_rng(0)
+    images = np.unique(groups)
+    held = np.isin(groups, rng.choice(images, max(1, int(len(images) * HOLDOUT)), replace=False))
+    stats = {}
+    if (~held).any() and len(set(y[~held].tolist())) == 2:
+        stats = evaluate(train(args.model, x[~held], y[~held], mean, scale), x[held], y[held], mean, scale)
+        print(f"📊 Отложенные кадры: изделий {stats['n']}, точность {stats['accuracy'] * 100:.1f}%, "
+              f"годных в брак {stats['false_reject']}, брака в годные {stats['missed']}")
+
+    # итоговая модель — на всех изделиях
+    t0 = time.perf_counter()
+    model = train(args.model, x, y, mean, scale)
+    model.save(args.output)
+    meta = {"model": args.model, "feature_version": FEATURE_VERSION, "features": FEATURE_NAMES,
+            "mean": mean.tolist(), "scale": scale.tolist(), "samples": int(len(y)),
+            "rejects": int((y == REJECT).sum()), "holdout": stats,
+            "defect_detector": "reference" if reference is not None else "hsv",
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"), "params": params}
+    with open(meta_path(args.output), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+
+    t1 = time.perf_counter()
+    for _ in range(1000):
+        model.predict((x[:3] - mean) / scale)
+    print(f"✅ Модель {args.output} ({args.model}): обучение {t1 - t0:.2f} с, "
+          f"оценка кадра из 3 изделий {(time.perf_counter() - t1) * 1000:.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,709 @@
+"""
+halva_detector.py
+Детектор дефектов халвы: поиск эллипсов изделий и чёрных пятен.
+
+Общий код для настроечной программы (CV1.2.3.3 perebor foto.py)
+и рабочей программы (itog prog.py).
+
+Режим пирамиды: эллипсы ищутся на уменьшенной копии кадра
+(по умолчанию 1/4), геометрия пересчитывается в полное разрешение,
+а чёрные пятна ищутся только внутри эллипсов в полном разрешении.
+
+Дефекты возвращаются в виде массивов (площадь, рамка, центр, эллипс, зона)
+без рисования; оверлей рисуется отдельно (draw_defects / render_overlay)
+и только когда его кто-то смотрит.
+
+Параллельный режим: пятна ищутся в ROI каждого эллипса отдельно
+на пуле потоков (OpenCV отпускает GIL), число внутренних потоков
+OpenCV задаётся явно через configure_threads().
+
+Поиск пятен по эталону годных изделий (вместо порогов LHBlack..UVBlack) —
+analyze_product(reference=...), см. halva_reference.py.
+
+Бюджет времени: analyze_product(deadline=...) сверяется с дедлайном
+после каждой стадии и бросает AnalysisTimeout с именем стадии.
+
+Проверка качества (pick_best_frame): до полного анализа каждый из последних
+кадров оценивается на уменьшенной копии (<1 мс на кадр) — резкость
+(дисперсия лапласиана), экспозиция, изделие в зонах детекции; на анализ
+идёт лучший годный кадр.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import cv2
+import numpy as np
+
+# === Глобальные константы ===
+color_red = (0, 0, 255)     # Красный цвет для отметки ошибок
+color_green = (0, 255, 0)   # Зелёный цвет для выделения зон
+
+PYRAMID_SCALE = 4           # во сколько раз уменьшать кадр при поиске эллипсов
+MIN_SPOT_AREA = 10          # минимальная площадь чёрного пятна (cv2.contourArea внешнего контура)
+QUALITY_SCALE = 4           # во сколько раз уменьшать кадр при проверке качества
+CLIPPED_LEVEL = 250         # яркость пересвеченного пикселя
+
+# Пороги проверки качества кадра по умолчанию
+DEFAULT_QUALITY_LIMITS = {
+    'min_sharpness': 50.0,      # дисперсия лапласиана уменьшенного кадра (смаз/расфокус — ниже)
+    'min_brightness': 30.0,     # средняя яркость зоны обрезки
+    'max_brightness': 230.0,
+    'max_clipped': 0.05,        # доля пересвеченных пикселей
+    'min_zones': 1,             # зон детекции, закрытых изделием (наполовину вошедшее — не закрывает)
+}
+
+# Параметры детектора по умолчанию (совпадают с начальными значениями трекбаров)
+DEFAULT_PARAMS = {
+    'LH': 0, 'LS': 0, 'LV': 51, 'UH': 220, 'US': 155, 'UV': 255,
+    'Zone X': 800, 'Zone Y': 61, 'Zone Width': 1000, 'Zone Height': 1500,
+    'Min Radius': 110, 'Max Radius': 160,
+    'X1': 264, 'Y1': 318, 'X2': 528, 'Y2': 135,
+    'X3': 352, 'Y3': 562, 'X4': 670, 'Y4': 420,
+    'Zone Radius': 53,
+    'Show Zones': 1,
+    'LHBlack': 0, 'LSBlack': 0, 'LVBlack': 8,
+    'UHBlack': 24, 'USBlack': 121, 'UVBlack': 73,
+}
+
+# Допустимые диапазоны параметров (как у трекбаров настроечной программы)
+PARAM_LIMITS = {name: (0, 255) for name in
+                ('LH', 'LS', 'LV', 'UH', 'US', 'UV',
+                 'LHBlack', 'LSBlack', 'LVBlack', 'UHBlack', 'USBlack', 'UVBlack')}
+PARAM_LIMITS.update({name: (0, 1500) for name in
+                     ('Zone X', 'Zone Y', 'Zone Width', 'Zone Height',
+                      'X1', 'Y1', 'X2', 'Y2', 'X3', 'Y3', 'X4', 'Y4')})
+PARAM_LIMITS.update({'Min Radius': (0, 300), 'Max Radius': (0, 300),
+                     'Zone Radius': (0, 500), 'Show Zones': (0, 1)})
+
+
+def validate_params(params: dict) -> list[str]:
+    """
+    Проверяет полный набор параметров детектора.
+    Возвращает список ошибок (пустой — набор годен).
+    """
+    errors = []
+    for name, (lo, hi) in PARAM_LIMITS.items():
+        if name not in params:
+            errors.append(f"нет параметра '{name}'")
+            continue
+        value = params[name]
+        if not isinstance(value, int) or isinstance(value, bool):
+            errors.append(f"'{name}' должен быть целым числом")
+        elif not lo <= value <= hi:
+            errors.append(f"'{name}' = {value} вне диапазона {lo}..{hi}")
+    for name in params:
+        if name not in PARAM_LIMITS:
+            errors.append(f"неизвестный параметр '{name}'")
+    if errors:
+        return errors
+
+    for suffix in ('', 'Black'):
+        for c in 'HSV':
+            if params['L' + c + suffix] > params['U' + c + suffix]:
+                errors.append(f"L{c}{suffix} больше U{c}{suffix}")
+    if params['Min Radius'] > params['Max Radius']:
+        errors.append("Min Radius больше Max Radius")
+    if params['Zone Width'] == 0 or params['Zone Height'] == 0:
+        errors.append("пустая зона обрезки")
+    return errors
+
+
+# === Бюджет времени на изделие ===
+class AnalysisTimeout(Exception):
+    """Бюджет времени на изделие исчерпан на стадии stage."""
+
+    def __init__(self, stage: str, elapsed: float, budget: float):
+        super().__init__(f"стадия '{stage}': {elapsed * 1000:.0f} мс при бюджете {budget * 1000:.0f} мс")
+        self.stage = stage
+        self.elapsed = elapsed
+        self.budget = budget
+
+
+class Deadline:
+    """
+    Дедлайн обработки одного изделия.
+    Отсчёт идёт от создания (момент срабатывания bNewProduct) или от start —
+    time.monotonic() срабатывания, если дедлайн создаётся в другом потоке.
+    budget <= 0 — без ограничения.
+    """
+
+    def __init__(self, budget: float, start: float | None = None):
+        self.budget = budget
+        self.start = time.monotonic() if start is None else start
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> float | None:
+        """Оставшееся время в секундах (None — без ограничения)."""
+        if self.budget <= 0:
+            return None
+        return max(self.budget - self.elapsed(), 0.0)
+
+    def check(self, stage: str) -> None:
+        """Бросает AnalysisTimeout, если стадия stage завершилась после дедлайна."""
+        if self.budget > 0 and self.elapsed() > self.budget:
+            raise AnalysisTimeout(stage, self.elapsed(), self.budget)
+
+
+# === Потоки OpenCV и пул анализа ===
+def configure_threads(cv_threads: int, pool_size: int) -> ThreadPoolExecutor | None:
+    """
+    Явно задаёт число внутренних потоков OpenCV (cv2.setNumThreads)
+    и создаёт пул для анализа эллипсов. pool_size = 0 — последовательный режим.
+    Возвращает пул (или None), его передают в analyze_product(pool=...).
+    """
+    cv2.setNumThreads(cv_threads)
+    if pool_size <= 0:
+        return None
+    return ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="halva-roi")
+
+
+# === Разбор словаря параметров ===
+def crop_rect(params: dict) -> tuple[int, int, int, int]:
+    """Зона обрезки кадра (x, y, w, h)."""
+    return params['Zone X'], params['Zone Y'], params['Zone Width'], params['Zone Height']
+
+
+def crop_zone(frame: np.ndarray, params: dict) -> np.ndarray:
+    """Обрезает кадр по зоне обрезки (без копирования)."""
+    x, y, w, h = crop_rect(params)
+    return frame[y:y + h, x:x + w]
+
+
+def detection_zones(params: dict) -> list[tuple[int, int]]:
+    """Центры зон детекции X1..Y4 в координатах обрезанного кадра."""
+    return [(params['X1'], params['Y1']), (params['X2'], params['Y2']),
+            (params['X3'], params['Y3']), (params['X4'], params['Y4'])]
+
+
+def hsv_bounds(params: dict, suffix: str = '') -> tuple[np.ndarray, np.ndarray]:
+    """HSV диапазон: suffix='' — цвет изделия, suffix='Black' — чёрные пятна."""
+    lower = np.array([params['L' + c + suffix] for c in 'HSV'], np.uint8)
+    upper = np.array([params['U' + c + suffix] for c in 'HSV'], np.uint8)
+    return lower, upper
+
+
+# === Поиск эллипсов по маске ===
+def fit_zone_ellipses(
+    mask: np.ndarray,
+    zones: list[tuple[int, int]],
+    zone_radius: int,
+    max_circles: int = 3,
+    scale: float = 1.0,
+    deadline: Deadline | None = None
+) -> list[tuple[int, int, int, int, int]]:
+    """
+    Аппроксимирует контуры маски эллипсами и оставляет те, чей центр попал в зону.
+    scale — во сколько раз маска меньше исходного кадра: геометрия эллипсов
+    пересчитывается в координаты полного разрешения.
+    deadline — на шумной маске с тысячами контуров проверяется каждые 256 контуров.
+    """
+    ellipses = []
+    # Поиск контуров на бинарной маске
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if deadline is not None:
+        deadline.check("contours")
+
+    for i, cnt in enumerate(contours):
+        if deadline is not None and i % 256 == 255:
+            deadline.check("fit_ellipse")
+        if len(cnt) < 5:
+            continue  # Недостаточно точек для аппроксимации эллипса
+
+        (cx, cy), axes, angle = cv2.fitEllipse(cnt)  # Аппроксимация контуров эллипсом
+        if scale != 1.0:
+            # центр пикселя уменьшенного кадра -> центр блока пикселей полного кадра
+            cx = (cx + 0.5) * scale - 0.5
+            cy = (cy + 0.5) * scale - 0.5
+            axes = (axes[0] * scale, axes[1] * scale)
+
+        # Проверка попадания центра в одну из зон
+        for zx, zy in zones:
+            if (cx - zx) ** 2 + (cy - zy) ** 2 <= zone_radius ** 2:
+                ellipses.append((int(cx), int(cy), int(axes[0] * 0.65), int(axes[1] * 0.7), int(angle)))
+                break
+
+    # Сортировка по размеру и выбор максимальных N эллипсов
+    return sorted(ellipses, key=lambda c: c[3], reverse=True)[:max_circles]
+
+
+def locate_ellipses(
+    img: np.ndarray,
+    hsv_min: np.ndarray,
+    hsv_max: np.ndarray,
+    zones: list[tuple[int, int]],
+    zone_radius: int,
+    max_circles: int = 3,
+    scale: int = 1,
+    deadline: Deadline | None = None
+) -> list[tuple[int, int, int, int, int]]:
+    """
+    Находит эллипсы изделий на обрезанном кадре.
+    При scale > 1 порог и контуры считаются на кадре, уменьшенном в scale раз
+    (INTER_AREA), результат возвращается в координатах полного разрешения.
+    """
+    if scale > 1:
+        h, w = img.shape[:2]
+        img = cv2.resize(img, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, hsv_min, hsv_max)
+    if deadline is not None:
+        deadline.check("threshold")
+    return fit_zone_ellipses(mask, zones, zone_radius, max_circles, float(scale), deadline)
+
+
+# === Поиск и отрисовка эллипсов в заданных зонах ===
+def find_and_draw_largest_ellipses(
+    img: np.ndarray,
+    img_clean: np.ndarray,
+    mask: np.ndarray,
+    zones: list[tuple[int, int]],
+    zone_radius: int,
+    min_r: int = 110,
+    max_r: int = 160,
+    max_circles: int = 3
+) -> tuple[np.ndarray, list[tuple[int, int, int, int, int]]]:
+    """
+    Находит эллипсы в заданных зонах по маске и рисует центры на изображении.
+    Возвращает обновлённое изображение и список найденных эллипсов.
+    """
+    ellipses = fit_zone_ellipses(mask, zones, zone_radius, max_circles)
+    draw_ellipse_centers(img_clean, ellipses)
+    return img_clean, ellipses
+
+
+def draw_ellipse_centers(img: np.ndarray, ellipses: list[tuple[int, int, int, int, int]]) -> np.ndarray:
+    """Отрисовка центров эллипсов."""
+    for (cx, cy, axes1, axes2, angle) in ellipses:
+        cv2.circle(img, (cx, cy), 2, color_green, -1)
+        cv2.putText(img, "cen", (cx - 25, cy - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color_green, 2)
+    return img
+
+
+# === Сравнение двух наборов эллипсов (полное разрешение vs пирамида) ===
+def compare_ellipses(
+    reference: list[tuple[int, int, int, int, int]],
+    candidate: list[tuple[int, int, int, int, int]],
+    tolerance_px: float = 10.0
+) -> dict:
+    """
+    Сопоставляет эллипсы candidate с эталонными reference по ближайшему центру.
+    Совпадением считается центр не дальше tolerance_px.
+    Возвращает число совпавших/пропущенных/лишних и ошибки центров и осей в пикселях.
+    """
+    free = list(candidate)
+    center_err, axis_err = [], []
+    matched = 0
+    for (rx, ry, rax, ray, _) in reference:
+        if not free:
+            break
+        dists = [np.hypot(cx - rx, cy - ry) for (cx, cy, *_rest) in free]
+        k = int(np.argmin(dists))
+        if dists[k] <= tolerance_px:
+            _, _, cax, cay, _ = free.pop(k)
+            matched += 1
+            center_err.append(dists[k])
+            axis_err.append(max(abs(cax - rax), abs(cay - ray)))
+
+    return {
+        "matched": matched,
+        "missed": len(reference) - matched,
+        "extra": len(free),
+        "center_err_max": float(max(center_err, default=0.0)),
+        "center_err_mean": float(np.mean(center_err)) if center_err else 0.0,
+        "axis_err_max": max(axis_err, default=0),
+    }
+
+
+# === Белая заливка области вне найденных эллипсов ===
+def white_mask_outside_ellipses(img: np.ndarray, ellipses: list[tuple[int, int, int, int, int]]) -> np.ndarray:
+    """
+    Оставляет внутри эллипсов исходное изображение, остальное заменяет белым цветом.
+    Пиксели внутри эллипсов не меняются — и чёрные тоже (раньше нулевые каналы
+    внутри эллипса белели, и совсем чёрное пятно пропадало): пятна здесь
+    и в extract_defects(ellipses=...) рабочей программы одни и те же.
+    """
+    mask = np.full(img.shape[:2], 255, dtype=np.uint8)
+    for (cx, cy, ax, ay, angle) in ellipses:
+        cv2.ellipse(mask, (cx, cy), (ax, ay), angle, 0, 360, 0, -1)
+
+    result = img.copy()
+    result[mask > 0] = 255
+    return result
+
+
+# === Структурированный поиск чёрных пятен ===
+def ellipse_zone(ellipse: tuple[int, int, int, int, int], zones: list[tuple[int, int]], zone_radius: int) -> int:
+    """Номер зоны, в которую попал центр эллипса, или -1."""
+    cx, cy = ellipse[0], ellipse[1]
+    for k, (zx, zy) in enumerate(zones):
+        if (cx - zx) ** 2 + (cy - zy) ** 2 <= zone_radius ** 2:
+            return k
+    return -1
+
+
+def empty_defects() -> dict:
+    """Пустой результат поиска пятен (в том же формате, что extract_defects)."""
+    return {
+        "area": np.zeros(0, dtype=np.int32),
+        "bbox": np.zeros((0, 4), dtype=np.int32),
+        "centroid": np.zeros((0, 2), dtype=np.float64),
+        "ellipse": np.zeros(0, dtype=np.int32),
+        "zone": np.zeros(0, dtype=np.int32),
+    }
+
+
+def spot_areas(mask: np.ndarray, labels: np.ndarray, stats: np.ndarray, min_area: int) -> np.ndarray:
+    """
+    Площадь компонент (индекс — метка, 0 — фон) так, как её всегда считала
+    настроечная программа: cv2.contourArea внешнего контура. Для мелких пятен
+    она заметно меньше числа пикселей, порог MIN_SPOT_AREA подобран под неё.
+    0 — компоненты, которые заведомо не больше min_area (по рамке), и пятна
+    внутри дыр других пятен (внешнего контура у них нет, раньше их тоже не видели).
+    """
+    areas = np.zeros(len(stats), dtype=np.float64)
+    # контур идёт по центрам крайних пикселей: его площадь не больше (w - 1) * (h - 1)
+    big = (stats[:, cv2.CC_STAT_WIDTH] - 1) * (stats[:, cv2.CC_STAT_HEIGHT] - 1) > min_area
+    big[0] = False
+    if not big.any():
+        return areas
+    if not big[1:].all():
+        # мелочь (шум) убираем до контуров — цикл ниже идёт только по кандидатам
+        mask = big.astype(np.uint8)[labels] * np.uint8(255)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for cnt in contours:
+        x, y = cnt[0, 0]
+        areas[labels[y, x]] = cv2.contourArea(cnt)
+    return areas
+
+
+def extract_defects(
+    img: np.ndarray,
+    lower_black: np.ndarray,
+    upper_black: np.ndarray,
+    ellipses: list[tuple[int, int, int, int, int]] | None = None,
+    zones: list[tuple[int, int]] | None = None,
+    zone_radius: int = 0,
+    min_area: int = MIN_SPOT_AREA
+) -> dict:
+    """
+    Ищет чёрные пятна через cv2.connectedComponentsWithStats, ничего не рисует.
+    Если заданы эллипсы — учитываются только пиксели внутри них, все, включая
+    совсем чёрные (как после white_mask_outside_ellipses, но без копии кадра).
+    Возвращает словарь массивов длины N (по одному элементу на пятно):
+      area     — площадь пятна (int32, см. spot_areas)
+      bbox     — рамка x, y, w, h (N x 4, int32)
+      centroid — центр масс x, y (N x 2, float64)
+      ellipse  — индекс эллипса в списке ellipses или -1
+      zone     — номер зоны X1..X4 (0..3) или -1
+    """
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, lower_black, upper_black)
+
+    owner = None
+    if ellipses is not None:
+        # карта принадлежности: 0 — вне эллипсов, k + 1 — внутри эллипса k
+        owner = np.zeros(img.shape[:2], dtype=np.uint8)
+        for k, (cx, cy, ax, ay, angle) in enumerate(ellipses):
+            cv2.ellipse(owner, (cx, cy), (ax, ay), angle, 0, 360, k + 1, -1)
+        mask = cv2.bitwise_and(mask, mask, mask=owner)
+
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    # нулевая компонента — фон
+    area = spot_areas(mask, labels, stats, min_area)[1:]
+    stats, centroids = stats[1:], centroids[1:]
+    keep = area > min_area  # Фильтр по минимальной площади
+    stats, centroids, area = stats[keep], centroids[keep], area[keep]
+
+    n = len(stats)
+    ellipse_idx = np.full(n, -1, dtype=np.int32)
+    zone_idx = np.full(n, -1, dtype=np.int32)
+    if owner is not None and n:
+        h, w = owner.shape
+        px = np.clip(np.rint(centroids[:, 0]).astype(int), 0, w - 1)
+        py = np.clip(np.rint(centroids[:, 1]).astype(int), 0, h - 1)
+        ellipse_idx = owner[py, px].astype(np.int32) - 1
+        # центр масс кольцевого пятна может выпасть из эллипса — берём ближайший
+        for i in np.flatnonzero(ellipse_idx < 0):
+            d = [(cx - centroids[i, 0]) ** 2 + (cy - centroids[i, 1]) ** 2 for (cx, cy, *_rest) in ellipses]
+            ellipse_idx[i] = int(np.argmin(d))
+        if zones:
+            ell_zone = np.array([ellipse_zone(e, zones, zone_radius) for e in ellipses], dtype=np.int32)
+            zone_idx = ell_zone[ellipse_idx]
+
+    return {
+        "area": area.astype(np.int32),
+        "bbox": stats[:, :4].astype(np.int32),
+        "centroid": centroids.astype(np.float64),
+        "ellipse": ellipse_idx,
+        "zone": zone_idx,
+    }
+
+
+def ellipse_roi(ellipse: tuple[int, int, int, int, int], shape: tuple) -> tuple[int, int, int, int]:
+    """Описанный прямоугольник повёрнутого эллипса (x, y, w, h), обрезанный по кадру."""
+    cx, cy, ax, ay, angle = ellipse
+    pts = cv2.ellipse2Poly((cx, cy), (ax, ay), angle, 0, 360, 10)
+    x, y, w, h = cv2.boundingRect(pts)
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w + 1, shape[1]), min(y + h + 1, shape[0])
+    return x0, y0, max(x1 - x0, 0), max(y1 - y0, 0)
+
+
+def _ellipse_defects(
+    img: np.ndarray,
+    k: int,
+    ellipse: tuple[int, int, int, int, int],
+    zone: int,
+    lower_black: np.ndarray,
+    upper_black: np.ndarray,
+    min_area: int
+) -> dict:
+    """Пятна внутри одного эллипса: работа идёт только в его ROI."""
+    x, y, w, h = ellipse_roi(ellipse, img.shape)
+    cx, cy, ax, ay, angle = ellipse
+    roi = img[y:y + h, x:x + w]
+    inside = np.zeros((h, w), dtype=np.uint8)
+    cv2.ellipse(inside, (cx - x, cy - y), (ax, ay), angle, 0, 360, 255, -1)
+
+    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, lower_black, upper_black)
+    mask = cv2.bitwise_and(mask, inside)
+
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    area = spot_areas(mask, labels, stats, min_area)[1:]
+    stats, centroids = stats[1:], centroids[1:]
+    keep = area > min_area
+    stats, centroids, area = stats[keep], centroids[keep], area[keep]
+
+    bbox = stats[:, :4].astype(np.int32)
+    bbox[:, 0] += x
+    bbox[:, 1] += y
+    n = len(stats)
+    return {
+        "area": area.astype(np.int32),
+        "bbox": bbox,
+        "centroid": centroids.astype(np.float64) + (x, y),
+        "ellipse": np.full(n, k, dtype=np.int32),
+        "zone": np.full(n, zone, dtype=np.int32),
+    }
+
+
+def extract_defects_parallel(
+    img: np.ndarray,
+    lower_black: np.ndarray,
+    upper_black: np.ndarray,
+    ellipses: list[tuple[int, int, int, int, int]],
+    zones: list[tuple[int, int]],
+    zone_radius: int,
+    pool: ThreadPoolExecutor | None = None,
+    min_area: int = MIN_SPOT_AREA,
+    deadline: Deadline | None = None
+) -> dict:
+    """
+    То же, что extract_defects с эллипсами, но каждый эллипс обрабатывается
+    в своём ROI и, если передан пул, — в отдельном потоке.
+    Пятно на стыке двух перекрывающихся эллипсов попадёт в оба.
+    С дедлайном ожидание результатов пула ограничено оставшимся временем.
+    """
+    jobs = [(img, k, e, ellipse_zone(e, zones, zone_radius), lower_black, upper_black, min_area)
+            for k, e in enumerate(ellipses)]
+    if pool is None:
+        parts = []
+        for job in jobs:
+            parts.append(_ellipse_defects(*job))
+            if deadline is not None:
+                deadline.check("defects")
+    else:
+        futures = [pool.submit(_ellipse_defects, *job) for job in jobs]
+        try:
+            parts = [f.result(timeout=None if deadline is None else deadline.remaining())
+                     for f in futures]
+        except FutureTimeout:
+            for f in futures:
+                f.cancel()
+            raise AnalysisTimeout("defects", deadline.elapsed(), deadline.budget)
+
+    if not parts:
+        return empty_defects()
+    return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+
+def defects_to_list(defects: dict) -> list[dict]:
+    """Пятна в виде списка словарей (для JSON и логов)."""
+    return [
+        {
+            "area": int(defects["area"][i]),
+            "bbox": [int(v) for v in defects["bbox"][i]],
+            "centroid": [round(float(v), 1) for v in defects["centroid"][i]],
+            "ellipse": int(defects["ellipse"][i]),
+            "zone": int(defects["zone"][i]),
+        }
+        for i in range(len(defects["area"]))
+    ]
+
+
+# === Анализ одного кадра без рисования ===
+def analyze_product(
+    frame: np.ndarray,
+    params: dict,
+    scale: int = PYRAMID_SCALE,
+    pool: ThreadPoolExecutor | None = None,
+    deadline: Deadline | None = None,
+    reference=None
+) -> dict:
+    """
+    Полный анализ кадра: обрезка, поиск эллипсов (scale > 1 — по пирамиде),
+    поиск пятен внутри эллипсов. Возвращает {'ellipses': [...], 'defects': {...},
+    'timings': {'ellipses': с, 'defects': с}}.
+    Координаты — в системе обрезанного кадра.
+    pool — пул из configure_threads(): эллипсы анализируются параллельно по ROI.
+    deadline — при превышении бюджета бросается AnalysisTimeout(stage).
+    reference — эталон (halva_reference.ReferenceModel): пятна ищутся сравнением
+    с ним, а не по порогам LHBlack..UVBlack.
+    Прервать уже идущий вызов OpenCV нельзя, поэтому проверка идёт между стадиями.
+    """
+    img = crop_zone(frame, params)
+    zones = detection_zones(params)
+    zone_r = params['Zone Radius']
+    hsv_min, hsv_max = hsv_bounds(params)
+    black_min, black_max = hsv_bounds(params, 'Black')
+
+    t0 = time.perf_counter()
+    ellipses = locate_ellipses(img, hsv_min, hsv_max, zones, zone_r, scale=scale, deadline=deadline)
+    if deadline is not None:
+        deadline.check("ellipses")
+    t1 = time.perf_counter()
+    if reference is not None:
+        defects = reference.extract_defects(img, ellipses, zones, zone_r, deadline=deadline)
+    elif pool is not None:
+        defects = extract_defects_parallel(img, black_min, black_max, ellipses, zones, zone_r,
+                                           pool, deadline=deadline)
+    else:
+        defects = extract_defects(img, black_min, black_max, ellipses, zones, zone_r)
+    if deadline is not None:
+        deadline.check("defects")
+    t2 = time.perf_counter()
+    return {"ellipses": ellipses, "defects": defects,
+            "timings": {"ellipses": t1 - t0, "defects": t2 - t1}}
+
+
+def verdict_of(result: dict) -> int:
+    """Код для ПЛК по результату analyze_product: 1 – ОК, 2 – брак, 0 – нет решения."""
+    if not result["ellipses"]:
+        return 0
+    return 2 if len(result["defects"]["area"]) > 0 else 1
+
+
+# === Проверка качества кадра до полного анализа ===
+def frame_quality(frame: np.ndarray, params: dict, scale: int = QUALITY_SCALE) -> dict:
+    """
+    Быстрые признаки кадра на зоне обрезки, уменьшенной в scale раз:
+    sharpness  — дисперсия лапласиана (смаз и расфокус её снижают);
+    brightness — средняя яркость; clipped — доля пересвеченных пикселей;
+    zones      — сколько зон детекции хотя бы наполовину закрыто цветом изделия
+                 (квадрат со стороной 2 * Zone Radius вокруг центра зоны).
+    """
+    img = crop_zone(frame, params)
+    h, w = img.shape[:2]
+    # INTER_LINEAR в 3-4 раза быстрее INTER_AREA, а смаз различает не хуже
+    small = cv2.resize(img, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_LINEAR)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    hsv_min, hsv_max = hsv_bounds(params)
+    mask = cv2.inRange(cv2.cvtColor(small, cv2.COLOR_BGR2HSV), hsv_min, hsv_max)
+    r = max(1, params['Zone Radius'] // scale)
+    zones = 0
+    for zx, zy in detection_zones(params):
+        cx, cy = zx // scale, zy // scale
+        roi = mask[max(0, cy - r):cy + r, max(0, cx - r):cx + r]
+        if roi.size and cv2.countNonZero(roi) * 2 >= roi.size:
+            zones += 1
+
+    return {"sharpness": round(float(cv2.Laplacian(gray, cv2.CV_32F).var()), 1),
+            "brightness": round(float(cv2.mean(gray)[0]), 1),
+            "clipped": round(cv2.countNonZero(cv2.inRange(gray, CLIPPED_LEVEL, 255)) / gray.size, 4),
+            "zones": zones}
+
+
+def quality_problems(quality: dict, limits: dict) -> list[str]:
+    """Почему кадр не годится для анализа (пустой список — годится)."""
+    problems = []
+    if quality["sharpness"] < limits['min_sharpness']:
+        problems.append(f"смаз: резкость {quality['sharpness']} < {limits['min_sharpness']}")
+    if not limits['min_brightness'] <= quality["brightness"] <= limits['max_brightness']:
+        problems.append(f"экспозиция: яркость {quality['brightness']} вне "
+                        f"{limits['min_brightness']}..{limits['max_brightness']}")
+    if quality["clipped"] > limits['max_clipped']:
+        problems.append(f"пересвет: {quality['clipped'] * 100:.1f}% пикселей")
+    if quality["zones"] < limits['min_zones']:
+        problems.append(f"нет изделия: закрыто зон {quality['zones']} < {limits['min_zones']}")
+    return problems
+
+
+def pick_best_frame(
+    frames: list[np.ndarray],
+    params: dict,
+    limits: dict,
+    scale: int = QUALITY_SCALE,
+    deadline: Deadline | None = None
+) -> tuple[int | None, list[dict]]:
+    """
+    Оценивает кадры (frame_quality) и выбирает лучший годный: больше закрытых
+    изделием зон, при равенстве — резче. Возвращает (индекс или None, если
+    годных нет; оценки кадров с полем problems).
+    """
+    qualities = []
+    for frame in frames:
+        quality = frame_quality(frame, params, scale)
+        quality["problems"] = quality_problems(quality, limits)
+        qualities.append(quality)
+    if deadline is not None:
+        deadline.check("quality")
+    good = [i for i, q in enumerate(qualities) if not q["problems"]]
+    best = max(good, key=lambda i: (qualities[i]["zones"], qualities[i]["sharpness"]), default=None)
+    return best, qualities
+
+
+# === Оверлей (только для просмотра и архива) ===
+def draw_defects(img: np.ndarray, defects: dict) -> np.ndarray:
+    """Отмечает прямоугольники и площади найденных пятен."""
+    for (x, y, w, h), area in zip(defects["bbox"], defects["area"]):
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        cv2.rectangle(img, (x, y), (x + w, y + h), color_red, 2)
+        cv2.putText(img, f"{int(area)}", (x, y - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color_red, 1)
+    return img
+
+
+def render_overlay(frame: np.ndarray, params: dict, result: dict) -> np.ndarray:
+    """
+    Рисует результат analyze_product на копии обрезанного кадра:
+    контуры и центры эллипсов, рамки пятен.
+    """
+    img = crop_zone(frame, params).copy()
+    for (cx, cy, ax, ay, angle) in result["ellipses"]:
+        cv2.ellipse(img, (cx, cy), (ax, ay), angle, 0, 360, color_green, 2)
+    draw_ellipse_centers(img, result["ellipses"])
+    return draw_defects(img, result["defects"])
+
+
+def cv_handling(frame_bgr: np.ndarray) -> np.ndarray:
+    """
+    Обработка изображения для превью в браузере.
+    Сейчас пример: серый + размытие.
+    """
+    gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    return blur
+
+
+# === Обнаружение чёрных пятен (с отрисовкой, для настроечной программы) ===
+def detect_black_spot(img: np.ndarray, lower_black: np.ndarray, upper_black: np.ndarray) -> np.ndarray:
+    """
+    Ищет чёрные пятна на изображении в заданном HSV диапазоне.
+    Отмечает прямоугольники вокруг найденных пятен.
+    """
+    return draw_defects(img, extract_defects(img, lower_black, upper_black))
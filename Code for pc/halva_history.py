@@ -0,0 +1,117 @@
+"""
+halva_history.py
+Ограниченная история последних проверок с размеченными миниатюрами.
+
+- InspectionHistory хранит последние N записей (кольцо deque(maxlen=N)):
+  номер изделия, метки времени, результат, код ошибки, измерения детектора
+- Миниатюра с разметкой рисуется и кодируется в JPEG в фоновом потоке,
+  цикл обмена с ПЛК на это не тратит время
+- Очередь на отрисовку тоже ограничена: при перегрузке миниатюра
+  пропускается, а не копится, поэтому расход памяти постоянный
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from halva_detector import crop_zone, defects_to_list, render_overlay
+
+MAX_SPOTS_PER_ENTRY = 50   # сколько пятен хранить в записи (остальные только считаются)
+
+
+class InspectionHistory:
+    """Кольцо последних size проверок + фоновая отрисовка миниатюр."""
+
+    def __init__(self, size: int = 200, thumb_width: int = 480, thumb_quality: int = 70,
+                 render_queue: int = 4):
+        self.size = size
+        self.thumb_width = thumb_width
+        self.thumb_quality = thumb_quality
+        self.lock = threading.Lock()
+        self.entries = {}          # seq -> запись; порядок вставки = порядок изделий
+        self.order = deque()       # номера изделий в кольце (не длиннее size)
+        self.jobs = queue.Queue(maxsize=render_queue)
+        self.dropped_thumbs = 0
+        threading.Thread(target=self._render_loop, daemon=True, name="halva-history").start()
+
+    def add(self, seq: int, verdict: int, error: int, t_trigger: float, t_frame: float | None,
+            frame=None, params: dict | None = None, result: dict | None = None,
+            params_version: int | None = None, quality: dict | None = None) -> dict:
+        """
+        Добавляет запись о проверке изделия seq. frame/result (если есть)
+        уходят на фоновую отрисовку миниатюры. params_version — версия
+        параметров детектора, с которыми считался результат; quality —
+        оценка кадра проверкой качества (None — проверка выключена).
+        """
+        entry = {
+            "seq": seq,
+            "t_trigger": round(t_trigger, 3),
+            "t_frame": None if t_frame is None else round(t_frame, 3),
+            "t_result": round(time.time(), 3),
+            "verdict": verdict,
+            "error": error,
+            "params_version": params_version,
+            "quality": quality,
+            "ellipses": [],
+            "spots": 0,
+            "max_area": 0,
+            "defects": [],
+            "rejected": None,
+            "timings_ms": {},
+            "thumb": None,
+        }
+        if result is not None:
+            defects = result["defects"]
+            entry["ellipses"] = [list(e) for e in result["ellipses"]]
+            entry["spots"] = int(len(defects["area"]))
+            entry["max_area"] = int(defects["area"].max()) if len(defects["area"]) else 0
+            entry["defects"] = defects_to_list(defects)[:MAX_SPOTS_PER_ENTRY]
+            entry["rejected"] = result.get("rejected")   # эллипсы, отклонённые классификатором
+            entry["timings_ms"] = {k: round(v * 1000, 2) for k, v in result.get("timings", {}).items()}
+
+        with self.lock:
+            self.entries[seq] = entry
+            self.order.append(seq)
+            while len(self.order) > self.size:
+                self.entries.pop(self.order.popleft(), None)
+
+        if frame is not None and params is not None:
+            try:
+                self.jobs.put_nowait((entry, frame, params, result))
+            except queue.Full:
+                self.dropped_thumbs += 1
+        return entry
+
+    def _render_loop(self):
+        while True:
+            entry, frame, params, result = self.jobs.get()
+            try:
+                if result is not None:
+                    img = render_overlay(frame, params, result)
+                else:
+                    img = crop_zone(frame, params)
+                h, w = img.shape[:2]
+                if w > self.thumb_width:
+                    img = cv2.resize(img, (self.thumb_width, max(1, h * self.thumb_width // w)),
+                                     interpolation=cv2.INTER_AREA)
+                ok, jpeg = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), self.thumb_quality])
+                if ok:
+                    entry["thumb"] = jpeg.tobytes()
+            except Exception:
+                pass  # миниатюра не обязательна — запись остаётся без неё
+
+    def list(self, since: int = -1) -> list[dict]:
+        """Записи новее since (без миниатюр), от новых к старым."""
+        with self.lock:
+            seqs = [s for s in self.order if s > since]
+            entries = [self.entries[s] for s in reversed(seqs)]
+        return [{k: v for k, v in e.items() if k != "thumb"} | {"has_thumb": e["thumb"] is not None}
+                for e in entries]
+
+    def thumb(self, seq: int) -> bytes | None:
+        with self.lock:
+            entry = self.entries.get(seq)
+        return None if entry is None else entry["thumb"]
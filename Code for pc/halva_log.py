@@ -0,0 +1,344 @@
+"""
+halva_log.py
+Асинхронный лог: рабочие потоки не ждут диска.
+
+- log() только ставит строку в ограниченную очередь (put_nowait) —
+  печать в консоль и запись в файл делает фоновый поток пачками
+- Одинаковые сообщения в пределах окна пишутся один раз, по окончании
+  окна добавляется строка «повторено N раз»
+- Шумные источники (source="plc", "camera", ...) ограничены числом
+  строк за окно, лишние считаются и сводятся в одну строку
+- Сообщения по каждому изделию пишутся с dedup=False — они не схлопываются
+- Файл ротируется по размеру и по времени: halva_log.txt → halva_log.1.txt → ...
+- Если очередь переполнена, строка отбрасывается (это тоже считается),
+  а не блокирует вызывающий поток
+- EventLog — то же для машиночитаемых событий (JSONL: одна строка —
+  один JSON с полями t, up, ev), их разбирает log_analyzer.py
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+DEDUP_WINDOW_S = 60.0       # окно схлопывания одинаковых сообщений, с
+SOURCE_LIMIT = 20           # строк от одного источника за окно
+QUEUE_SIZE = 10000          # очередь строк на запись
+BATCH_SIZE = 500            # строк за одну запись в файл
+FLUSH_S = 0.5               # как часто сбрасывать пачку на диск, с
+MAX_BYTES = 5 * 1024 * 1024 # ротация по размеру файла
+ROTATE_S = 24 * 3600        # ротация по времени (0 — только по размеру)
+BACKUPS = 5                 # сколько старых файлов хранить
+MAX_KEYS = 1000             # предел словаря схлопывания (память постоянная)
+
+
+def format_elapsed(seconds: float) -> str:
+    """Время от старта в виде 0:00:05.123."""
+    td = str(timedelta(seconds=seconds))
+    if "." in td:
+        t_main, t_ms = td.split(".")
+        td = f"{t_main}.{t_ms[:3]}"  # миллисекунды
+    return td
+
+
+class BackgroundWriter(ABC):
+    """
+    Ограниченная очередь + фоновый поток, дописывающий пачки строк в ротируемый файл.
+    Наследник задаёт строки записи (_lines) и строку о потерях очереди (_dropped_line).
+    """
+
+    console = False
+
+    def __init__(self, path: str, start_time: float | None, max_bytes: int, rotate_s: float,
+                 backups: int, name: str):
+        self.path = path
+        self.start_time = time.time() if start_time is None else start_time
+        self.max_bytes = max_bytes
+        self.rotate_s = rotate_s
+        self.backups = backups
+        self.name = name
+
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0            # не влезли в очередь
+        self.file = None
+        self.file_opened = 0.0
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    # ---------- вызывающие потоки ----------
+
+    def _put(self, item: tuple) -> None:
+        """Поставить запись в очередь. Никогда не блокирует и не бросает исключений."""
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Дописать всё, что в очереди, и закрыть файл."""
+        if self.thread is None or self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _start(self):
+        with self.start_lock:
+            if self.thread is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self.thread = threading.Thread(target=self._writer_loop, daemon=True, name=self.name)
+                self.thread.start()
+                atexit.register(self.close)
+
+    # ---------- фоновый поток ----------
+
+    @abstractmethod
+    def _lines(self, item: tuple) -> list[str]:
+        """Строки файла для одной записи очереди."""
+
+    def _periodic(self, now: float, lines: list[str], force: bool) -> None:
+        """Раз в секунду (и при закрытии): сводки, потери очереди."""
+        if self.dropped:
+            n, self.dropped = self.dropped, 0
+            lines.append(self._dropped_line(now, n))
+
+    @abstractmethod
+    def _dropped_line(self, now: float, n: int) -> str:
+        """Строка о записях, потерянных из-за переполненной очереди."""
+
+    def _header(self) -> str:
+        """Начало нового файла (после ротации тоже)."""
+        return ""
+
+    def _rotate_if_needed(self, now: float) -> None:
+        if self.file is None:
+            return
+        too_big = self.max_bytes > 0 and self.file.tell() >= self.max_bytes
+        too_old = self.rotate_s > 0 and now - self.file_opened >= self.rotate_s
+        if not (too_big or too_old):
+            return
+        self.file.close()
+        self.file = None
+        base, ext = os.path.splitext(self.path)
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{base}.{i}{ext}"
+            if os.path.exists(src):
+                os.replace(src, f"{base}.{i + 1}{ext}")
+        if self.backups > 0:
+            os.replace(self.path, f"{base}.1{ext}")
+        else:
+            os.remove(self.path)
+
+    def _write(self, lines: list[str]) -> None:
+        if not lines:
+            return
+        text = "\n".join(lines) + "\n"
+        if self.console:
+            print(text, end="")
+        try:
+            now = time.time()
+            self._rotate_if_needed(now)
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+                self.file_opened = now
+                if self.file.tell() == 0:
+                    self.file.write(self._header())
+            self.file.write(text)
+            self.file.flush()
+        except Exception as e:
+            # если даже лог не записался — просто скажем в консоль
+            print(f"[LOG ERROR] Не удалось записать в файл {self.path}: {e}")
+            self.file = None
+
+    def _writer_loop(self):
+        last_periodic = time.time()
+        while True:
+            lines = []
+            stop = False
+            try:
+                item = self.queue.get(timeout=FLUSH_S)
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    lines.extend(self._lines(item))
+                    if len(lines) >= BATCH_SIZE:
+                        break
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            if stop or now - last_periodic >= 1.0:
+                self._periodic(now, lines, stop)
+                last_periodic = now
+            self._write(lines)
+            if stop:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+
+class AsyncLogger(BackgroundWriter):
+    """Текстовый лог: очередь строк + фоновая запись с дедупликацией и ротацией."""
+
+    def __init__(self, path: str, start_time: float | None = None, console: bool = True,
+                 dedup_window: float = DEDUP_WINDOW_S, source_limit: int = SOURCE_LIMIT,
+                 max_bytes: int = MAX_BYTES, rotate_s: float = ROTATE_S, backups: int = BACKUPS):
+        super().__init__(path, start_time, max_bytes, rotate_s, backups, "halva-log")
+        self.console = console
+        self.dedup_window = dedup_window
+        self.source_limit = source_limit
+        self.repeats = {}           # сообщение -> [начало окна, повторов подавлено]
+        self.sources = {}           # источник -> [начало окна, строк записано, строк подавлено]
+
+    def log(self, message: str, source: str | None = None, dedup: bool = True) -> None:
+        """Поставить сообщение в очередь. Никогда не блокирует и не бросает исключений."""
+        self._put((time.time(), message, source, dedup))
+
+    def _line(self, t: float, message: str) -> str:
+        return f"[{format_elapsed(t - self.start_time)}] {message}"
+
+    def _dropped_line(self, now: float, n: int) -> str:
+        return self._line(now, f"⚠ Лог: очередь переполнена, потеряно строк: {n}")
+
+    def _first_in_window(self, t: float, message: str, lines: list[str]) -> bool:
+        """Схлопывание одинаковых сообщений: True — сообщение надо писать."""
+        rep = self.repeats.get(message)
+        if rep is not None and t - rep[0] < self.dedup_window:
+            rep[1] += 1
+            return False
+        if rep is not None and rep[1] > 0:
+            # окно истекло между сводками: сводка по старому окну, а само сообщение
+            # открывает новое окно и пишется как обычно
+            lines.append(self._line(t, f"{message} — повторено {rep[1]} раз за {t - rep[0]:.0f} с"))
+            self.repeats[message] = [t, 0]
+            return True
+        if len(self.repeats) >= MAX_KEYS:
+            self._periodic(t, lines, force=True)
+        self.repeats[message] = [t, 0]
+        return True
+
+    def _lines(self, item: tuple) -> list[str]:
+        """Строки, которые надо записать для этого сообщения (часто — ни одной)."""
+        t, message, source, dedup = item
+        lines = []
+        if dedup and not self._first_in_window(t, message, lines):
+            return lines
+
+        if source is not None:
+            src = self.sources.get(source)
+            if src is None or t - src[0] >= self.dedup_window:
+                if src is not None and src[2] > 0:
+                    lines.append(self._line(t, f"⏸ {source}: подавлено {src[2]} сообщений "
+                                               f"за {t - src[0]:.0f} с"))
+                src = self.sources[source] = [t, 0, 0]
+            if src[1] >= self.source_limit:
+                src[2] += 1
+                return lines
+            src[1] += 1
+
+        lines.append(self._line(t, message))
+        return lines
+
+    def _periodic(self, now: float, lines: list[str], force: bool = False) -> None:
+        """Сводки по истёкшим окнам (или по всем при force)."""
+        for message, (t0, n) in list(self.repeats.items()):
+            if force or now - t0 >= self.dedup_window:
+                if n > 0:
+                    lines.append(self._line(now, f"{message} — повторено {n} раз за {now - t0:.0f} с"))
+                del self.repeats[message]
+        for source, (t0, _, n) in list(self.sources.items()):
+            if force or now - t0 >= self.dedup_window:
+                if n > 0:
+                    lines.append(self._line(now, f"⏸ {source}: подавлено {n} сообщений за {now - t0:.0f} с"))
+                del self.sources[source]
+        super()._periodic(now, lines, force)
+
+
+class EventLog(BackgroundWriter):
+    """
+    Машиночитаемые события (JSONL) с той же фоновой записью и ротацией.
+    emit("result", seq=12, result=1) → {"t": 1732700000.123, "up": 5.2, "ev": "result", "seq": 12, "result": 1}
+    """
+
+    def __init__(self, path: str, start_time: float | None = None,
+                 max_bytes: int = MAX_BYTES, rotate_s: float = ROTATE_S, backups: int = BACKUPS):
+        super().__init__(path, start_time, max_bytes, rotate_s, backups, "halva-events")
+
+    def emit(self, event: str, **fields) -> None:
+        """Поставить событие в очередь. Никогда не блокирует и не бросает исключений."""
+        self._put((time.time(), event, fields))
+
+    def _record(self, t: float, event: str, fields: dict) -> str:
+        record = {"t": round(t, 3), "up": round(t - self.start_time, 3), "ev": event} | fields
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+    def _lines(self, item: tuple) -> list[str]:
+        return [self._record(*item)]
+
+    def _dropped_line(self, now: float, n: int) -> str:
+        return self._record(now, "log_dropped", {"lines": n})
+
+
+class ForwardLogger:
+    """
+    Лог и события дочернего процесса (многопроцессный режим, halva_bus.py):
+    записи уходят в очередь multiprocessing, главный процесс пишет их
+    своими AsyncLogger/EventLog (forward_loop) — файлы пишет один процесс.
+    Заменяет в дочернем процессе и logger, и events.
+    Записи, не влезшие в очередь, считаются; как только место появляется,
+    в лог уходит строка о потерях (как у BackgroundWriter).
+    """
+
+    def __init__(self, q, role: str):
+        self.q = q
+        self.role = role
+        self.dropped = 0
+
+    def log(self, message: str, source: str | None = None, dedup: bool = True) -> None:
+        self._send(("log", time.time(), f"[{self.role}] {message}", source, dedup))
+
+    def emit(self, event: str, **fields) -> None:
+        self._send(("event", time.time(), event, fields | {"process": self.role}))
+
+    def _send(self, item: tuple) -> None:
+        try:
+            self.q.put_nowait(item)
+        except Exception:
+            self.dropped += 1
+            return
+        if self.dropped:
+            n, self.dropped = self.dropped, 0
+            try:
+                self.q.put_nowait(("log", time.time(),
+                                   f"[{self.role}] ⚠ Лог: очередь пересылки переполнена, потеряно записей: {n}",
+                                   None, False))
+            except Exception:
+                self.dropped += n
+
+    def close(self, timeout: float = 2.0) -> None:
+        pass
+
+
+def forward_loop(q, logger: AsyncLogger, events: EventLog) -> None:
+    """Главный процесс: переносит записи дочерних процессов в свои лог и события (поток-демон)."""
+    while True:
+        try:
+            item = q.get()
+            if item[0] == "log":
+                _, t, message, source, dedup = item
+                logger._put((t, message, source, dedup))
+            else:
+                _, t, event, fields = item
+                events._put((t, event, fields))
+        except Exception:
+            time.sleep(0.1)
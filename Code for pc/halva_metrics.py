@@ -0,0 +1,172 @@
+"""
+halva_metrics.py
+Счётчики и гистограммы рабочей программы для /metrics.
+
+- Counter   — монотонный счётчик (inc)
+- Gauge     — текущее значение (set)
+- Histogram — гистограмма с фиксированными корзинами (observe)
+
+Метки передаются именованными аргументами: observe(0.012, op="read").
+Обновление — одна блокировка и поиск корзины, можно вызывать на каждом изделии.
+Выдача: render_prometheus() (текстовый формат Prometheus) и render_json().
+"""
+
+import bisect
+import json
+import math
+import threading
+import time
+
+# корзины по умолчанию, секунды: от 1 мс до 10 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+START_TIME = time.time()
+
+
+def set_start_time(t: float) -> None:
+    """Время запуска программы для halva_uptime_seconds (дочерний процесс берёт его у главного)."""
+    global START_TIME
+    START_TIME = t
+
+
+def _escape(value) -> str:
+    """Значение метки в формате Prometheus: \\, " и перевод строки экранируются."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names: tuple, key: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _json_key(self, key: tuple) -> str:
+        return ",".join(f"{n}={v}" for n, v in zip(self.labelnames, key)) or "value"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _prometheus(self) -> list[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_label_str(self.labelnames, k)} {v}" for k, v in items]
+
+    def _json(self):
+        with self.lock:
+            return {self._json_key(k): v for k, v in self.values.items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            h = self.values.get(key)
+            if h is None:
+                # [счётчики по корзинам (+Inf последняя), сумма, количество, максимум]
+                h = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+            if value > h[3]:
+                h[3] = value
+
+    def _snapshot(self) -> list:
+        with self.lock:
+            return [(k, list(h[0]), h[1], h[2], h[3]) for k, h in self.values.items()]
+
+    def _quantile(self, counts: list, total: int, q: float) -> float:
+        """Квантиль по корзинам (линейная интерполяция внутри корзины)."""
+        rank = q * total
+        acc = 0
+        for i, c in enumerate(counts):
+            if acc + c >= rank and c > 0:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else lo
+                return lo + (hi - lo) * (rank - acc) / c
+            acc += c
+        return math.nan
+
+    def _prometheus(self) -> list[str]:
+        lines = []
+        for key, counts, total_sum, count, _ in self._snapshot():
+            acc = 0
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                le_label = 'le="' + ("+Inf" if le == math.inf else repr(le)) + '"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le_label)} {acc}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total_sum}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+    def _json(self):
+        out = {}
+        for key, counts, total_sum, count, vmax in self._snapshot():
+            out[self._json_key(key)] = {
+                "count": count,
+                "sum": round(total_sum, 6),
+                "max": round(vmax, 6),
+                # оценка по корзинам не может быть больше наблюдавшегося максимума
+                "p50": round(min(self._quantile(counts, count, 0.50), vmax), 6),
+                "p95": round(min(self._quantile(counts, count, 0.95), vmax), 6),
+                "p99": round(min(self._quantile(counts, count, 0.99), vmax), 6),
+            }
+        return out
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for m in _registry:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m._prometheus())
+    lines.append("# HELP halva_uptime_seconds Время работы программы")
+    lines.append("# TYPE halva_uptime_seconds gauge")
+    lines.append(f"halva_uptime_seconds {time.time() - START_TIME:.3f}")
+    return "\n".join(lines) + "\n"
+
+
+def render_json() -> str:
+    """Все метрики в JSON (гистограммы — с количеством, суммой и перцентилями)."""
+    data = {"uptime_s": round(time.time() - START_TIME, 3)}
+    for m in _registry:
+        data[m.name] = m._json()
+    return json.dumps(data, ensure_ascii=False, indent=1, default=lambda v: None)
@@ -0,0 +1,151 @@
+"""
+halva_params.py
+Версионированные параметры детектора с атомарной заменой на лету.
+
+- ParamStore.get() возвращает пару (версия, параметры) одной ссылкой:
+  цикл обмена с ПЛК берёт её один раз на изделие, поэтому замена
+  происходит строго между изделиями, а не посреди анализа
+- update() проверяет набор (validate_params), увеличивает версию,
+  сохраняет его в файл и дописывает в журнал версий — брак всегда
+  можно связать с параметрами, которые его дали
+- При запуске последняя сохранённая версия подхватывается из файла.
+  Если файла нет или он негодный — берутся начальные параметры под
+  следующей после журнала версией, и эта версия тоже пишется в журнал
+  (причина — в load_error); повторный набор без изменений версию не меняет
+- reload_if_changed() — для процесса, который сам параметры не меняет
+  (анализ в многопроцессном режиме): подхватывает новую версию из файла
+- read_params_file() — только чтение и проверка файла, без записи:
+  для офлайн-инструментов (эталон, классификатор), которые могут
+  запускаться на файле рабочей программы
+"""
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from halva_detector import DEFAULT_PARAMS, validate_params
+
+
+def read_params_file(path: str) -> tuple[int, dict]:
+    """
+    (версия, параметры) из файла ParamStore; параметры, которых нет в файле, — по умолчанию.
+    Ничего не пишет. Файла нет — OSError, файл негодный — ValueError (с причиной).
+    """
+    with open(path, encoding="utf-8") as f:
+        try:
+            saved = json.load(f)
+            version, params = int(saved["version"]), dict(DEFAULT_PARAMS) | saved["params"]
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"{type(e).__name__}: {e}") from e
+    errors = validate_params(params)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return version, params
+
+
+class ParamStore:
+    """Текущие параметры детектора + журнал версий."""
+
+    def __init__(self, initial: dict, path: str | None = None):
+        self.path = path
+        self.history_path = None if path is None else os.path.splitext(path)[0] + "_history.jsonl"
+        self.lock = threading.Lock()   # только для записи; чтение — без блокировки
+
+        self.mtime = None
+        self.load_error = None         # почему файл не подхватился (None — подхватился или его нет)
+        self._current = (1, MappingProxyType(dict(initial)))
+        if self.path is None:
+            return
+        saved = self._load()
+        if saved is not None:
+            self._current = saved
+            return
+        # файла нет или он негодный: начальные параметры — новая версия после последней в журнале,
+        # чтобы номера версий не повторялись, а в журнале было видно, с чем работали
+        last = self._last_record()
+        version = int(last.get("version", 0)) + 1
+        params = dict(initial)
+        changed = {k: v for k, v in params.items() if last.get("params", {}).get(k) != v} if last else {}
+        try:
+            self._save(version, params, "initial" if self.load_error is None else "fallback", changed)
+        except OSError as e:
+            self.load_error = f"{self.load_error or 'нет файла'}; не записан: {e}"
+        self._current = (version, MappingProxyType(params))
+
+    def _load(self) -> tuple[int, MappingProxyType] | None:
+        """Сохранённая версия из файла (None — файла нет или он негодный, причина — в load_error)."""
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            self.mtime = os.stat(self.path).st_mtime_ns
+            version, params = read_params_file(self.path)
+            return version, MappingProxyType(params)
+        except Exception as e:
+            self.load_error = str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}"
+        return None
+
+    def _last_record(self) -> dict:
+        """Последняя запись журнала версий ({} — журнала нет или последняя строка негодная)."""
+        try:
+            with open(self.history_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 65536))
+                lines = f.read().splitlines()
+            return json.loads(lines[-1]) if lines else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, version: int, params: dict, source: str, changed: dict) -> None:
+        """Файл параметров (атомарной заменой) + строка в журнал версий."""
+        record = {"version": version, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "source": source, "changed": changed, "params": params}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "params": params}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        with open(self.history_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def reload_if_changed(self) -> bool:
+        """Подхватить более новую версию из файла (её записал другой процесс). True — заменили."""
+        try:
+            if self.path is None or os.stat(self.path).st_mtime_ns == self.mtime:
+                return False
+        except OSError:
+            return False
+        saved = self._load()
+        if saved is None or saved[0] <= self._current[0]:
+            return False
+        self._current = saved
+        return True
+
+    def get(self) -> tuple[int, MappingProxyType]:
+        """(версия, параметры только для чтения) — одна атомарная ссылка."""
+        return self._current
+
+    def update(self, params: dict, source: str = "") -> tuple[int | None, dict, list[str]]:
+        """
+        Проверяет и применяет полный набор параметров.
+        Возвращает (новая версия, изменённые параметры, [])
+        или (None, {}, список ошибок) — тогда ничего не меняется.
+        Набор без изменений — (текущая версия, {}, []): версия и журнал не трогаются.
+        """
+        params = dict(params)
+        errors = validate_params(params)
+        if errors:
+            return None, {}, errors
+
+        with self.lock:
+            old_version, old_params = self._current
+            changed = {k: v for k, v in params.items() if old_params.get(k) != v}
+            if not changed:
+                return old_version, {}, []
+            version = old_version + 1
+            if self.path is not None:
+                self._save(version, params, source, changed)
+            # замена одной ссылкой: читатели видят либо старый, либо новый набор целиком
+            self._current = (version, MappingProxyType(params))
+        return version, changed, []
@@ -0,0 +1,302 @@
+"""
+halva_reference.py
+Поиск дефектов сравнением с эталоном годных изделий.
+
+- Эллипс изделия (геометрия из locate_ellipses, та же, что у
+  find_and_draw_largest_ellipses) выпрямляется одним warpAffine в круг
+  PATCH_SIZE x PATCH_SIZE: поворот на угол эллипса, оси — в радиус
+- Эталон — попиксельные среднее и разброс (std) яркости выпрямленных
+  годных изделий. Строится офлайн по фото годных изделий и сохраняется
+  в .npy (рядом .json с описанием: сколько изделий, параметры детектора)
+- Рабочая программа открывает эталон через np.load(mmap_mode="r"):
+  файл не читается целиком при старте, страницы подгружает ОС
+- На изделие — несколько векторных операций: warpAffine, выравнивание
+  яркости к REFERENCE_LEVEL (дрейф освещения не даёт ложных пятен),
+  absdiff со средним, сравнение с заранее посчитанным порогом
+  sigma * std + min_diff. Пятна — компоненты связности, в тех же
+  массивах, что extract_defects (оверлей, история, вердикт не меняются);
+  площадь — площадь контура (spot_areas), пересчитанная в пиксели кадра,
+  поэтому порог MIN_SPOT_AREA тот же, что у пятен по порогам HSV
+- Пятно — любое отклонение от эталона, тёмное или светлое, без порогов
+  LVBlack/UVBlack
+
+Построение эталона:
+    python halva_reference.py good_frames/ -o halva_reference.npy
+    python halva_reference.py good1/ good2/ --params halva_params.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from halva_detector import (
+    DEFAULT_PARAMS, MIN_SPOT_AREA, PYRAMID_SCALE, Deadline, crop_zone, detection_zones,
+    ellipse_zone, empty_defects, hsv_bounds, locate_ellipses, spot_areas,
+)
+from halva_params import read_params_file
+from halva_replay import list_frames
+
+PATCH_SIZE = 128            # сторона выпрямленного изделия, px
+INNER = 0.92                # доля радиуса, которая сравнивается (край — неточность подгонки эллипса)
+REFERENCE_LEVEL = 128.0     # средняя яркость, к которой выравнивается каждое изделие
+DIFF_SIGMA = 4.0            # порог: столько std от среднего эталона ...
+MIN_DIFF = 25.0             # ... плюс столько уровней яркости (после выравнивания)
+MIN_SAMPLES = 10            # меньше изделий — эталон не строится
+
+
+# ============================================================
+#  ВЫПРЯМЛЕНИЕ ИЗДЕЛИЯ
+# ============================================================
+
+def patch_transform(ellipse: tuple[int, int, int, int, int], size: int = PATCH_SIZE) -> np.ndarray:
+    """
+    Аффинная матрица 2x3 «точка круга size x size → точка кадра»:
+    круг радиуса size/2 ложится на эллипс (как его рисует cv2.ellipse).
+    """
+    cx, cy, ax, ay, angle = ellipse
+    r = size / 2
+    a = np.deg2rad(angle)
+    rot = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+    m = rot @ np.diag([ax / r, ay / r])
+    c = (size - 1) / 2
+    return np.hstack([m, [[cx - m[0, 0] * c - m[0, 1] * c], [cy - m[1, 0] * c - m[1, 1] * c]]])
+
+
+def align_patch(img: np.ndarray, ellipse: tuple[int, int, int, int, int], size: int = PATCH_SIZE
+                ) -> tuple[np.ndarray, np.ndarray]:
+    """Выпрямленное изделие (яркость, uint8 size x size) и его матрица patch_transform."""
+    m = patch_transform(ellipse, size)
+    patch = cv2.warpAffine(img, m, (size, size), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                           borderMode=cv2.BORDER_REPLICATE)
+    if patch.ndim == 3:
+        patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+    return patch, m
+
+
+def inner_disk(size: int = PATCH_SIZE, inner: float = INNER) -> np.ndarray:
+    """Маска сравниваемой части круга (uint8, 255 — внутри)."""
+    mask = np.zeros((size, size), dtype=np.uint8)
+    c = (size - 1) / 2
+    cv2.circle(mask, (int(round(c)), int(round(c))), int(size / 2 * inner), 255, -1)
+    return mask
+
+
+def level_gain(patch: np.ndarray, inside: np.ndarray) -> float:
+    """Множитель, выравнивающий среднюю яркость изделия к REFERENCE_LEVEL."""
+    level = cv2.mean(patch, mask=inside)[0]
+    return REFERENCE_LEVEL / max(level, 1.0)
+
+
+# ============================================================
+#  ЭТАЛОН
+# ============================================================
+
+def meta_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+class ReferenceModel:
+    """
+    Эталон годного изделия: среднее и std (float32, size x size).
+    load() открывает файл через memory map; порог сравнения считается
+    один раз при создании.
+    """
+
+    def __init__(self, mean: np.ndarray, std: np.ndarray, sigma: float = DIFF_SIGMA,
+                 min_diff: float = MIN_DIFF, meta: dict | None = None):
+        self.mean = mean
+        self.size = mean.shape[0]
+        self.meta = meta or {}
+        self.inside = inner_disk(self.size)
+        self.threshold = (sigma * np.asarray(std, dtype=np.float32) + np.float32(min_diff))
+
+    @classmethod
+    def load(cls, path: str, sigma: float = DIFF_SIGMA, min_diff: float = MIN_DIFF) -> "ReferenceModel":
+        """Эталон из .npy (memory map) и описание из .json рядом (если есть)."""
+        data = np.load(path, mmap_mode="r")
+        if data.ndim != 3 or data.shape[0] != 2 or data.shape[1] != data.shape[2]:
+            raise ValueError(f"{path}: ожидался массив 2 x N x N, а не {data.shape}")
+        meta = None
+        if os.path.exists(meta_path(path)):
+            with open(meta_path(path), encoding="utf-8") as f:
+                meta = json.load(f)
+        return cls(data[0], data[1], sigma, min_diff, meta)
+
+    def deviation_mask(self, img: np.ndarray, ellipse: tuple[int, int, int, int, int]
+                       ) -> tuple[np.ndarray, np.ndarray]:
+        """Маска отклонений от эталона в выпрямленном изделии (uint8) и матрица patch_transform."""
+        patch, m = align_patch(img, ellipse, self.size)
+        aligned = patch.astype(np.float32) * np.float32(level_gain(patch, self.inside))
+        diff = cv2.absdiff(aligned, self.mean)
+        mask = cv2.compare(diff, self.threshold, cv2.CMP_GT)
+        return cv2.bitwise_and(mask, self.inside), m
+
+    def extract_defects(
+        self,
+        img: np.ndarray,
+        ellipses: list[tuple[int, int, int, int, int]],
+        zones: list[tuple[int, int]],
+        zone_radius: int,
+        min_area: int = MIN_SPOT_AREA,
+        deadline: Deadline | None = None
+    ) -> dict:
+        """
+        Пятна всех эллипсов в формате extract_defects: площадь, рамка
+        и центр — в пикселях обрезанного кадра (пересчёт из выпрямленного круга).
+        """
+        parts = []
+        for k, ellipse in enumerate(ellipses):
+            mask, m = self.deviation_mask(img, ellipse)
+            _, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            # площадь — как у порогов HSV (spot_areas, площадь внешнего контура), чтобы
+            # MIN_SPOT_AREA значил одно и то же; пиксель круга в пикселях кадра — определитель матрицы
+            det = abs(np.linalg.det(m[:, :2]))
+            area = np.rint(spot_areas(mask, labels, stats, min_area / det)[1:] * det).astype(np.int32)
+            stats, centroids = stats[1:], centroids[1:]
+            keep = area > min_area
+            stats, centroids, area = stats[keep], centroids[keep], area[keep]
+
+            # рамка — описанный прямоугольник четырёх углов рамки в круге
+            x, y, w, h = (stats[:, i].astype(np.float64) for i in range(4))
+            corners = np.stack([np.stack([x, y], 1), np.stack([x + w, y], 1),
+                                np.stack([x, y + h], 1), np.stack([x + w, y + h], 1)], 1)
+            corners = corners @ m[:, :2].T + m[:, 2]
+            lo = np.floor(corners.min(axis=1)).astype(np.int32)
+            hi = np.ceil(corners.max(axis=1)).astype(np.int32)
+            n = len(area)
+            parts.append({
+                "area": area,
+                "bbox": np.hstack([lo, hi - lo]).reshape(n, 4),
+                "centroid": (centroids @ m[:, :2].T + m[:, 2]).astype(np.float64).reshape(n, 2),
+                "ellipse": np.full(n, k, dtype=np.int32),
+                "zone": np.full(n, ellipse_zone(ellipse, zones, zone_radius), dtype=np.int32),
+            })
+            if deadline is not None:
+                deadline.check("defects")
+        if not parts:
+            return empty_defects()
+        return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+
+# ============================================================
+#  ПОСТРОЕНИЕ ЭТАЛОНА (офлайн)
+# ============================================================
+
+def list_images(inputs: list[str]) -> list[str]:
+    """Файлы кадров: папки (по порядку записи, как halva_replay) и отдельные файлы."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(p for p, _ in list_frames(item))
+        else:
+            paths.append(item)
+    return paths
+
+
+def product_ellipses(frame: np.ndarray, params: dict) -> tuple[np.ndarray, list]:
+    """Обрезанный кадр и эллипсы изделий — как в analyze_product."""
+    img = crop_zone(frame, params)
+    hsv_min, hsv_max = hsv_bounds(params)
+    ellipses = locate_ellipses(img, hsv_min, hsv_max, detection_zones(params), params['Zone Radius'],
+                               scale=PYRAMID_SCALE)
+    return img, ellipses
+
+
+def build_reference(paths: list[str], params: dict, size: int = PATCH_SIZE) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Среднее и std выпрямленных изделий со всех кадров paths (одним проходом,
+    суммы в float64). Возвращает (mean, std, описание).
+    """
+    inside = inner_disk(size)
+    total = np.zeros((size, size), dtype=np.float64)
+    total_sq = np.zeros((size, size), dtype=np.float64)
+    samples = images = skipped = 0
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            skipped += 1
+            continue
+        img, ellipses = product_ellipses(frame, params)
+        if not ellipses:
+            skipped += 1
+            continue
+        images += 1
+        for ellipse in ellipses:
+            patch, _ = align_patch(img, ellipse, size)
+            aligned = patch.astype(np.float64) * level_gain(patch, inside)
+            total += aligned
+            total_sq += aligned * aligned
+            samples += 1
+
+    if samples < MIN_SAMPLES:
+        raise ValueError(f"изделий найдено {samples}, нужно хотя бы {MIN_SAMPLES}")
+    mean = total / samples
+    std = np.sqrt(np.maximum(total_sq / samples - mean * mean, 0.0))
+    meta = {"samples": samples, "images": images, "skipped": skipped, "patch_size": size,
+            "level": REFERENCE_LEVEL, "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "params": dict(params)}
+    return mean.astype(np.float32), std.astype(np.float32), meta
+
+
+def save_reference(path: str, mean: np.ndarray, std: np.ndarray, meta: dict) -> None:
+    """Эталон в .npy (2 x N x N, float32, открывается через memory map) + описание в .json."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.save(path, np.stack([mean, std]).astype(np.float32))
+    with open(meta_path(path), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+
+
+# ---------- ОСНОВНАЯ ЛОГИКА ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение эталона годного изделия халвы")
+    parser.add_argument("inputs", nargs="+", help="папки и/или файлы с кадрами годных изделий")
+    parser.add_argument("-o", "--output", default="halva_reference.npy", help="файл эталона (.npy)")
+    parser.add_argument("--params", help="параметры детектора (halva_params.json рабочей программы)")
+    parser.add_argument("--size", type=int, default=PATCH_SIZE, help="сторона выпрямленного изделия, px")
+    args = parser.parse_args()
+
+    params = dict(DEFAULT_PARAMS)
+    if args.params:
+        # только чтение: файл и журнал версий рабочей программы не трогаем
+        try:
+            params = read_params_file(args.params)[1]
+        except (OSError, ValueError) as e:
+            print(f"❌ Параметры {args.params} не прочитаны: {e}")
+            sys.exit(1)
+
+    paths = list_images(args.inputs)
+    t0 = time.perf_counter()
+    try:
+        mean, std, meta = build_reference(paths, params, args.size)
+    except ValueError as e:
+        print(f"❌ Эталон не построен: {e}")
+        sys.exit(1)
+    save_reference(args.output, mean, std, meta)
+    print(f"✅ Эталон {args.output}: изделий {meta['samples']} с {meta['images']} кадров "
+          f"(пропущено {meta['skipped']}), {time.perf_counter() - t0:.1f} с")
+
+    # самопроверка: на тех же годных кадрах пятен быть не должно
+    model = ReferenceModel.load(args.output)
+    flagged = checked = 0
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        img, ellipses = product_ellipses(frame, params)
+        if not ellipses:
+            continue
+        defects = model.extract_defects(img, ellipses, detection_zones(params), params['Zone Radius'])
+        checked += len(ellipses)
+        flagged += len(set(defects["ellipse"].tolist()))
+    print(f"🔍 Самопроверка: изделий с пятнами {flagged} из {checked} "
+          f"(на годных — ложные срабатывания, при многих поднимите DIFF_SIGMA / MIN_DIFF)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+halva_replay.py
+Воспроизведение записанных кадров вместо камеры и имитация ПЛК.
+
+- ReplaySource — источник кадров с интерфейсом cv2.VideoCapture
+  (isOpened/read/release): папка 0.png, 1.png, ... (как пишет
+  «Запись кадров.py») или видеофайл. Если рядом с кадрами лежит
+  timestamps.csv, сохраняются исходные метки времени съёмки.
+  Нечитаемый кадр пропускается (о нём сообщает on_skip), запись
+  заканчивается только когда кадры кончились (без loop).
+- SimulatedPlc — подменяет OPC UA клиент: выставляет bNewProduct на
+  каждый новый кадр, принимает iPcResult и считает пропускную
+  способность и задержку пути камера → анализ → ПЛК.
+
+Позволяет прогнать и профилировать itog prog.py на любом ПК без камеры и ПЛК.
+"""
+
+import csv
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+TIMESTAMPS_FILE = "timestamps.csv"   # файл меток времени в папке с кадрами
+DEFAULT_FPS = 10.0                   # темп, если меток времени нет
+
+
+# ============================================================
+#  ИСТОЧНИК КАДРОВ
+# ============================================================
+
+def list_frames(folder: str) -> list[tuple[str, float | None]]:
+    """
+    Список (путь к кадру, время съёмки) в порядке записи.
+    Время берётся из timestamps.csv (frame,timestamp), иначе None.
+    """
+    ts_path = os.path.join(folder, TIMESTAMPS_FILE)
+    if os.path.exists(ts_path):
+        with open(ts_path, newline="", encoding="utf-8") as f:
+            rows = [r for r in csv.DictReader(f)]
+        return [(os.path.join(folder, r["frame"]), float(r["timestamp"])) for r in rows]
+
+    names = [n for n in os.listdir(folder) if n.lower().endswith((".png", ".jpg", ".jpeg", ".bmp"))]
+    # 0.png, 1.png, ..., 10.png — сортируем по номеру, остальное по имени
+    names.sort(key=lambda n: (0, int(os.path.splitext(n)[0]), n) if os.path.splitext(n)[0].isdigit() else (1, 0, n))
+    return [(os.path.join(folder, n), None) for n in names]
+
+
+class ReplaySource:
+    """
+    Источник кадров из папки или видеофайла с интерфейсом cv2.VideoCapture.
+
+    fps = None — темп по исходным меткам времени (без меток — DEFAULT_FPS),
+    fps = 0    — как можно быстрее,
+    fps > 0    — фиксированный темп.
+    После read() в timestamp лежит исходное время съёмки кадра (unix-время),
+    для видео и папки без меток — время от начала записи.
+    on_skip(путь) — вызывается на каждый нечитаемый кадр папки (он пропускается).
+    """
+
+    def __init__(self, path: str, fps: float | None = None, loop: bool = True, on_skip=None):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.on_skip = on_skip
+        self.skipped = 0
+        self.timestamp = None
+        self.finished = False
+        self._video = None
+        self._frames = []
+        self._pos = 0
+        self._n = 0
+        self._t0_play = None
+        self._t0_rec = None
+
+        if os.path.isdir(path):
+            self._frames = list_frames(path)
+        elif os.path.isfile(path):
+            self._video = cv2.VideoCapture(path)
+
+    def isOpened(self) -> bool:
+        if self.finished:
+            return False
+        if self._video is not None:
+            return self._video.isOpened()
+        return len(self._frames) > 0
+
+    def release(self) -> None:
+        if self._video is not None:
+            self._video.release()
+
+    def _next_raw(self) -> tuple[np.ndarray | None, float]:
+        """Следующий кадр и его время съёмки (с перемоткой при loop)."""
+        if self._video is not None:
+            ret, frame = self._video.read()
+            if not ret and self.loop:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self._t0_play = None
+                ret, frame = self._video.read()
+            ts = self._video.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            return (frame if ret else None), ts
+
+        # битый файл не заканчивает запись — пропускаем; круг без единого годного кадра — конец
+        for _ in range(len(self._frames)):
+            if self._pos >= len(self._frames):
+                if not self.loop:
+                    break
+                self._pos = 0
+                self._t0_play = None
+            path, ts = self._frames[self._pos]
+            if ts is None:
+                ts = self._pos / DEFAULT_FPS
+            self._pos += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame, ts
+            self.skipped += 1
+            if self.on_skip is not None:
+                self.on_skip(path)
+        return None, 0.0
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        frame, ts = self._next_raw()
+        if frame is None:
+            self.finished = True
+            return False, None
+
+        # выдерживаем темп воспроизведения
+        now = time.monotonic()
+        if self._t0_play is None:
+            self._t0_play, self._t0_rec, self._n = now, ts, 0
+        elif self.fps is None:
+            due = self._t0_play + (ts - self._t0_rec)
+            if due > now:
+                time.sleep(due - now)
+        elif self.fps > 0:
+            due = self._t0_play + self._n / self.fps
+            if due > now:
+                time.sleep(due - now)
+        self._n += 1
+
+        self.timestamp = ts
+        return True, frame
+
+
+# ============================================================
+#  ИМИТАЦИЯ ПЛК
+# ============================================================
+
+class _SimNode:
+    """Узел TargetVars с интерфейсом opcua Node (get_value/set_value)."""
+
+    def __init__(self, plc: "SimulatedPlc", name: str):
+        self.plc = plc
+        self.name = name
+
+    def get_value(self):
+        return self.plc.get(self.name)
+
+    def set_value(self, value):
+        # safe_write передаёт ua.Variant — берём из него само значение
+        self.plc.set(self.name, getattr(value, "Value", value))
+
+
+class SimulatedPlc:
+    """
+    Имитация ПЛК для офлайн-прогона.
+    bPlcReady всегда True; bNewProduct поднимается, когда камера выдала
+    новый кадр (frame_info() -> (номер кадра, time.time() его получения)),
+    и держится до записи bStartGrab = False после iPcResult.
+    Задержка считается от получения кадра до записи iPcResult.
+    """
+
+    def __init__(self, frame_info, history: int = 1000):
+        self.frame_info = frame_info
+        self.values = {"bNewProduct": False, "bPlcReady": True, "bStartGrab": False,
+                       "iPcResult": 0, "uiPcErrorCode": 0}
+        self.nodes = {name: _SimNode(self, name) for name in self.values}
+        self.lock = threading.Lock()
+        self.last_seq = -1
+        self.frame_time = None
+        self.trigger_time = None
+        self.result_time = None
+        self.products = 0
+        self.results = {}
+        self.latencies = deque(maxlen=history)       # кадр → результат, с
+        self.cycle_times = deque(maxlen=history)     # триггер → результат, с
+        self.start_time = time.time()
+
+    # --- интерфейс opcua Client ---
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def get_node(self, node_id: str) -> _SimNode:
+        return self.nodes[node_id.rsplit(".", 1)[-1]]
+
+    # --- логика ---
+    def get(self, name: str):
+        with self.lock:
+            if name == "bNewProduct" and not self.values["bNewProduct"]:
+                seq, t_frame = self.frame_info()
+                if seq is not None and seq > self.last_seq:
+                    self.last_seq = seq
+                    self.frame_time = t_frame
+                    self.trigger_time = time.time()
+                    self.result_time = None
+                    self.values["bNewProduct"] = True
+            return self.values[name]
+
+    def set(self, name: str, value) -> None:
+        with self.lock:
+            self.values[name] = value
+            now = time.time()
+            if name == "iPcResult" and self.values["bNewProduct"]:
+                self.result_time = now
+            if name == "bStartGrab" and not value and self.result_time is not None:
+                # цикл завершён — фиксируем статистику и опускаем bNewProduct
+                self.products += 1
+                res = self.values["iPcResult"]
+                self.results[res] = self.results.get(res, 0) + 1
+                self.latencies.append(self.result_time - self.frame_time)
+                self.cycle_times.append(self.result_time - self.trigger_time)
+                self.values["bNewProduct"] = False
+                self.result_time = None
+
+    def report(self) -> str:
+        """Строка с пропускной способностью и перцентилями задержек."""
+        with self.lock:
+            dt = time.time() - self.start_time
+            lat = np.array(self.latencies) * 1000
+            cyc = np.array(self.cycle_times) * 1000
+            results = dict(self.results)
+            products = self.products
+        if products == 0:
+            return "🧪 Имитация ПЛК: изделий ещё не было"
+        return (f"🧪 Имитация ПЛК: изделий {products}, {products / dt:.2f} шт/с; "
+                f"кадр→результат p50 {np.percentile(lat, 50):.1f} мс, p95 {np.percentile(lat, 95):.1f} мс; "
+                f"триггер→результат p50 {np.percentile(cyc, 50):.1f} мс, p95 {np.percentile(cyc, 95):.1f} мс; "
+                f"результаты {results}")
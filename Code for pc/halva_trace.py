@@ -0,0 +1,217 @@
+"""
+halva_trace.py
+Трассировка каждого изделия: где ушло время от bNewProduct до результата.
+
+- Tracer.begin() на фронте bNewProduct выдаёт трассу с trace_id
+  (или None, если изделие не попало в выборку)
+- Внутри — отрезки (span): каждое чтение/запись OPC UA, ожидание
+  блокировок (locked), копия кадра, стадии анализа
+- Трассы пишутся в файл формата Chrome Trace Event (JSON-массив событий
+  «X»), который открывается в chrome://tracing или ui.perfetto.dev
+- Выборка: доля изделий sample_rate и/или все медленнее slow_ms.
+  Вне трассы span()/locked() — проверка одного thread-local поля,
+  ничего не замеряется и не пишется
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from halva_log import BACKUPS, MAX_BYTES, ROTATE_S, BackgroundWriter
+
+
+class _NoopSpan:
+    """Отрезок, когда трассы нет: ничего не делает."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "cat", "args", "t0")
+
+    def __init__(self, trace: "Trace", name: str, cat: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.t0, time.perf_counter(), self.cat, **self.args)
+        return False
+
+
+class _Locked:
+    """with tracer.locked(lock, "plc_lock"): — захват блокировки с замером ожидания."""
+
+    __slots__ = ("tracer", "lock", "name")
+
+    def __init__(self, tracer: "Tracer", lock, name: str):
+        self.tracer = tracer
+        self.lock = lock
+        self.name = name
+
+    def __enter__(self):
+        trace = getattr(self.tracer.local, "trace", None)
+        if trace is None:
+            self.lock.acquire()
+        else:
+            t0 = time.perf_counter()
+            self.lock.acquire()
+            trace.add(f"wait {self.name}", t0, time.perf_counter(), cat="lock")
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+        return False
+
+
+class Trace:
+    """
+    Отрезки одного изделия. Пишутся из потоков, где трасса активна (обмен с ПЛК,
+    анализ, пул анализа): у каждого отрезка свой поток (tid). После end()
+    новые отрезки не принимаются — поток пула, доработавший после дедлайна,
+    в записанную трассу уже не попадает.
+    """
+
+    def __init__(self, name: str, sampled: bool, **args):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.args = args
+        self.tid = threading.get_native_id()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def add(self, name: str, t0: float, t1: float, cat: str = "stage", **args) -> None:
+        """Готовый отрезок по меткам time.perf_counter() (поток — тот, который вызвал add)."""
+        span = (name, cat, t0, t1, threading.get_native_id(), args)
+        with self.lock:
+            if not self.closed:
+                self.spans.append(span)
+
+    def close(self) -> list[tuple]:
+        """Закрыть трассу для новых отрезков; отрезки на этот момент."""
+        with self.lock:
+            self.closed = True
+            return list(self.spans)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+
+
+class TraceWriter(BackgroundWriter):
+    """Фоновая запись событий Chrome Trace: файл — JSON-массив без закрывающей скобки (допускается форматом)."""
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES, rotate_s: float = ROTATE_S,
+                 backups: int = BACKUPS):
+        super().__init__(path, None, max_bytes, rotate_s, backups, "halva-trace")
+
+    def write(self, events: list[dict]) -> None:
+        self._put(events)
+
+    def _header(self) -> str:
+        return "[\n"
+
+    def _lines(self, item: list[dict]) -> list[str]:
+        return [json.dumps(e, ensure_ascii=False, default=str) + "," for e in item]
+
+    def _dropped_line(self, now: float, n: int) -> str:
+        return json.dumps({"name": "trace_dropped", "ph": "i", "s": "g", "ts": 0,
+                           "pid": os.getpid(), "args": {"traces": n}}) + ","
+
+
+class Tracer:
+    """
+    Трассировка изделий.
+    sample_rate — доля изделий, которые пишутся всегда (0 — ни одного);
+    slow_ms     — дополнительно пишется любое изделие медленнее этого (0 — не смотреть).
+    Оба 0 — трассировка выключена, begin() сразу возвращает None.
+    """
+
+    def __init__(self, path: str, sample_rate: float = 0.0, slow_ms: float = 0.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.enabled = sample_rate > 0 or slow_ms > 0
+        self.local = threading.local()
+        self.writer = TraceWriter(path) if self.enabled else None
+        self.pid = os.getpid()
+        # ts — unix-время в мкс (perf_counter со сдвигом), чтобы сопоставлять с логом и событиями
+        self.epoch_us = time.time() * 1e6 - time.perf_counter() * 1e6
+        self.written = 0
+
+    # ---------- трасса изделия ----------
+
+    def begin(self, name: str, **args) -> Trace | None:
+        """Начать трассу в текущем потоке (None — изделие не трассируется)."""
+        if not self.enabled:
+            return None
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and self.slow_ms <= 0:
+            return None
+        trace = Trace(name, sampled, **args)
+        self.local.trace = trace
+        return trace
+
+    def end(self, trace: Trace | None, **args) -> bool:
+        """Закрыть трассу; True — записана (попала в выборку или медленная)."""
+        if trace is None:
+            return False
+        self.local.trace = None
+        t1 = time.perf_counter()
+        spans = trace.close()
+        slow = self.slow_ms > 0 and (t1 - trace.t0) * 1000 >= self.slow_ms
+        if not (trace.sampled or slow):
+            return False
+        root_args = {"trace_id": trace.trace_id, "slow": slow} | trace.args | args
+        events = [self._event(trace.name, "product", trace.t0, t1, trace.tid, root_args)]
+        for name, cat, s0, s1, tid, span_args in spans:
+            events.append(self._event(name, cat, s0, s1, tid, {"trace_id": trace.trace_id} | span_args))
+        self.writer.write(events)
+        self.written += 1
+        return True
+
+    def _event(self, name: str, cat: str, t0: float, t1: float, tid: int, args: dict) -> dict:
+        return {"name": name, "cat": cat, "ph": "X", "ts": round(self.epoch_us + t0 * 1e6, 1),
+                "dur": round((t1 - t0) * 1e6, 1), "pid": self.pid, "tid": tid, "args": args}
+
+    # ---------- отрезки ----------
+
+    def active(self) -> Trace | None:
+        """Трасса, активная в текущем потоке."""
+        return getattr(self.local, "trace", None)
+
+    def attach(self, trace: Trace | None) -> None:
+        """Продолжить трассу в текущем потоке (поток анализа линии); None — отцепить."""
+        self.local.trace = trace
+
+    def span(self, name: str, cat: str = "stage", **args):
+        """with tracer.span("copy frame"): ... — отрезок активной трассы (или пустышка)."""
+        trace = getattr(self.local, "trace", None)
+        if trace is None:
+            return _NOOP
+        return _Span(trace, name, cat, args)
+
+    def locked(self, lock, name: str) -> _Locked:
+        """Замена `with lock:` с замером ожидания блокировки в активной трассе."""
+        return _Locked(self, lock, name)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
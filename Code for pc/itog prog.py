@@ -1,132 +1,426 @@
+import os
+# MSMF на Windows без этого открывает камеру ~10 с (до импорта cv2)
+os.environ.setdefault("OPENCV_VIDEOIO_MSMF_ENABLE_HW_TRANSFORMS", "0")
+
 import cv2
 import numpy as np
 import time
 import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from opcua import Client, ua
-from datetime import timedelta
-import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import signal
+from collections import deque
+from urllib.parse import parse_qs, quote, urlsplit
+
+from halva_detector import (
+    DEFAULT_PARAMS, DEFAULT_QUALITY_LIMITS, PARAM_LIMITS, PYRAMID_SCALE, AnalysisTimeout, Deadline,
+    analyze_product, configure_threads, crop_zone, cv_handling, detection_zones, ellipse_zone,
+    pick_best_frame, render_overlay, validate_params, verdict_of,
+)
+from halva_replay import ReplaySource, SimulatedPlc
+from halva_metrics import Counter, Gauge, Histogram, render_json, render_prometheus, set_start_time
+from halva_history import InspectionHistory
+from halva_classifier import LearnedClassifier
+from halva_reference import DIFF_SIGMA, MIN_DIFF, ReferenceModel
+from halva_params import ParamStore
+from halva_log import AsyncLogger, EventLog, ForwardLogger, forward_loop
+from halva_bus import Channel, FrameRing, Supervisor, mark_ready, read_state
+from halva_trace import Tracer
 
 # ------------------ ЛОГИ ------------------
 
-# Путь к папке и файлу логов
-LOG_DIR = r"C:\Users\admin\Documents\halvaRF"
+# Путь к папке и файлу логов (не на Windows — рядом с программой)
+LOG_DIR = r"C:\Users\admin\Documents\halvaRF" if os.name == "nt" else os.path.dirname(os.path.abspath(__file__))
 LOG_FILE = os.path.join(LOG_DIR, "halva_log.txt")
+EVENTS_FILE = os.path.join(LOG_DIR, "halva_events.jsonl")   # события для log_analyzer.py
 
 # Создадим каталог, если его нет
 os.makedirs(LOG_DIR, exist_ok=True)
 
 # Время старта программы
 START_TIME = time.time()
+set_start_time(START_TIME)
 
-# Блокировка для потокобезопасной записи в файл
-log_lock = threading.Lock()
+# Запись в консоль и файл — в фоновом потоке (halva_log.py)
+logger = AsyncLogger(LOG_FILE, START_TIME)
+# Машиночитаемые события (JSONL): trigger, frame, analysis, result, conn, start/stop
+events = EventLog(EVENTS_FILE, START_TIME)
 
 
-def log(message: str):
+def log(message: str, source: str | None = None, dedup: bool = True):
     """
     Лог с отметкой времени от старта.
-    Пишет в консоль и в файл.
+    Пишет в консоль и в файл (пачками, в фоне) — вызывающий поток не ждёт диска.
     Формат: [00:00:05.123] текст
+    source — источник шумных сообщений ("plc", "camera"): их число за окно ограничено.
+    Одинаковые сообщения схлопываются в «повторено N раз»;
+    dedup=False — для сообщений по каждому изделию, их схлопывать нельзя.
     """
-    dt = time.time() - START_TIME
-    td = str(timedelta(seconds=dt))
-    if "." in td:
-        t_main, t_ms = td.split(".")
-        td = f"{t_main}.{t_ms[:3]}"  # миллисекунды
-
-    line = f"[{td}] {message}"
-
-    # вывод в консоль
-    print(line)
-
-    # запись в файл
-    with log_lock:
-        try:
-            with open(LOG_FILE, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
-        except Exception as e:
-            # если даже лог не записался — просто скажем в консоль
-            print(f"[LOG ERROR] Не удалось записать в файл: {e}")
+    logger.log(message, source, dedup)
 
 
 # ------------------ НАСТРОЙКИ ------------------
 
 PLC_URL = "opc.tcp://172.16.3.186:4840"   # адрес OPC UA сервера ПЛК
+TARGET_VARS = "ns=4;s=|var|PLC210 OPC-UA.Application.TargetVars."  # префикс узлов обмена с ПЛК
 HTTP_PORT = 8000                          # порт веб-сервера
 CAM_INDEX = 0                             # номер камеры в OpenCV
 
+# Офлайн-прогон без камеры и ПЛК (halva_replay.py)
+FRAME_SOURCE = "camera"                   # "camera" или путь к папке с кадрами / видеофайлу
+REPLAY_FPS = None                         # None — по исходным меткам, 0 — как можно быстрее, N — кадр/с
+REPLAY_LOOP = True                        # крутить запись по кругу
+PLC_SIMULATE = False                      # True — вместо ПЛК имитация с отчётом о задержках
+
+# Превью для браузера: кодируется только пока есть зрители
+PREVIEW_SCALE = 0.5                       # масштаб картинки превью относительно кадра
+PREVIEW_QUALITY = (40, 80)                # JPEG-качество: (мин, макс)
+PREVIEW_FPS = (2.0, 10.0)                 # частота превью: (мин, макс)
+PREVIEW_CPU_HIGH = 0.7                    # загрузка CPU процессом (доля всех ядер), выше — экономим
+PREVIEW_REPORT_S = 60                     # раз во сколько секунд писать в лог расход CPU на превью
+
+HISTORY_SIZE = 200                        # сколько последних проверок держать в памяти (/history)
+HISTORY_THUMB_WIDTH = 480                 # ширина миниатюры с разметкой, px
+
+DETECTOR_PARAMS = dict(DEFAULT_PARAMS)    # параметры детектора (как в CV1.2.3.3 perebor foto.py)
+PARAMS_FILE = os.path.join(LOG_DIR, "halva_params.json")  # параметры, изменённые через /params
+ELLIPSE_SCALE = PYRAMID_SCALE             # поиск эллипсов на кадре 1/N (1 — полное разрешение)
+CV_THREADS = 1                            # cv2.setNumThreads (подбирается thread_sweep.py)
+ANALYSIS_POOL_SIZE = 3                    # потоков анализа эллипсов (0 — последовательно)
+ANALYSIS_BUDGET_S = 0.5                   # бюджет на изделие от bNewProduct до результата, с (0 — см. ниже)
+ANALYSIS_WAIT_S = 5.0                     # при ANALYSIS_BUDGET_S = 0 стадии анализа не прерываются, но ПЛК
+                                          # ждёт ответ не дольше стольких секунд, потом — 0 и ERR_TIMEOUT
+
+# Поиск пятен: "hsv" — пороги LHBlack..UVBlack, "reference" — сравнение с эталоном годных
+# изделий (строится офлайн: python halva_reference.py папка_с_годными). Нет эталона — "hsv"
+DEFECT_DETECTOR = "hsv"
+REFERENCE_FILE = os.path.join(LOG_DIR, "halva_reference.npy")
+REFERENCE_SIGMA = DIFF_SIGMA              # пятно — отклонение больше sigma * std эталона ...
+REFERENCE_MIN_DIFF = MIN_DIFF             # ... плюс столько уровней яркости
+
+# Решение ОК/брак: "spots" — брак, если в изделии есть пятно; "classifier" — модель cv2.ml
+# по признакам пятен и цвета изделия (обучается офлайн: python halva_classifier.py
+# --ok папка_годных --reject папка_брака). Нет модели — "spots"
+VERDICT_MODE = "spots"
+CLASSIFIER_FILE = os.path.join(LOG_DIR, "halva_classifier.yml")
+
+# Проверка качества кадра (halva_detector.pick_best_frame): на анализ идёт лучший
+# годный из последних QUALITY_FRAMES кадров, если годных нет — 0 и код ERR_QUALITY
+QUALITY_FRAMES = 3                        # сколько последних кадров оценивать (0 — выкл., берётся последний)
+QUALITY_LIMITS = dict(DEFAULT_QUALITY_LIMITS)  # пороги резкости, яркости, пересвета, зон с изделием
+
+# Трассировка изделий (halva_trace.py): файл открывается в chrome://tracing / ui.perfetto.dev
+TRACE_FILE = os.path.join(LOG_DIR, "halva_trace.json")
+TRACE_SAMPLE_RATE = 0.0                   # доля изделий в трассе (0 — выкл., 1 — все)
+TRACE_SLOW_MS = 0                         # плюс все изделия дольше стольких мс (0 — выкл.)
+
+# Многопроцессный режим (halva_bus.py): камера, анализ, ПЛК и веб — отдельные процессы
+# под присмотром главного, кадры — через общую память. False — всё в одном процессе (потоки)
+PROCESS_MODE = False
+PROCESS_ROLES = ("camera", "analysis", "plc", "web")
+FRAME_RING_NAME = "halva_frames"          # имя сегментов общей памяти
+FRAME_RING_SLOTS = 8                      # кадров в кольце (столько кадров вид остаётся целым)
+FRAME_RING_SHAPE = (1080, 1920, 3)        # наибольший кадр камеры
+
+# Несколько линий на одном ПК: у каждой свой ПЛК (адрес и TargetVars) и одна или несколько
+# камер (номер в OpenCV или путь к записи), свой обмен с ПЛК и свой поток анализа; пул
+# анализа, веб и метрики — общие. Брак на любой камере линии — брак изделия.
+# Пусто — одна линия из PLC_URL, TARGET_VARS и CAM_INDEX / FRAME_SOURCE
+LINES = []
+# LINES = [
+#     {"name": "line1", "plc_url": "opc.tcp://172.16.3.186:4840", "cameras": [0]},
+#     {"name": "line2", "plc_url": "opc.tcp://172.16.3.187:4840", "cameras": [1, 2],
+#      "target_vars": "ns=4;s=|var|PLC210 OPC-UA.Application.TargetVars."},
+# ]
+LINE_POOL_SIZE = 0                        # пул анализа на все линии (0 — по числу ядер)
+CAPACITY_REPORT_S = 60                    # окно и период отчёта о пропускной способности линий, с
+
+# Коды ошибок uiPcErrorCode
+ERR_NO_FRAME = 10                         # нет кадра с камеры
+ERR_TIMEOUT = 20                          # не уложились в ANALYSIS_BUDGET_S
+ERR_QUALITY = 30                          # ни один из последних кадров не прошёл проверку качества
+
 
 # ------------------ ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ------------------
 
-cap = None                 # объект камеры
-last_jpeg = None           # последний JPEG для браузера
-last_frame = None          # последний сырой кадр BGR (для анализа)
+lines = []                 # линии: ПЛК + камеры (Line, создаются в main — build_lines)
+last_analysis = None       # (кадр, результат, параметры) последнего изделия — для оверлея
+param_store = None         # версионированные параметры детектора (ParamStore, создаётся в main)
+product_seq = 0            # номер изделия (с запуска программы, сквозной по всем линиям)
+product_lock = threading.Lock()
+history = None             # история проверок (InspectionHistory, создаётся в main)
+analysis_pool = None       # пул анализа эллипсов (configure_threads)
+reference = None           # эталон годного изделия (DEFECT_DETECTOR = "reference")
+classifier = None          # модель ОК/брак (VERDICT_MODE = "classifier")
 frame_lock = threading.Lock()
 
-plc_client = None          # объект OPC UA клиента
-plc_vars = {}              # словарь узлов TargetVars
-plc_lock = threading.Lock()
-plc_connected_once = False # флаг: было ли хоть одно успешное подключение к ПЛК
+process_role = None        # роль дочернего процесса (PROCESS_MODE), None — один процесс
+proc_state = None          # общий массив состояния процессов (Supervisor.state)
+frame_ring = None          # кольцо кадров в общей памяти (PROCESS_MODE)
+history_queue = None       # анализ → веб: записи для истории (PROCESS_MODE)
+mono_offset = 0.0          # сдвиг time.monotonic() этого процесса к часам главного (PROCESS_MODE)
 
+tracer = Tracer(TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_MS)
+
+
+# ------------------ МЕТРИКИ (/metrics) ------------------
+
+m_cycle = Histogram("halva_trigger_to_result_seconds", "От bNewProduct до записи iPcResult")
+m_opcua = Histogram("halva_opcua_seconds", "Одно чтение/запись переменной OPC UA", ("op", "var"))
+m_stage = Histogram("halva_analysis_stage_seconds", "Время стадий анализа кадра", ("stage",))
+m_fps = Gauge("halva_capture_fps", "Частота чтения кадров с камеры", ("camera",))
+m_frames = Counter("halva_frames_total", "Прочитано кадров с камеры")
+m_frames_oversize = Counter("halva_frames_oversize_total",
+                            "Кадры больше FRAME_RING_SHAPE, не записанные в общую память", ("camera",))
+m_reconnects = Counter("halva_reconnects_total", "Восстановления связи", ("subsystem", "line"))
+m_lost = Counter("halva_connection_lost_total", "Потери связи", ("subsystem", "line"))
+m_verdicts = Counter("halva_verdicts_total", "Отправленные в ПЛК результаты", ("result", "error"))
+m_rejected = Counter("halva_frames_rejected_total", "Кадры, не прошедшие проверку качества", ("reason",))
+m_startup = Gauge("halva_startup_seconds", "От запуска программы до готовности подсистемы", ("subsystem",))
+m_line_rate = Gauge("halva_line_products_per_second", "Проверено изделий/с за окно CAPACITY_REPORT_S", ("line",))
+m_line_capacity = Gauge("halva_line_capacity_products_per_second",
+                        "Оценка: сколько изделий/с линия может проверять на этом ПК", ("line",))
 
-# ============================================================
-#  ПЛК  (OPC UA)
-# ============================================================
 
-def connect_plc():
+class Readiness:
     """
-    ОДНОКРАТНАЯ попытка подключиться к ПЛК и получить узлы TargetVars.
-    НИКОГДА не кидает исключения наружу.
-    Возвращает True/False (успех/ошибка).
+    Готовность подсистем при запуске.
+    Веб, камера и ПЛК поднимаются параллельно, каждая отмечает себя mark();
+    когда готовы все из required — программа готова к проверке изделий
+    (несколько линий: ПЛК и камеры каждой линии — lines_required).
+    Время каждой подсистемы (с от старта) — в /api/status, /metrics и логе.
     """
-    global plc_client, plc_vars, plc_connected_once
 
-    try:
-        time.sleep(1)
-        client = Client(PLC_URL)
-        client.connect()
-    except Exception as e:
-        log(f"⚠ Не удалось подключиться к ПЛК по OPC UA: {e}")
-        plc_client = None
-        plc_vars = {}
-        return False
+    REQUIRED = ("web", "camera", "first_frame", "opcua_import", "plc")
+    # многопроцессный режим: отметка, после которой процесс роли готов
+    ROLE_READY = {"camera": "first_frame", "analysis": "analysis", "plc": "plc", "web": "web"}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}        # подсистема -> с от старта программы
+        self.ready_at = None
+        self.required = self.REQUIRED
+
+    @staticmethod
+    def line_required(line) -> tuple:
+        """Подсистемы одной линии из нескольких: «plc line1», «camera line1/0», «first_frame line1/0», ..."""
+        names = [f"plc {line.name}"]
+        for camera in line.cameras:
+            names += [f"camera {camera.name}", f"first_frame {camera.name}"]
+        return tuple(names)
+
+    @staticmethod
+    def lines_required(all_lines: list) -> tuple:
+        """Подсистемы нескольких линий: общие (веб, импорт opcua) + каждой линии."""
+        return ("web", "opcua_import") + tuple(n for line in all_lines for n in Readiness.line_required(line))
+
+    def waiting(self, names: tuple) -> list[str]:
+        """Какие из подсистем names ещё не готовы."""
+        with self.lock:
+            return [n for n in names if n not in self.times]
+
+    def mark(self, name: str) -> None:
+        """Подсистема готова (повторные отметки — после переподключений — не считаются)."""
+        with self.lock:
+            if name in self.times:
+                return
+            t = time.time() - START_TIME
+            self.times[name] = t
+            all_ready = self.ready_at is None and all(n in self.times for n in self.required)
+            if all_ready:
+                self.ready_at = t
+        m_startup.set(round(t, 3), subsystem=name)
+        log(f"🚦 Готово: {name} через {t:.2f} с после запуска")
+        if process_role is not None and self.ROLE_READY.get(process_role) == name:
+            mark_ready(proc_state, PROCESS_ROLES.index(process_role))
+        if all_ready:
+            m_startup.set(round(t, 3), subsystem="all")
+            breakdown = ", ".join(f"{n} {self.times[n]:.2f} с" for n in self.required)
+            log(f"🚀 Программа готова к проверке через {t:.2f} с ({breakdown})")
+            events.emit("ready", total_s=round(t, 3), **{n: round(self.times[n], 3) for n in self.required})
+
+    def state(self) -> dict:
+        with self.lock:
+            times = dict(self.times)
+            ready_at = self.ready_at
+        if proc_state is not None:
+            # многопроцессный режим: готовность — по процессам (этот процесс видит только свои отметки)
+            processes = read_state(proc_state, PROCESS_ROLES)
+            waiting = [role for role, p in processes.items() if p["ready_s"] is None]
+            return {"ready": not waiting, "uptime_s": round(time.time() - START_TIME, 3),
+                    "waiting": waiting, "processes": processes,
+                    "subsystems": {n: round(t, 3) for n, t in times.items()}}
+        return {
+            "ready": ready_at is not None,
+            "ready_s": None if ready_at is None else round(ready_at, 3),
+            "uptime_s": round(time.time() - START_TIME, 3),
+            "waiting": [n for n in self.required if n not in times],
+            "subsystems": {n: round(t, 3) for n, t in times.items()},
+        }
 
-    # если подключились — один раз сообщаем
-    if not plc_connected_once:
-        log("✅ ПЛК: подключение по OPC UA выполнено")
-        plc_connected_once = True
-    else:
-        log("🔄 ПЛК: связь с ПЛК восстановлена")
 
-    base = "ns=4;s=|var|PLC210 OPC-UA.Application.TargetVars."
+readiness = Readiness()
 
-    try:
-        vars_map = {
-            "bNewProduct":   client.get_node(base + "bNewProduct"),
-            "bPlcReady":     client.get_node(base + "bPlcReady"),
-            "bStartGrab":    client.get_node(base + "bStartGrab"),
-            "iPcResult":     client.get_node(base + "iPcResult"),
-            "uiPcErrorCode": client.get_node(base + "uiPcErrorCode"),
-        }
 
-        # пробное чтение, чтобы убедиться, что ноды живые
-        _ = vars_map["bPlcReady"].get_value()
+class JpegHub:
+    """
+    Последний JPEG для браузеров.
+    Камера кодирует кадр один раз и публикует его, все клиенты /stream
+    получают один и тот же готовый фрагмент multipart. Медленный клиент
+    не копит очередь: после отправки он сразу берёт самый свежий кадр,
+    промежуточные пропускаются.
+    """
 
-    except Exception as e:
-        log(f"⚠ Подключились к ПЛК, но не удалось получить/прочитать ноды: {e}")
-        try:
-            client.disconnect()
-        except Exception:
-            pass
-        plc_client = None
-        plc_vars = {}
-        return False
+    SNAPSHOT_VIEWER_S = 2.0    # сколько секунд после /snapshot считаем, что зритель есть
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.jpeg = None       # последний JPEG (для /snapshot)
+        self.part = None       # тот же кадр, оформленный как часть multipart
+        self.seq = 0           # номер последнего кадра
+        self.published = 0.0  # когда опубликован (time.monotonic)
+        self.clients = 0       # сколько клиентов смотрят /stream
+        self.last_snapshot = -1e9
+
+    def publish(self, jpeg: bytes):
+        part = (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+        with self.cond:
+            self.jpeg = jpeg
+            self.part = part
+            self.seq += 1
+            self.published = time.monotonic()
+            self.cond.notify_all()
+
+    def viewers(self) -> int:
+        """Зрители: клиенты /stream плюс один, если недавно запрашивали /snapshot."""
+        with self.cond:
+            recent = time.monotonic() - self.last_snapshot < self.SNAPSHOT_VIEWER_S
+            return self.clients + (1 if recent else 0)
+
+    def snapshot(self, timeout: float = 1.0):
+        """
+        JPEG для /snapshot. Без зрителей превью не кодируется, поэтому
+        устаревший кадр не отдаём, а ждём свежий (не дольше timeout).
+        """
+        with self.cond:
+            self.last_snapshot = time.monotonic()
+            if self.jpeg is None or time.monotonic() - self.published > self.SNAPSHOT_VIEWER_S:
+                seq = self.seq
+                self.cond.wait_for(lambda: self.seq != seq, timeout)
+            return self.jpeg
+
+    def wait_next(self, last_seq: int, timeout: float):
+        """Ждёт кадр новее last_seq; возвращает (номер, часть multipart или None)."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            if self.seq == last_seq:
+                return last_seq, None
+            return self.seq, self.part
+
+    def add_client(self):
+        with self.cond:
+            self.clients += 1
+
+    def remove_client(self):
+        with self.cond:
+            self.clients -= 1
+
+
+class PreviewControl:
+    """
+    Управление превью: кодировать ли кадр сейчас, с каким качеством,
+    и сколько CPU на это ушло.
+    Раз в секунду смотрит на число зрителей и загрузку CPU процессом:
+    при нехватке CPU снижает частоту и качество, с ростом числа
+    зрителей (больше трафика) снижает качество.
+    """
+
+    def __init__(self):
+        self.quality = PREVIEW_QUALITY[1]
+        self.fps = PREVIEW_FPS[1]
+        self.last_encode = 0.0
+        self.cpu_s = 0.0           # CPU-время потока камеры на превью, с
+        self.frames = 0
+        self.t_adapt = time.monotonic()
+        self.cpu_adapt = time.process_time()
+        self.t_report = time.monotonic()
+        self.cpu_report = 0.0
+        self.frames_report = 0
+
+    def due(self, viewers: int) -> bool:
+        """Пора ли кодировать кадр (есть зрители и выдержан интервал)."""
+        if viewers == 0:
+            return False
+        return time.monotonic() - self.last_encode >= 1.0 / self.fps
+
+    def adapt(self, viewers: int):
+        now = time.monotonic()
+        if now - self.t_adapt < 1.0:
+            return
+        cpu_now = time.process_time()
+        load = (cpu_now - self.cpu_adapt) / (now - self.t_adapt) / (os.cpu_count() or 1)
+        self.t_adapt, self.cpu_adapt = now, cpu_now
+
+        q_min, q_max = PREVIEW_QUALITY
+        f_min, f_max = PREVIEW_FPS
+        if load > PREVIEW_CPU_HIGH:
+            self.fps = max(f_min, self.fps / 2)
+            self.quality = max(q_min, self.quality - 10)
+        else:
+            self.fps = min(f_max, self.fps + 1)
+            # каждый следующий зритель — минус 5 к качеству
+            self.quality = min(max(q_min, q_max - 5 * max(viewers - 1, 0)), self.quality + 5)
+
+    def encode(self, frame):
+        """Уменьшение + обработка + JPEG; возвращает байты или None."""
+        t_cpu = time.thread_time()
+        if PREVIEW_SCALE != 1.0:
+            frame = cv2.resize(frame, None, fx=PREVIEW_SCALE, fy=PREVIEW_SCALE,
+                               interpolation=cv2.INTER_AREA)
+        processed = cv_handling(frame)
+        ok, jpeg = cv2.imencode(
+            ".jpg", processed, [int(cv2.IMWRITE_JPEG_QUALITY), int(self.quality)]
+        )
+        self.cpu_s += time.thread_time() - t_cpu
+        self.frames += 1
+        self.last_encode = time.monotonic()
+        return jpeg.tobytes() if ok else None
+
+    def report(self, viewers: int):
+        """Раз в PREVIEW_REPORT_S пишет в лог расход CPU на превью (если он был)."""
+        now = time.monotonic()
+        if now - self.t_report < PREVIEW_REPORT_S:
+            return
+        cpu = self.cpu_s - self.cpu_report
+        frames = self.frames - self.frames_report
+        if frames:
+            log(f"🖼 Превью: кадров {frames}, CPU {cpu:.2f} с "
+                f"({100 * cpu / (now - self.t_report):.1f}% ядра), "
+                f"качество {int(self.quality)}, {self.fps:.0f} кадр/с, зрителей {viewers}")
+        self.t_report, self.cpu_report, self.frames_report = now, self.cpu_s, self.frames
+
+
+# ============================================================
+#  ПЛК  (OPC UA)
+# ============================================================
 
-    # если дошли сюда — всё хорошо
-    plc_client = client
-    plc_vars = vars_map
-    return True
+Client = ua = None         # opcua грузится лениво, в потоке ПЛК (load_opcua)
+opcua_lock = threading.Lock()
+
+
+def load_opcua():
+    """
+    Импорт opcua (тяжёлый — тянет криптографию) при первом обращении,
+    чтобы он шёл параллельно с подключением камеры, а не до старта потоков.
+    """
+    global Client, ua
+    with opcua_lock:
+        if ua is None:
+            from opcua import Client as _Client, ua as _ua
+            Client, ua = _Client, _ua
+            readiness.mark("opcua_import")
 
 
 def _default_value(name: str):
@@ -142,223 +436,1003 @@ def _default_value(name: str):
     return None
 
 
-def safe_read(name):
+class PlcLink:
     """
-    Безопасное чтение переменной ПЛК.
-    Никогда не бросает исключений.
-    При отсутствии связи возвращает значение по умолчанию
-    и раз в ~3 сек пытается переподключиться.
+    Связь с одним ПЛК по OPC UA: подключение и узлы TargetVars.
+    read()/write() никогда не бросают исключений: без связи — значение
+    по умолчанию (или пропуск записи) и переподключение при следующем обращении.
     """
-    global plc_client
-
-    with plc_lock:
-        # если ещё не подключались или соединение уже закрыто
-        if plc_client is None:
-            ok = connect_plc()
-            if not ok:
-                # нет связи — вернём дефолт
-                return _default_value(name)
 
+    NODES = ("bNewProduct", "bPlcReady", "bStartGrab", "iPcResult", "uiPcErrorCode")
+
+    def __init__(self, url: str, target_vars: str, frame_info, tag: str = "", fields: dict | None = None,
+                 suffix: str = ""):
+        self.url = url
+        self.target_vars = target_vars   # префикс узлов: target_vars + "bNewProduct"
+        self.frame_info = frame_info     # номер и время последнего кадра камеры линии (для имитации ПЛК)
+        self.tag = tag                   # приставка сообщений лога: "[line1] " (одна линия — "")
+        self.fields = fields or {}       # поля событий: line
+        self.suffix = suffix             # к имени отметки готовности: "plc line1"
+        self.source = "plc" + suffix     # ограничение шумных сообщений — у каждой линии своё
+        self.client = None               # объект OPC UA клиента
+        self.vars = {}                   # словарь узлов TargetVars
+        self.lock = threading.Lock()
+        self.connected_once = False      # было ли хоть одно успешное подключение
+        self.attempts = 0                # попыток подключения (первая — без паузы)
+        self.sim = None                  # имитация ПЛК (PLC_SIMULATE)
+
+    def connect(self) -> bool:
+        """
+        ОДНОКРАТНАЯ попытка подключиться к ПЛК и получить узлы TargetVars.
+        НИКОГДА не кидает исключения наружу.
+        Возвращает True/False (успех/ошибка).
+        """
         try:
-            return plc_vars[name].get_value()
+            # пауза между попытками; первая попытка при запуске — сразу
+            if self.attempts > 0:
+                time.sleep(1)
+            self.attempts += 1
+            load_opcua()
+            if PLC_SIMULATE:
+                if self.sim is None:
+                    self.sim = SimulatedPlc(self.frame_info)
+                client = self.sim
+            else:
+                client = Client(self.url)
+            client.connect()
         except Exception as e:
-            log(f"⚠ Ошибка чтения {name} из ПЛК: {e}")
-            # считаем, что связь потеряна
-            try:
-                plc_client.disconnect()
-            except Exception:
-                pass
-            plc_client = None
-            plc_vars.clear()
-            # небольшая пауза перед следующей попыткой
-            time.sleep(3.0)
-            return _default_value(name)
-
+            log(f"{self.tag}⚠ Не удалось подключиться к ПЛК по OPC UA: {e}", source=self.source)
+            events.emit("conn", subsystem="plc", state="fail", detail=str(e), **self.fields)
+            self.client = None
+            self.vars = {}
+            return False
 
-def safe_write(name, value, vtype):
-    """
-    Безопасная запись переменной ПЛК.
-    Если связи нет — пишет предупреждение, но программу не роняет.
-    """
-    global plc_client
+        try:
+            vars_map = {name: client.get_node(self.target_vars + name) for name in self.NODES}
 
-    with plc_lock:
-        if plc_client is None:
-            # пробуем переподключиться
-            ok = connect_plc()
-            if not ok:
-                log(f"⚠ Нет связи с ПЛК, не могу записать {name}")
-                time.sleep(3.0)
-                return
+            # пробное чтение, чтобы убедиться, что ноды живые
+            _ = vars_map["bPlcReady"].get_value()
 
-        try:
-            var = ua.Variant(value, vtype)
-            plc_vars[name].set_value(var)
         except Exception as e:
-            log(f"⚠ Ошибка записи {name} в ПЛК: {e}")
+            log(f"{self.tag}⚠ Подключились к ПЛК, но не удалось получить/прочитать ноды: {e}", source=self.source)
+            events.emit("conn", subsystem="plc", state="fail", detail=str(e), **self.fields)
             try:
-                plc_client.disconnect()
+                client.disconnect()
             except Exception:
                 pass
-            plc_client = None
-            plc_vars.clear()
-            time.sleep(3.0)
-
-
-def plc_logic_loop():
-    """
-    Основной цикл логики ПК ↔ ПЛК.
-    Ждём bPlcReady/bNewProduct, берём кадр, считаем результат, пишем в ПЛК.
-    Даже при потере связи не вылетает — safe_read/safe_write всё ловят.
-    """
-    log("▶ Цикл обмена с ПЛК запущен")
-
-    busy = False  # внутренний флаг: сейчас идёт обработка
-
-    while True:
+            self.client = None
+            self.vars = {}
+            return False
+
+        # если дошли сюда — всё хорошо; подключение (и переподключение) считается
+        # только после живого пробного чтения, а не по одному client.connect()
+        reconnect = self.connected_once
+        if not self.connected_once:
+            log(f"{self.tag}✅ ПЛК: подключение по OPC UA выполнено")
+            self.connected_once = True
+        else:
+            log(f"{self.tag}🔄 ПЛК: связь с ПЛК восстановлена", source=self.source)
+            m_reconnects.inc(subsystem="plc", line=self.fields.get("line", ""))
+        self.client = client
+        self.vars = vars_map
+        events.emit("conn", subsystem="plc", state="up", reconnect=reconnect, **self.fields)
+        readiness.mark("plc" + self.suffix)
+        return True
+
+    def _drop(self):
+        """Считаем, что связь потеряна: закрыть клиента (вызывается под self.lock)."""
         try:
-            b_ready = safe_read("bPlcReady")
-            b_new   = safe_read("bNewProduct")
-
-            # новое изделие и ПЛК говорит "готов"
-            if b_ready and b_new and not busy:
-                busy = True
-                log("📷 Новый объект под камерой, начинаю обработку")
-
-                safe_write("bStartGrab", True, ua.VariantType.Boolean)
-                safe_write("uiPcErrorCode", 0, ua.VariantType.UInt16)
-
-                # берём последний кадр
-                with frame_lock:
-                    frame = None if last_frame is None else last_frame.copy()
+            self.client.disconnect()
+        except Exception:
+            pass
+        self.client = None
+        self.vars.clear()
+
+    def read(self, name):
+        """
+        Безопасное чтение переменной ПЛК.
+        Никогда не бросает исключений.
+        При отсутствии связи возвращает значение по умолчанию
+        и раз в ~3 сек пытается переподключиться.
+        """
+        with tracer.locked(self.lock, "plc_lock"):
+            # если ещё не подключались или соединение уже закрыто
+            if self.client is None:
+                with tracer.span("connect_plc", cat="opcua"):
+                    ok = self.connect()
+                if not ok:
+                    # нет связи — вернём дефолт
+                    return _default_value(name)
 
-                if frame is None:
-                    log("❌ Нет кадра с камеры для анализа")
-                    safe_write("uiPcErrorCode", 10, ua.VariantType.UInt16)
-                    safe_write("iPcResult", 0, ua.VariantType.Int16)
-                else:
-                    # обработка кадра и вычисление результата
-                    result_code = process_and_classify(frame)
-                    safe_write("iPcResult", result_code, ua.VariantType.Int16)
-                    log(f"✅ Результат анализа отправлен в ПЛК: {result_code}")
+            try:
+                t0 = time.perf_counter()
+                with tracer.span(f"read {name}", cat="opcua"):
+                    value = self.vars[name].get_value()
+                m_opcua.observe(time.perf_counter() - t0, op="read", var=name)
+                return value
+            except Exception as e:
+                log(f"{self.tag}⚠ Ошибка чтения {name} из ПЛК: {e}", source=self.source)
+                events.emit("conn", subsystem="plc", state="down", detail=f"read {name}: {e}", **self.fields)
+                m_lost.inc(subsystem="plc", line=self.fields.get("line", ""))
+                self._drop()
+                # небольшая пауза перед следующей попыткой
+                time.sleep(3.0)
+                return _default_value(name)
 
-                safe_write("bStartGrab", False, ua.VariantType.Boolean)
-                busy = False
+    def write(self, name, value, vtype):
+        """
+        Безопасная запись переменной ПЛК.
+        Если связи нет — пишет предупреждение, но программу не роняет.
+        """
+        with tracer.locked(self.lock, "plc_lock"):
+            if self.client is None:
+                # пробуем переподключиться
+                with tracer.span("connect_plc", cat="opcua"):
+                    ok = self.connect()
+                if not ok:
+                    log(f"{self.tag}⚠ Нет связи с ПЛК, не могу записать {name}", source=self.source)
+                    time.sleep(3.0)
+                    return
 
-            time.sleep(0.05)
+            try:
+                var = ua.Variant(value, vtype)
+                t0 = time.perf_counter()
+                with tracer.span(f"write {name}", cat="opcua", value=value):
+                    self.vars[name].set_value(var)
+                m_opcua.observe(time.perf_counter() - t0, op="write", var=name)
+            except Exception as e:
+                log(f"{self.tag}⚠ Ошибка записи {name} в ПЛК: {e}", source=self.source)
+                events.emit("conn", subsystem="plc", state="down", detail=f"write {name}: {e}", **self.fields)
+                m_lost.inc(subsystem="plc", line=self.fields.get("line", ""))
+                self._drop()
+                time.sleep(3.0)
 
-        except Exception as e:
-            # сюда вообще не должны попадать, но на всякий случай
-            log(f"⚠ Неожиданная ошибка в цикле обмена с ПЛК: {e}")
-            time.sleep(1.0)
+    def disconnect(self):
+        with self.lock:
+            if self.client is not None:
+                self._drop()
 
 
 # ============================================================
-#  КАМЕРА
+#  ЛИНИИ
 # ============================================================
 
-def initial_cam():
-    """Первое подключение к камере."""
-    global cap
-    cap = cv2.VideoCapture(CAM_INDEX)
-    if not cap.isOpened():
-        log("❌ Камера не обнаружена")
-        cap = None
-    else:
-        log("✅ Камера подключена")
-
-
-def check_camera():
-    """Проверка и автоматическое переподключение камеры."""
-    global cap
-    while cap is None or not cap.isOpened():
-        log("🔄 Камера недоступна, пытаюсь подключить...")
-        initial_cam()
-        if cap is None or not cap.isOpened():
-            time.sleep(3)
-        else:
-            break
+def next_product() -> int:
+    """Номер нового изделия — сквозной по всем линиям (ключ истории и трасс)."""
+    global product_seq
+    with product_lock:
+        product_seq += 1
+        return product_seq
 
 
-def cv_handling(frame_bgr):
+def combine_outcomes(outs: list[dict]) -> dict:
     """
-    Обработка изображения. 
-    Сейчас пример: серый + размытие.
+    Итог изделия по камерам линии: брак на любой камере — брак; иначе первая
+    камера с ошибкой или без решения; иначе ОК (итог первой камеры).
     """
-    gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    return blur
+    for out in outs:
+        if not out["error"] and out["verdict"] == 2:
+            return out
+    for out in outs:
+        if out["error"] or out["verdict"] == 0:
+            return out
+    return outs[0]
 
 
-def process_and_classify(frame_bgr):
+class Line:
     """
-    Логика анализа кадра и выдача кода:
-    1 – ОК, 2 – брак, 0 – нет решения.
-    Сейчас пример: по средней яркости.
+    Линия: ПЛК и его камеры.
+    У линии свой поток обмена с ПЛК (logic_loop) и свой поток анализа
+    (worker_loop): линии не ждут друг друга, а ПЛК получает ответ вовремя,
+    даже когда анализ не укладывается в бюджет. Пул анализа, параметры,
+    история, веб и метрики — общие для всех линий.
+    PROCESS_MODE (одна линия): обмен и анализ — в разных процессах,
+    requests/results — каналы между ними (halva_bus.Channel).
     """
-    img = cv_handling(frame_bgr)
-    mean_val = float(np.mean(img))
-    # простая заглушка:
-    # яркий объект – ОК, тёмный – брак
-    if mean_val > 100:
-        return 1  # ОК
-    else:
-        return 2  # брак
 
+    def __init__(self, name: str, plc_url: str, target_vars: str, sources: list, tagged: bool):
+        self.name = name
+        # несколько линий: приставка в логе (как у процессов — log_analyzer её пропускает) и поле событий
+        self.tag = f"[{name}] " if tagged else ""
+        self.fields = {"line": name} if tagged else {}
+        self.suffix = f" {name}" if tagged else ""   # к имени отметок готовности: «first_inspection line1»
+        self.cameras = [Camera(f"{name}/{i}" if tagged else name, source, self.fields, tagged)
+                        for i, source in enumerate(sources)]
+        self.plc = PlcLink(plc_url, target_vars, self.cameras[0].frame_info, self.tag, self.fields,
+                           self.suffix)
+        self.requests = queue.Queue()   # обмен → анализ: (номер изделия, время триггера, трасса)
+        self.results = queue.Queue()    # анализ → обмен: итог изделия
+        self.cycles = deque(maxlen=10000)   # (time.time() результата, цикл триггер → результат, с)
+        self.cycles_lock = threading.Lock()
+        self.started = time.time()
+        self.capacity_state = {}        # последняя оценка пропускной способности (/api/status)
+
+    def log(self, message: str, source: str | None = None, dedup: bool = True):
+        log(self.tag + message, source, dedup)
+
+    def emit(self, event: str, **fields):
+        events.emit(event, **fields, **self.fields)
+
+    # ---------- обмен с ПЛК ----------
+
+    def logic_loop(self):
+        """
+        Основной цикл логики ПК ↔ ПЛК линии.
+        Ждём bPlcReady/bNewProduct, отдаём изделие на анализ, пишем результат в ПЛК.
+        Даже при потере связи не вылетает — PlcLink.read/write всё ловят.
+        """
+        self.log("▶ Цикл обмена с ПЛК запущен")
+        load_opcua()
+        plc = self.plc
+
+        busy = False  # внутренний флаг: сейчас идёт обработка
+        t_prev_poll = time.perf_counter()
 
-def camera_loop():
+        while True:
+            try:
+                t_poll = time.perf_counter()
+                b_ready = plc.read("bPlcReady")
+                b_new   = plc.read("bNewProduct")
+
+                # новое изделие и ПЛК говорит "готов"
+                if b_ready and b_new and not busy:
+                    busy = True
+                    deadline = Deadline(ANALYSIS_BUDGET_S)
+                    t_trigger = time.time()
+                    seq = next_product()
+                    # трасса изделия; опрос, который увидел фронт, — её первый отрезок
+                    trace = tracer.begin(f"product #{seq}", seq=seq, **self.fields)
+                    if trace is not None:
+                        trace.t0 = t_poll
+                        trace.add("poll bPlcReady/bNewProduct", t_poll, time.perf_counter(), cat="opcua",
+                                  poll_gap_ms=round((t_poll - t_prev_poll) * 1000, 1))
+                    self.log("📷 Новый объект под камерой, начинаю обработку", dedup=False)
+                    self.emit("trigger", seq=seq, trace_id=None if trace is None else trace.trace_id)
+
+                    plc.write("bStartGrab", True, ua.VariantType.Boolean)
+                    plc.write("uiPcErrorCode", 0, ua.VariantType.UInt16)
+
+                    # кадр и анализ — в потоке анализа линии (PROCESS_MODE — в процессе анализа)
+                    with tracer.span("analysis request"):
+                        out = self.request_analysis(seq, deadline, t_trigger, trace)
+                    result_code, error_code = out["verdict"], out["error"]
+
+                    if error_code == ERR_NO_FRAME:
+                        self.log("❌ Нет кадра с камеры для анализа", dedup=False)
+                        plc.write("uiPcErrorCode", ERR_NO_FRAME, ua.VariantType.UInt16)
+                        plc.write("iPcResult", 0, ua.VariantType.Int16)
+                    elif error_code == ERR_QUALITY:
+                        self.log(f"🌫 Нет годного кадра из {out['quality']['candidates']} "
+                                 f"({'; '.join(out['quality']['problems'])}), отправляю 0 и код {ERR_QUALITY}",
+                                 dedup=False)
+                        plc.write("uiPcErrorCode", ERR_QUALITY, ua.VariantType.UInt16)
+                        plc.write("iPcResult", 0, ua.VariantType.Int16)
+                    elif error_code == ERR_TIMEOUT:
+                        self.log(f"⏱ Превышен бюджет анализа ({out['timeout']}), отправляю 0 и код {ERR_TIMEOUT}",
+                                 dedup=False)
+                        plc.write("uiPcErrorCode", ERR_TIMEOUT, ua.VariantType.UInt16)
+                        plc.write("iPcResult", 0, ua.VariantType.Int16)
+                    else:
+                        plc.write("iPcResult", result_code, ua.VariantType.Int16)
+                        self.log(f"✅ Результат анализа отправлен в ПЛК: {result_code} "
+                                 f"({deadline.elapsed() * 1000:.0f} мс)", dedup=False)
+                    m_verdicts.inc(result=result_code, error=error_code)
+
+                    m_cycle.observe(deadline.elapsed())
+                    with self.cycles_lock:
+                        self.cycles.append((time.time(), deadline.elapsed()))
+                    self.emit("result", seq=seq, result=result_code, error=error_code,
+                              cycle_ms=round(deadline.elapsed() * 1000, 1), params_version=out["params_version"])
+                    if history is not None:
+                        # миниатюра рисуется в фоне, здесь только запись в кольцо
+                        with tracer.span("history.add"):
+                            history.add(seq, result_code, error_code, t_trigger, out["frame_ts"],
+                                        out["frame"], out["params"], out["result"], out["params_version"],
+                                        out["quality"])
+                    readiness.mark("first_inspection" + self.suffix)
+                    plc.write("bStartGrab", False, ua.VariantType.Boolean)
+                    tracer.end(trace, result=result_code, error=error_code, params_version=out["params_version"],
+                               frame=out["frame_no"], frame_age_ms=out["frame_age_ms"])
+                    busy = False
+
+                t_prev_poll = t_poll
+                time.sleep(0.05)
+
+            except Exception as e:
+                # сюда вообще не должны попадать, но на всякий случай
+                self.log(f"⚠ Неожиданная ошибка в цикле обмена с ПЛК: {e}")
+                time.sleep(1.0)
+
+    def request_analysis(self, seq: int, deadline: Deadline, t_trigger: float, trace=None) -> dict:
+        """
+        Отдать изделие анализу линии и ждать ответ не дольше бюджета
+        (при ANALYSIS_BUDGET_S = 0 — ANALYSIS_WAIT_S).
+        Если анализ не успел (или его процесс упал) — итог ERR_TIMEOUT.
+        trace — трасса изделия: поток анализа пишет в неё свои отрезки
+        (в другой процесс она не передаётся).
+        Начало бюджета уходит по монотонным часам (в часах главного процесса):
+        перевод системных часов (NTP, сезонное время) бюджет не сдвигает.
+        """
+        self.requests.put((seq, t_trigger, deadline.start + mono_offset,
+                           trace if process_role is None else None))
+        while True:
+            remaining = deadline.remaining()
+            try:
+                out = self.results.get(timeout=ANALYSIS_WAIT_S if remaining is None else remaining)
+            except queue.Empty:
+                return {"verdict": 0, "error": ERR_TIMEOUT, "frame_no": None, "frame_age_ms": None,
+                        "quality": None, "params_version": None, "frame": None, "frame_ts": None,
+                        "params": None, "result": None,
+                        "timeout": f"нет ответа анализа за {deadline.elapsed() * 1000:.0f} мс"}
+            if out["seq"] == seq:
+                return out
+            # опоздавший ответ по прошлому изделию (по нему ПЛК уже ответили) — пропускаем
+
+    # ---------- анализ ----------
+
+    def worker_loop(self):
+        """Анализ изделий линии: запросы обмена с ПЛК, кадры камер линии, итог — обратно."""
+        if process_role == "analysis":
+            self.log("▶ Процесс анализа запущен")
+            readiness.mark("analysis")
+        else:
+            self.log("▶ Поток анализа запущен")
+        while True:
+            try:
+                seq, t_trigger, t_start, trace = self.requests.get()
+            except queue.Empty:
+                continue  # испорченная запись (писатель погиб посреди отправки)
+            # бюджет считается от срабатывания bNewProduct
+            deadline = Deadline(ANALYSIS_BUDGET_S, t_start - mono_offset)
+            if deadline.remaining() == 0:
+                continue  # ПЛК уже ответили по таймауту — изделие устарело
+            if process_role is not None and param_store.reload_if_changed():
+                log(f"🎛 Параметры детектора: версия {param_store.get()[0]} подхвачена из файла")
+
+            tracer.attach(trace)
+            try:
+                out = self.inspect(seq, deadline, t_trigger)
+            except Exception as e:
+                self.log(f"⚠ Неожиданная ошибка анализа: {e}")
+                continue  # ПЛК ответят по таймауту
+            finally:
+                tracer.attach(None)
+
+            if history_queue is None:
+                self.results.put(out | {"seq": seq})
+                continue
+            # PROCESS_MODE: кадр и результат остаются здесь
+            self.results.put({k: v for k, v in out.items() if k not in ("frame", "params", "result")}
+                             | {"seq": seq})
+            # в историю (процесс веба) — номер кадра вместо самого кадра: веб возьмёт его из общей памяти
+            history_queue.put((seq, out["verdict"], out["error"], t_trigger, out["frame_ts"],
+                               out["frame_no"], dict(out["params"]), out["result"], out["params_version"],
+                               out["quality"]))
+
+    def inspect(self, seq: int, deadline: Deadline, t_trigger: float) -> dict:
+        """
+        Кадр + анализ изделия на камерах линии (без записи в ПЛК).
+        Камеры смотрятся по очереди; брак или исчерпанный бюджет — остальные
+        камеры уже не нужны. Итог — combine_outcomes.
+        """
+        # параметры берём один раз на изделие: замена через /params
+        # вступает в силу только со следующего изделия
+        params_version, params = current_params()
+        outs = []
+        for camera in self.cameras:
+            out = self.inspect_camera(camera, seq, deadline, t_trigger, params_version, params)
+            outs.append(out)
+            if out["error"] == ERR_TIMEOUT or (not out["error"] and out["verdict"] == 2):
+                break
+        return combine_outcomes(outs)
+
+    def inspect_camera(self, camera, seq: int, deadline: Deadline, t_trigger: float,
+                       params_version: int, params: dict) -> dict:
+        """
+        Кадр одной камеры + анализ.
+        Итог: verdict, error (0 / ERR_NO_FRAME / ERR_TIMEOUT / ERR_QUALITY), timeout (текст),
+        frame_no, frame_age_ms, quality, params_version, а для истории — frame, frame_ts, params, result.
+        """
+        # кадр: последний или лучший из последних QUALITY_FRAMES
+        with tracer.span("select frame", **camera.label):
+            (frame, frame_ts, frame_no, frame_time), quality, usable = select_frame(camera, params)
+        age_ms = None if frame is None else round((t_trigger - frame_time) * 1000, 1)
+        self.emit("frame", seq=seq, frame=None if frame is None else frame_no, age_ms=age_ms, quality=quality,
+                  **camera.label)
+
+        out = {"verdict": 0, "error": 0, "timeout": None, "frame_no": None if frame is None else frame_no,
+               "frame_age_ms": age_ms, "quality": quality, "params_version": params_version,
+               "frame": frame, "frame_ts": frame_ts, "params": params, "result": None}
+        if frame is None:
+            out["error"] = ERR_NO_FRAME
+            return out
+        if not usable:
+            out["error"] = ERR_QUALITY
+            return out
+
+        try:
+            # PLC-записи выше тоже тратят бюджет
+            deadline.check("grab")
+            # обработка кадра и вычисление результата
+            with tracer.span("process_and_classify", **camera.label):
+                verdict, result = process_and_classify(frame, deadline, params, self.tag)
+            if camera.ring is not None and not camera.ring.valid(frame_no):
+                # кадр в общей памяти перезаписан во время анализа — повтор на устойчивой копии
+                # последнего кадра (выбранный уже ушёл из кольца, проверка качества не повторяется)
+                frame, frame_ts, frame_no, frame_time = camera.latest(copy=True)
+                out.update(frame=frame, frame_ts=frame_ts, frame_no=frame_no)
+                verdict, result = process_and_classify(frame, deadline, params, self.tag)
+        except AnalysisTimeout as e:
+            out["error"], out["timeout"] = ERR_TIMEOUT, str(e)
+            return out
+
+        self.emit("analysis", seq=seq, verdict=verdict,
+                  ellipses=len(result["ellipses"]), spots=len(result["defects"]["area"]),
+                  timings_ms={k: round(v * 1000, 2) for k, v in result["timings"].items()}, **camera.label)
+        out["verdict"], out["result"] = verdict, result
+        return out
+
+    # ---------- пропускная способность ----------
+
+    def capacity(self, cpu_load: float | None) -> dict:
+        """
+        Изделий/с за последние CAPACITY_REPORT_S: rate — проверено, capacity —
+        оценка, сколько линия может проверять на этом ПК. Изделия линии идут по
+        одному, поэтому не больше 1 / средний цикл; при известной загрузке CPU
+        процессом — и не больше rate / загрузка (линия сохраняет свою долю CPU).
+        capacity None — изделий за окно не было.
+        """
+        now = time.time()
+        with self.cycles_lock:
+            cycles = [c for t, c in self.cycles if now - t <= CAPACITY_REPORT_S]
+        window = min(CAPACITY_REPORT_S, now - self.started)
+        rate = len(cycles) / window if window > 0 else 0.0
+        state = {"rate_pps": round(rate, 2), "capacity_pps": None, "cycle_ms": None}
+        if cycles:
+            cycle = sum(cycles) / len(cycles)
+            capacity = 1.0 / cycle if cycle > 0 else float("inf")
+            if cpu_load:
+                capacity = min(capacity, rate / cpu_load)
+            state.update(capacity_pps=round(capacity, 2), cycle_ms=round(cycle * 1000, 1))
+        return state
+
+    def status(self) -> dict:
+        """Состояние линии для /api/status (ready/waiting — только при нескольких линиях)."""
+        state = {"plc": self.plc.url, "plc_connected": self.plc.client is not None,
+                 "cameras": [c.name for c in self.cameras]}
+        if self.suffix:
+            waiting = readiness.waiting(Readiness.line_required(self))
+            state |= {"ready": not waiting, "waiting": waiting}
+        return state | self.capacity_state
+
+
+def select_frame(camera, params: dict) -> tuple[tuple, dict | None, bool]:
+    """
+    Кадр камеры для анализа: ((кадр, время съёмки, номер, время получения), оценка, годен).
+    QUALITY_FRAMES = 0 — последний кадр без оценки. Иначе лучший годный из
+    последних QUALITY_FRAMES; если годных нет — тот, где изделие видно лучше
+    всего (для истории), и годен = False.
     """
-    Поток камеры: читает кадр, обрабатывает для веба,
-    сохраняет последний кадр и JPEG.
-    При потере камеры выполняется автоматическое переподключение.
+    if QUALITY_FRAMES <= 0:
+        return camera.latest(copy=camera.ring is None), None, True
+    candidates = camera.recent(QUALITY_FRAMES)
+    if not candidates:
+        return (None, None, None, None), None, True
+
+    t0 = time.perf_counter()
+    best, qualities = pick_best_frame([c[0] for c in candidates], params, QUALITY_LIMITS)
+    m_stage.observe(time.perf_counter() - t0, stage="quality")
+    rejected = 0
+    for q in qualities:
+        if q["problems"]:
+            rejected += 1
+            for problem in q["problems"]:
+                m_rejected.inc(reason=problem.split(":")[0])
+    usable = best is not None
+    if not usable:
+        best = max(range(len(qualities)), key=lambda i: (qualities[i]["zones"], qualities[i]["sharpness"]))
+    return candidates[best], qualities[best] | {"candidates": len(candidates), "rejected": rejected}, usable
+
+
+def build_lines() -> list:
+    """Линии из LINES; пусто — одна линия из PLC_URL / TARGET_VARS и CAM_INDEX (или FRAME_SOURCE)."""
+    if not LINES:
+        source = CAM_INDEX if FRAME_SOURCE == "camera" else FRAME_SOURCE
+        return [Line("main", PLC_URL, TARGET_VARS, [source], tagged=False)]
+    return [Line(cfg["name"], cfg["plc_url"], cfg.get("target_vars", TARGET_VARS), cfg["cameras"], tagged=True)
+            for cfg in LINES]
+
+
+def lines_problems() -> list[str]:
+    """Ошибки в LINES (пусто — всё в порядке)."""
+    problems = []
+    names = [cfg.get("name") for cfg in LINES]
+    for i, cfg in enumerate(LINES):
+        for key in ("name", "plc_url", "cameras"):
+            if not cfg.get(key):
+                problems.append(f"линия {i + 1}: не задано {key}")
+    if len(set(names)) != len(names):
+        problems.append("имена линий повторяются")
+    return problems
+
+
+def analysis_pool_size() -> int:
     """
-    global cap, last_jpeg, last_frame
+    Пул анализа эллипсов на все линии. Одна линия — ANALYSIS_POOL_SIZE;
+    несколько — LINE_POOL_SIZE или по числу ядер: по ядру остаётся потоку
+    анализа каждой линии, и не больше ANALYSIS_POOL_SIZE потоков на линию.
+    """
+    if len(lines) <= 1 or ANALYSIS_POOL_SIZE <= 0:
+        return ANALYSIS_POOL_SIZE
+    if LINE_POOL_SIZE > 0:
+        return LINE_POOL_SIZE
+    return max(1, min((os.cpu_count() or 1) - len(lines), ANALYSIS_POOL_SIZE * len(lines)))
+
+
+def report_capacity(cpu_load: float | None) -> None:
+    """Пропускная способность линий: метрики, /api/status, лог и событие (если были изделия)."""
+    states = {}
+    for line in lines:
+        state = line.capacity(cpu_load)
+        line.capacity_state = state
+        states[line.name] = state
+        m_line_rate.set(state["rate_pps"], line=line.name)
+        if state["capacity_pps"] is not None:
+            m_line_capacity.set(state["capacity_pps"], line=line.name)
+    if not any(s["capacity_pps"] is not None for s in states.values()):
+        return
+    parts = [f"{name} {s['rate_pps']:.2f} изд/с" + ("" if s["capacity_pps"] is None else
+             f", можно до {s['capacity_pps']:.2f} (цикл {s['cycle_ms']:.0f} мс)") for name, s in states.items()]
+    cpu = "" if cpu_load is None else f"; CPU {cpu_load * 100:.0f}%"
+    log(f"📈 Пропускная способность: {'; '.join(parts)}{cpu}")
+    events.emit("capacity", lines=states, cpu_load=None if cpu_load is None else round(cpu_load, 3))
 
-    JPEG_QUALITY = 80
 
-    # Первое подключение
-    check_camera()
+# ============================================================
+#  МНОГОПРОЦЕССНЫЙ РЕЖИМ (PROCESS_MODE)
+# ============================================================
 
+def history_feed_loop():
+    """Процесс веба: записи истории от процесса анализа (миниатюра — по кадру из общей памяти)."""
+    global last_analysis
     while True:
-        # если камера отсутствует — пробуем переподключить
-        if cap is None or not cap.isOpened():
-            log("🔄 Камера недоступна, переподключаю...")
-            check_camera()
-            time.sleep(1)
+        try:
+            (seq, verdict, error, t_trigger, frame_ts, frame_no, params, result, params_version,
+             quality) = history_queue.get()
+        except queue.Empty:
             continue
+        frame = None if frame_no is None else frame_ring.copy(frame_no)
+        history.add(seq, verdict, error, t_trigger, frame_ts, frame, params, result, params_version, quality)
+        if frame is not None and result is not None:
+            with frame_lock:
+                last_analysis = (frame, result, params)
 
-        # пробуем прочитать кадр
-        ret, frame = cap.read()
 
-        if not ret or frame is None:
-            log("⚠ Не удалось прочитать кадр — камера возможно отключилась")
-            try:
-                cap.release()
-            except Exception:
-                pass
-            cap = None
-            time.sleep(1)
+def preview_loop(camera):
+    """Процесс веба: превью из общей памяти, пока есть зрители."""
+    last_seq = 0
+    while True:
+        seq = frame_ring.latest_seq()
+        if seq == last_seq:
+            time.sleep(0.01)
             continue
+        last_seq = seq
+        frame = frame_ring.view(seq)[0]
+        if frame is not None:
+            camera.publish_preview(frame)
+
+
+def run_child(role: str, log_q, state, clock, requests, results, hist_q):
+    """Точка входа дочернего процесса: подключение к общей памяти и работа своей роли."""
+    global logger, events, tracer, process_role, proc_state, frame_ring, lines, mono_offset, START_TIME
+    global history_queue, analysis_pool, history, param_store, reference, classifier
+
+    process_role, proc_state = role, state
+    # монотонные часы процессов могут не совпадать — переводим в часы главного один раз, по
+    # его свежей паре (системное время, monotonic): бюджет изделия идёт по монотонным часам
+    with clock.get_lock():
+        wall0, mono0, START_TIME = clock[:]
+    mono_offset = mono0 + (time.time() - wall0) - time.monotonic()
+    # время работы и готовности в /api/status и /metrics — от запуска программы, а не процесса
+    set_start_time(START_TIME)
+    # Ctrl+C ловит главный процесс и сам останавливает дочерние
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # лог и события пишет главный процесс — сюда только пересылка
+    logger = events = ForwardLogger(log_q, role)
+    if role != "plc":
+        tracer = Tracer(TRACE_FILE)   # трассы изделий пишет только процесс ПЛК
+    frame_ring = FrameRing(FRAME_RING_NAME, FRAME_RING_SLOTS, FRAME_RING_SHAPE)
+    history_queue = hist_q
+    # многопроцессный режим — одна линия с одной камерой
+    lines = build_lines()
+    line, camera = lines[0], lines[0].cameras[0]
+    line.requests, line.results, camera.ring = requests, results, frame_ring
+
+    if role == "camera":
+        camera.loop()
+    elif role == "analysis":
+        analysis_pool = configure_threads(CV_THREADS, ANALYSIS_POOL_SIZE)
+        reference = load_reference()
+        classifier = load_classifier()
+        param_store = load_params()
+        line.worker_loop()
+    elif role == "plc":
+        threading.Thread(target=line.logic_loop, daemon=True).start()
+        monitor_loop()
+    elif role == "web":
+        history = InspectionHistory(HISTORY_SIZE, HISTORY_THUMB_WIDTH)
+        param_store = load_params()
+        # предпросмотр параметров решает так же, как процесс анализа
+        reference = load_reference()
+        classifier = load_classifier()
+        threading.Thread(target=history_feed_loop, daemon=True).start()
+        threading.Thread(target=preview_loop, args=(camera,), daemon=True).start()
+        web_loop()
+
+
+def run_processes():
+    """
+    Главный процесс многопроцессного режима: общая память для кадров, очереди
+    между процессами, запуск ролей и перезапуск упавших. Лог и события
+    всех процессов пишет он.
+    """
+    ring = FrameRing(FRAME_RING_NAME, FRAME_RING_SLOTS, FRAME_RING_SHAPE, create=True)
+    supervisor = Supervisor(PROCESS_ROLES)
+    ctx = supervisor.ctx
+    log_q = ctx.Queue(maxsize=10000)
+    # у каналов между ролями один писатель и один читатель — гибель любого не вешает другой
+    requests, results, hist_q = Channel(ctx), Channel(ctx), Channel(ctx, HISTORY_SIZE)
+    threading.Thread(target=forward_loop, args=(log_q, logger, events), daemon=True).start()
+    # (системное время, monotonic, START_TIME) главного процесса — обновляется перед каждым (пере)запуском
+    clock = ctx.Array("d", 3)
+    clock[:] = [time.time(), time.monotonic(), START_TIME]
+    # файл параметров (и начальная версия в журнале) — до запуска ролей, чтобы её не писали анализ и веб разом
+    log(f"🎛 Параметры детектора: версия {load_params().get()[0]}")
+
+    for role in PROCESS_ROLES:
+        supervisor.add(role, run_child, role, log_q, supervisor.state, clock, requests, results, hist_q)
+    supervisor.start()
+    log(f"🧩 Многопроцессный режим: {', '.join(f'{r} (pid {p.pid})' for r, p in supervisor.procs.items())}")
+    events.emit("start", frame_source=FRAME_SOURCE, plc_simulate=PLC_SIMULATE, process_mode=True)
+
+    reported_ready = False
+    try:
+        while True:
+            time.sleep(1)
+            with clock.get_lock():
+                clock[:2] = [time.time(), time.monotonic()]
+            for message in supervisor.check():
+                log(message)
+            status = supervisor.status()
+            if not reported_ready and all(p["ready_s"] is not None for p in status.values()):
+                reported_ready = True
+                log("🚀 Все процессы готовы: " + ", ".join(f"{r} {p['ready_s']:.2f} с" for r, p in status.items()))
+                events.emit("ready", processes=status)
+    except KeyboardInterrupt:
+        log("⏹ Остановка программы...")
+        supervisor.stop()
+        ring.close()
+        events.emit("stop")
+        events.close()
+        logger.close()
 
-        # сохраняем сырой кадр для анализа
-        with frame_lock:
-            last_frame = frame.copy()
 
-        # для веб — обработанный вариант
-        processed = cv_handling(frame)
+# ============================================================
+#  КАМЕРА
+# ============================================================
 
-        ok, jpeg = cv2.imencode(
-            ".jpg", processed, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        )
-        if not ok:
-            log("⚠ Ошибка JPEG-кодирования")
-            time.sleep(0.2)
-            continue
+class Camera:
+    """
+    Камера линии (или запись кадров, если источник — путь к папке/видео).
+    Поток камеры (loop) читает кадры, хранит последний и QUALITY_FRAMES
+    последних для анализа, пока есть зрители — готовит JPEG для веба.
+    PROCESS_MODE: кадры — в общей памяти (ring), превью кодирует процесс веба.
+    """
+
+    def __init__(self, name: str, source, line_fields: dict | None = None, tagged: bool = False):
+        self.name = name
+        self.source = source            # индекс камеры или путь к записи
+        self.replay = not isinstance(source, int)
+        self.tag = f"[{name}] " if tagged else ""
+        self.label = {"camera": name} if tagged else {}       # поле событий анализа (line добавляет Line)
+        self.fields = (line_fields or {}) | self.label         # поля событий камеры
+        self.suffix = f" {name}" if tagged else ""              # к имени отметок готовности
+        self.cap = None                 # объект камеры (или ReplaySource)
+        self.connected_once = False
+        self.lock = threading.Lock()
+        self.frame = None               # последний кадр с камеры (для анализа)
+        self.frame_ts = None            # время съёмки (метка записи при воспроизведении)
+        self.frame_time = None          # время получения последнего кадра
+        self.seq = 0                    # номер кадра (растёт с каждым кадром камеры)
+        self.buffer = deque(maxlen=max(1, QUALITY_FRAMES))   # последние кадры для выбора по качеству
+        self.ring = None                # PROCESS_MODE: FrameRing
+        self.hub = JpegHub()            # последний JPEG для веба — общий для всех клиентов
+        self.preview = PreviewControl() # темп и качество превью по числу зрителей
+
+    def frame_info(self):
+        """Номер последнего кадра и время его получения (для имитации ПЛК)."""
+        frame, _, seq, t_recv = self.latest()
+        return (seq if frame is not None else None), t_recv
+
+    def latest(self, copy: bool = False):
+        """
+        Последний кадр: (кадр, время съёмки, номер, время получения), кадр None — кадров ещё нет.
+        Один процесс: ссылка на self.frame (камера кадр не меняет, только заменяет ссылку).
+        PROCESS_MODE: вид на общую память без копии — после работы с ним
+        проверить ring.valid(номер); copy=True — устойчивая копия.
+        """
+        if self.ring is None:
+            with tracer.locked(self.lock, "frame_lock"):
+                frame = self.frame
+                info = (self.frame_ts, self.seq, self.frame_time)
+            if frame is not None and copy:
+                frame = frame.copy()
+            return (frame,) + info
+
+        while True:
+            seq, frame, ts, t_recv = self.ring.latest()
+            if frame is None or not copy:
+                return frame, ts, seq, t_recv
+            frame = self.ring.copy(seq)
+            if frame is not None:
+                return frame, ts, seq, t_recv
+            # слот перезаписали во время копирования — берём следующий последний
+
+    def recent(self, k: int) -> list[tuple]:
+        """
+        Последние k кадров, новые первыми: (кадр, время съёмки, номер, время получения).
+        Один процесс: кадры из self.buffer (камера их не меняет). PROCESS_MODE — виды
+        на общую память без копии (после работы проверить ring.valid(номер)).
+        """
+        if self.ring is None:
+            with tracer.locked(self.lock, "frame_lock"):
+                return list(reversed(self.buffer))[:k]
+        out = []
+        latest = self.ring.latest_seq()
+        for seq in range(latest, max(0, latest - k), -1):
+            frame, ts, t_recv = self.ring.view(seq)
+            if frame is not None:
+                out.append((frame, ts, seq, t_recv))
+        return out
+
+    def connect(self):
+        """Подключение к камере (или к записи, если источник — путь)."""
+        if self.replay:
+            self.cap = ReplaySource(self.source, REPLAY_FPS, REPLAY_LOOP, on_skip=lambda path: log(
+                f"{self.tag}⚠ Кадр записи {path} не читается — пропущен", source="camera" + self.suffix))
+        else:
+            self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            log(f"{self.tag}❌ Камера не обнаружена")
+            events.emit("conn", subsystem="camera", state="fail", **self.fields)
+            self.cap = None
+        else:
+            log(f"{self.tag}✅ Камера подключена")
+            events.emit("conn", subsystem="camera", state="up", reconnect=self.connected_once, **self.fields)
+            readiness.mark("camera" + self.suffix)
+            if self.connected_once:
+                m_reconnects.inc(subsystem="camera", line=self.fields.get("line", ""))
+            self.connected_once = True
+
+    def check(self):
+        """Проверка и автоматическое переподключение камеры."""
+        while self.cap is None or not self.cap.isOpened():
+            log(f"{self.tag}🔄 Камера недоступна, пытаюсь подключить...", source="camera" + self.suffix)
+            self.connect()
+            if self.cap is None or not self.cap.isOpened():
+                time.sleep(3)
+            else:
+                break
+
+    def publish_preview(self, frame):
+        """Для веб — только когда кто-то смотрит, в темпе и качестве PreviewControl."""
+        viewers = self.hub.viewers()
+        self.preview.adapt(viewers)
+        if self.preview.due(viewers):
+            jpeg = self.preview.encode(frame)
+            if jpeg is None:
+                log(f"{self.tag}⚠ Ошибка JPEG-кодирования")
+            else:
+                # кодируем один раз — дальше кадр раздаётся всем клиентам как есть
+                self.hub.publish(jpeg)
+        self.preview.report(viewers)
+
+    def loop(self):
+        """
+        Поток камеры: читает кадр, сохраняет последний кадр для анализа,
+        пока есть зрители — готовит JPEG для веба (PreviewControl).
+        При потере камеры выполняется автоматическое переподключение.
+        """
+        source = "camera" + self.suffix
+
+        # Первое подключение
+        self.check()
+
+        fps_t0, fps_frames = time.monotonic(), 0
+        first_frame = True
+        oversize_logged = False
+
+        while True:
+            # если камера отсутствует — пробуем переподключить
+            if self.cap is None or not self.cap.isOpened():
+                log(f"{self.tag}🔄 Камера недоступна, переподключаю...", source=source)
+                self.check()
+                time.sleep(1)
+                continue
+
+            # пробуем прочитать кадр
+            ret, frame = self.cap.read()
+
+            if not ret or frame is None:
+                if self.replay and getattr(self.cap, "finished", False):
+                    log(f"{self.tag}⏹ Запись кадров закончилась")
+                    return
+                log(f"{self.tag}⚠ Не удалось прочитать кадр — камера возможно отключилась", source=source)
+                events.emit("conn", subsystem="camera", state="down", **self.fields)
+                m_lost.inc(subsystem="camera", line=self.fields.get("line", ""))
+                try:
+                    self.cap.release()
+                except Exception:
+                    pass
+                self.cap = None
+                time.sleep(1)
+                continue
+
+            now = time.time()
+            ts = self.cap.timestamp if self.replay else now
+
+            stored = True
+            if self.ring is not None:
+                # многопроцессный режим: кадр — в общую память, превью кодирует процесс веба
+                stored = self.ring.write(frame, ts, now) > 0
+                if not stored:
+                    # кадр больше слота общей памяти: анализ его не увидит — настройку надо исправить
+                    m_frames_oversize.inc(camera=self.name)
+                    if not oversize_logged:
+                        log(f"{self.tag}❌ Кадр {frame.shape[1]}x{frame.shape[0]} не помещается в общую память "
+                            f"(FRAME_RING_SHAPE {FRAME_RING_SHAPE[1]}x{FRAME_RING_SHAPE[0]}) — "
+                            f"кадры не доходят до анализа")
+                        events.emit("frame_oversize", shape=list(frame.shape), **self.fields)
+                        oversize_logged = True
+            else:
+                # сохраняем сырой кадр для анализа
+                with self.lock:
+                    self.frame = frame.copy()
+                    self.frame_time = now
+                    self.frame_ts = ts
+                    self.seq += 1
+                    self.buffer.append((self.frame, ts, self.seq, now))
+            if first_frame and stored:
+                readiness.mark("first_frame" + self.suffix)
+                first_frame = False
+
+            m_frames.inc()
+            fps_frames += 1
+            if time.monotonic() - fps_t0 >= 1.0:
+                m_fps.set(round(fps_frames / (time.monotonic() - fps_t0), 2), camera=self.name)
+                fps_t0, fps_frames = time.monotonic(), 0
+
+            if self.ring is None:
+                self.publish_preview(frame)
+
+            if not self.replay:
+                time.sleep(0.1)   # частота опроса камеры (запись держит темп сама)
+
+
+def current_params():
+    """(версия, параметры) детектора; до запуска main — DETECTOR_PARAMS как версия 0."""
+    if param_store is None:
+        return 0, DETECTOR_PARAMS
+    return param_store.get()
+
+
+def load_reference():
+    """Эталон для DEFECT_DETECTOR = "reference" (memory map); None — пятна по порогам HSV."""
+    if DEFECT_DETECTOR != "reference":
+        return None
+    try:
+        model = ReferenceModel.load(REFERENCE_FILE, REFERENCE_SIGMA, REFERENCE_MIN_DIFF)
+    except Exception as e:
+        log(f"⚠ Эталон {REFERENCE_FILE} не загружен ({e}), пятна ищутся по порогам HSV")
+        return None
+    log(f"🧬 Эталон годного изделия: {model.meta.get('samples', '?')} изделий, "
+        f"построен {model.meta.get('created', '?')}")
+    return model
+
+
+def load_params() -> ParamStore:
+    """Параметры детектора из PARAMS_FILE; негодный файл — DETECTOR_PARAMS новой версией."""
+    store = ParamStore(DETECTOR_PARAMS, PARAMS_FILE)
+    if store.load_error:
+        log(f"⚠ Параметры {PARAMS_FILE} не загружены ({store.load_error}), "
+            f"работаем с настройками по умолчанию — версия {store.get()[0]}")
+    return store
+
+
+def load_classifier():
+    """Модель для VERDICT_MODE = "classifier"; None — брак по наличию пятен."""
+    if VERDICT_MODE != "classifier":
+        return None
+    try:
+        model = LearnedClassifier.load(CLASSIFIER_FILE)
+    except Exception as e:
+        log(f"⚠ Классификатор {CLASSIFIER_FILE} не загружен ({e}), брак — по наличию пятен")
+        return None
+    meta = model.meta
+    log(f"🧮 Классификатор {meta['model']}: {meta['samples']} изделий (брака {meta['rejects']}), "
+        f"обучен {meta.get('created', '?')}")
+    detector = "reference" if reference is not None else "hsv"
+    if meta.get("defect_detector") != detector:
+        log(f"⚠ Классификатор обучен на пятнах детектора {meta.get('defect_detector')}, "
+            f"а сейчас работает {detector} — решения могут быть хуже")
+    return model
+
+
+def analyze_and_decide(frame_bgr, params, deadline=None) -> tuple[int, dict]:
+    """
+    Анализ кадра и решение, как на линии: (код, результат analyze_product).
+    Пятна — по эталону, если он загружен; решение — классификатором (VERDICT_MODE)
+    или по наличию пятен. Без метрик и лога — этим же путём идёт предпросмотр параметров.
+    """
+    result = analyze_product(frame_bgr, params, ELLIPSE_SCALE, analysis_pool, deadline, reference)
+    if classifier is not None:
+        t = time.perf_counter()
+        verdict = classifier.verdict(crop_zone(frame_bgr, params), result, params, deadline)
+        result["timings"]["classifier"] = time.perf_counter() - t
+    else:
+        verdict = verdict_of(result)
+    return verdict, result
 
-        with frame_lock:
-            last_jpeg = jpeg.tobytes()
 
-        time.sleep(0.1)   # частота обновления картинки
+def process_and_classify(frame_bgr, deadline=None, params=None, tag=""):
+    """
+    Логика анализа кадра: (код, результат analyze_product),
+    код: 1 – ОК, 2 – брак, 0 – нет решения.
+    Эллипсы изделий + чёрные пятна внутри них (halva_detector);
+    решение — по наличию пятен или моделью classifier (VERDICT_MODE).
+    Оверлей здесь не рисуется — только по запросу /overlay.
+    deadline — при превышении бюджета бросает AnalysisTimeout.
+    params — набор параметров (по умолчанию текущий из param_store).
+    tag — приставка сообщений лога (линия).
+    """
+    global last_analysis
+
+    if params is None:
+        params = current_params()[1]
+
+    t0 = time.perf_counter()
+    verdict, result = analyze_and_decide(frame_bgr, params, deadline)
+    t1 = time.perf_counter()
+    m_stage.observe(t1 - t0, stage="total")
+    for stage, seconds in result["timings"].items():
+        m_stage.observe(seconds, stage=stage)
+
+    trace = tracer.active()
+    if trace is not None:
+        # стадии analyze_product идут подряд — раскладываем их внутри общего отрезка
+        trace.add("analyze_product", t0, t1, ellipses=len(result["ellipses"]),
+                  spots=len(result["defects"]["area"]))
+        t = t0
+        for stage, seconds in result["timings"].items():
+            trace.add(stage, t, t + seconds)
+            t += seconds
+
+    with frame_lock:
+        last_analysis = (frame_bgr, result, params)
+
+    if verdict == 0:
+        log(f"{tag}⚠ Изделия в зонах не найдены", dedup=False)
+    elif verdict == 2:
+        defects = result["defects"]
+        zones = sorted({int(z) + 1 for z in defects["zone"] if z >= 0})
+        if len(defects["area"]):
+            log(f"{tag}🔍 Найдено пятен: {len(defects['area'])}, "
+                f"макс. площадь {int(defects['area'].max())}, зоны {zones}", dedup=False)
+        if "rejected" in result:
+            centers, zone_r = detection_zones(params), params['Zone Radius']
+            rejected = sorted(ellipse_zone(result["ellipses"][k], centers, zone_r) + 1 for k in result["rejected"])
+            log(f"{tag}🧮 Классификатор: брак в зонах {rejected}", dedup=False)
+    return verdict, result
 
 
 # ============================================================
@@ -366,6 +1440,14 @@ def camera_loop():
 # ============================================================
 
 def web_loop():
+    cameras = {c.name: c for line in lines for c in line.cameras}
+    first_camera = next(iter(cameras.values()))
+
+    def camera_of(path: str):
+        """Камера из ?camera=имя (по умолчанию — первая); None — такой нет."""
+        name = parse_qs(urlsplit(path).query).get("camera", [None])[0]
+        return first_camera if name is None else cameras.get(name)
+
     HTML_PAGE = f"""
     <!doctype html>
     <html>
@@ -378,24 +1460,270 @@ def web_loop():
         </style>
     </head>
     <body>
-        <img id="cam" src="/snapshot" alt="camera">
+        <img id="cam" src="/stream" alt="camera">
+    </body>
+    </html>
+    """
+
+    if len(cameras) > 1:
+        # несколько камер — сетка, у каждой свой поток
+        cells = "".join(f'<figure><img src="/stream?camera={quote(name)}" alt="{name}">'
+                        f'<figcaption>{name}</figcaption></figure>' for name in cameras)
+        HTML_PAGE = f"""
+    <!doctype html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Камеры</title>
+        <style>
+            html,body {{margin:0;height:100%;background:#000;color:#ddd;font-family:sans-serif}}
+            body {{display:grid;grid-template-columns:repeat(auto-fit,minmax(480px,1fr));gap:4px}}
+            figure {{margin:0;position:relative}}
+            img {{width:100%;height:100%;object-fit:contain}}
+            figcaption {{position:absolute;top:4px;left:8px}}
+        </style>
+    </head>
+    <body>
+        {cells}
+    </body>
+    </html>
+    """
+
+    HISTORY_PAGE = """
+    <!doctype html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>История проверок</title>
+        <style>
+            body {font-family:sans-serif;background:#111;color:#ddd;margin:10px}
+            table {border-collapse:collapse}
+            td,th {border:1px solid #444;padding:4px 8px;vertical-align:top}
+            .v1 {color:#6c6} .v2 {color:#f66;font-weight:bold} .v0 {color:#fc3}
+            img {max-width:320px}
+        </style>
+    </head>
+    <body>
+        <a href="/" style="color:#8cf">← камера</a>
+        <table id="t"><tr><th>№</th><th>время</th><th>результат</th><th>ошибка</th>
+            <th>эллипсы</th><th>пятна</th><th>макс. площадь</th><th>мс</th><th>парам.</th><th>кадр</th></tr></table>
+        <script>
+            var names = {0: "нет решения", 1: "ОК", 2: "брак"};
+            function load() {
+                fetch("/api/history").then(r => r.json()).then(function(items) {
+                    var rows = ['<tr><th>№</th><th>время</th><th>результат</th><th>ошибка</th>' +
+                        '<th>эллипсы</th><th>пятна</th><th>макс. площадь</th><th>мс</th><th>парам.</th><th>кадр</th></tr>'];
+                    items.forEach(function(e) {
+                        var t = new Date(e.t_trigger * 1000).toLocaleTimeString();
+                        var ms = Math.round((e.t_result - e.t_trigger) * 1000);
+                        var img = e.has_thumb ? '<a href="/history/' + e.seq + '.jpg"><img src="/history/' +
+                            e.seq + '.jpg"></a>' : '';
+                        rows.push('<tr><td>' + e.seq + '</td><td>' + t + '</td><td class="v' + e.verdict + '">' +
+                            names[e.verdict] + '</td><td>' + e.error + '</td><td>' + e.ellipses.length +
+                            '</td><td>' + e.spots + '</td><td>' + e.max_area + '</td><td>' + ms +
+                            '</td><td><a href="/params">v' + e.params_version + '</a></td><td>' + img + '</td></tr>');
+                    });
+                    document.getElementById("t").innerHTML = rows.join("");
+                });
+            }
+            load();
+            setInterval(load, 2000);
+        </script>
+    </body>
+    </html>
+    """
+
+    PARAMS_PAGE = """
+    <!doctype html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Параметры детектора</title>
+        <style>
+            body {font-family:sans-serif;background:#111;color:#ddd;margin:10px;display:flex;gap:16px}
+            #form {min-width:360px}
+            label {display:flex;justify-content:space-between;gap:8px;margin:2px 0}
+            input[type=range] {width:180px}
+            input[type=number] {width:60px}
+            img {max-width:100%;max-height:95vh}
+            button {margin:8px 4px 0 0;padding:6px 12px}
+            #msg {margin-top:8px;white-space:pre-wrap}
+        </style>
+    </head>
+    <body>
+        <div id="form">
+            <a href="/" style="color:#8cf">← камера</a> <a href="/history" style="color:#8cf">история</a>
+            <h3>Параметры <span id="ver"></span></h3>
+            <div id="fields"></div>
+            <button onclick="apply()">Применить</button>
+            <button onclick="load()">Сбросить к текущим</button>
+            <div id="verdict"></div>
+            <div id="msg"></div>
+        </div>
+        <div><img id="preview" alt="предпросмотр на последнем кадре"></div>
         <script>
-            setInterval(function(){{
-                var img = document.getElementById("cam");
-                img.src = "/snapshot?t=" + Date.now();
-            }}, 200);
+            var limits = {}, timer = null;
+            function values() {
+                var v = {};
+                Object.keys(limits).forEach(function(k) {
+                    v[k] = parseInt(document.getElementById("n_" + k).value);
+                });
+                return v;
+            }
+            function changed(k, src) {
+                var other = document.getElementById((src === "r" ? "n_" : "r_") + k);
+                other.value = document.getElementById(src + "_" + k).value;
+                clearTimeout(timer);
+                timer = setTimeout(preview, 300);
+            }
+            function preview() {
+                fetch("/params/preview.jpg?" + new URLSearchParams(values())).then(function(r) {
+                    if (!r.ok) { return r.text().then(function(t) { msg.textContent = t; }); }
+                    msg.textContent = "";
+                    verdict.textContent = "Предпросмотр: " + verdictNames[r.headers.get("X-Verdict")] +
+                        ", эллипсов " + r.headers.get("X-Ellipses") + ", пятен " + r.headers.get("X-Spots");
+                    return r.blob().then(function(b) {
+                        var img = document.getElementById("preview");
+                        URL.revokeObjectURL(img.src);
+                        img.src = URL.createObjectURL(b);
+                    });
+                });
+            }
+            function load() {
+                fetch("/api/params").then(r => r.json()).then(function(d) {
+                    limits = d.limits;
+                    document.getElementById("ver").textContent = "(версия " + d.version + ")";
+                    var html = "";
+                    Object.keys(d.params).forEach(function(k) {
+                        var lim = limits[k];
+                        html += '<label>' + k + ' <input type="range" id="r_' + k + '" min="' + lim[0] +
+                            '" max="' + lim[1] + '" value="' + d.params[k] + '" oninput="changed(\'' + k +
+                            '\', \'r\')"><input type="number" id="n_' + k + '" min="' + lim[0] + '" max="' +
+                            lim[1] + '" value="' + d.params[k] + '" onchange="changed(\'' + k + '\', \'n\')"></label>';
+                    });
+                    document.getElementById("fields").innerHTML = html;
+                    preview();
+                });
+            }
+            function apply() {
+                fetch("/params", {method: "POST", body: JSON.stringify({params: values()})})
+                    .then(r => r.json()).then(function(d) {
+                        if (d.errors) { msg.textContent = "Не применено:\n" + d.errors.join("\n"); return; }
+                        msg.textContent = "Применена версия " + d.version + ", изменено: " + JSON.stringify(d.changed);
+                        document.getElementById("ver").textContent = "(версия " + d.version + ")";
+                    });
+            }
+            var msg = document.getElementById("msg"), verdict = document.getElementById("verdict");
+            var verdictNames = {none: "нет решения", ok: "ОК", reject: "брак"};
+            load();
         </script>
     </body>
     </html>
     """
 
+    # код итога для заголовка X-Verdict (заголовки — только ASCII; подпись — в JS)
+    VERDICT_CODES = {0: "none", 1: "ok", 2: "reject"}
+
     class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            global last_jpeg
+        def do_POST(self):
+            if not self.path.startswith("/params"):
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                # можно прислать только изменённые параметры — остальные берём текущие
+                params = dict(current_params()[1]) | dict(body.get("params", {}))
+                version, changed, errors = param_store.update(params, source=self.client_address[0])
+            except Exception as e:
+                version, changed, errors = None, {}, [f"ошибка запроса: {e}"]
+
+            if errors:
+                self.send_body(json.dumps({"errors": errors}, ensure_ascii=False).encode("utf-8"),
+                               "application/json; charset=utf-8", 400)
+                return
+            if changed:
+                log(f"🎛 Параметры детектора: версия {version} применена ({self.client_address[0]}), "
+                    f"изменено: {changed}")
+                events.emit("params", version=version, changed=changed, source=self.client_address[0])
+            self.send_body(json.dumps({"version": version, "changed": changed}, ensure_ascii=False)
+                           .encode("utf-8"), "application/json; charset=utf-8")
 
-            if self.path.startswith("/snapshot"):
+        def do_GET(self):
+            if self.path.startswith("/stream"):
+                self.send_stream()
+            elif self.path.startswith("/api/history"):
+                # ?since=N — только записи новее изделия N
+                since = -1
+                if "since=" in self.path:
+                    try:
+                        since = int(self.path.split("since=", 1)[1].split("&")[0])
+                    except ValueError:
+                        pass
+                items = [] if history is None else history.list(since)
+                self.send_body(json.dumps(items, ensure_ascii=False).encode("utf-8"),
+                               "application/json; charset=utf-8")
+            elif self.path.startswith("/history/"):
+                # /history/<номер>.jpg — миниатюра с разметкой
+                try:
+                    seq = int(self.path[len("/history/"):].split(".")[0])
+                except ValueError:
+                    seq = -1
+                data = None if history is None else history.thumb(seq)
+                if data is None:
+                    self.send_error(404, "Миниатюры нет (ещё не готова или вытеснена)")
+                    return
+                self.send_body(data, "image/jpeg")
+            elif self.path.startswith("/history"):
+                self.send_body(HISTORY_PAGE.encode("utf-8"), "text/html; charset=utf-8")
+            elif self.path.startswith("/api/params"):
+                version, params = current_params()
+                data = {"version": version, "params": dict(params), "limits": PARAM_LIMITS}
+                self.send_body(json.dumps(data, ensure_ascii=False).encode("utf-8"),
+                               "application/json; charset=utf-8")
+            elif self.path.startswith("/params/preview"):
+                self.send_params_preview()
+            elif self.path.startswith("/params"):
+                self.send_body(PARAMS_PAGE.encode("utf-8"), "text/html; charset=utf-8")
+            elif self.path.startswith("/api/status"):
+                # 200 — готова к проверке изделий, 503 — ещё поднимается
+                state = readiness.state()
+                if proc_state is None:
+                    state["lines"] = {line.name: line.status() for line in lines}
+                self.send_body(json.dumps(state, ensure_ascii=False).encode("utf-8"),
+                               "application/json; charset=utf-8", 200 if state["ready"] else 503)
+            elif self.path.startswith("/metrics.json"):
+                self.send_body(render_json().encode("utf-8"), "application/json; charset=utf-8")
+            elif self.path.startswith("/metrics"):
+                self.send_body(render_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            elif self.path.startswith("/overlay"):
+                # разметка последнего изделия рисуется только по запросу
                 with frame_lock:
-                    data = last_jpeg
+                    analysis = last_analysis
+
+                if analysis is None:
+                    self.send_error(503, "Изделий ещё не было")
+                    return
+
+                frame, result, params = analysis
+                img = render_overlay(frame, params, result)
+                ok, jpeg = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+                if not ok:
+                    self.send_error(500, "Ошибка JPEG-кодирования")
+                    return
+
+                data = jpeg.tobytes()
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif self.path.startswith("/snapshot"):
+                camera = camera_of(self.path)
+                if camera is None:
+                    self.send_error(404, "Нет такой камеры")
+                    return
+                data = camera.hub.snapshot()
 
                 if data is None:
                     self.send_error(503, "Кадр ещё не готов")
@@ -412,12 +1740,88 @@ def web_loop():
                 self.end_headers()
                 self.wfile.write(HTML_PAGE.encode("utf-8"))
 
+        def send_params_preview(self):
+            """
+            Разметка последнего кадра с параметрами из строки запроса
+            (не применяя их). Итог — в заголовках X-Verdict/X-Ellipses/X-Spots.
+            """
+            params = dict(current_params()[1])
+            try:
+                for k, v in parse_qs(urlsplit(self.path).query).items():
+                    params[k] = int(v[0])
+            except ValueError as e:
+                self.send_body(f"Неверное значение: {e}".encode("utf-8"), "text/plain; charset=utf-8", 400)
+                return
+            errors = validate_params(params)
+            if errors:
+                self.send_body("\n".join(errors).encode("utf-8"), "text/plain; charset=utf-8", 400)
+                return
+
+            frame, _, frame_no, _ = first_camera.latest(copy=frame_ring is not None)
+            if frame is None:
+                self.send_error(503, "Кадр ещё не готов")
+                return
+
+            # тот же путь, что на линии: эталон и классификатор, если они включены
+            verdict, result = analyze_and_decide(frame, params)
+            ok, jpeg = cv2.imencode(".jpg", render_overlay(frame, params, result),
+                                    [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+            if not ok:
+                self.send_error(500, "Ошибка JPEG-кодирования")
+                return
+            self.send_body(jpeg.tobytes(), "image/jpeg", headers={
+                "X-Verdict": VERDICT_CODES[verdict],
+                "X-Ellipses": str(len(result["ellipses"])),
+                "X-Spots": str(len(result["defects"]["area"])),
+            })
+
+        def send_body(self, data: bytes, content_type: str, code: int = 200, headers: dict | None = None):
+            self.send_response(code)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_stream(self):
+            """MJPEG-поток (multipart/x-mixed-replace) из JpegHub камеры (?camera=имя)."""
+            camera = camera_of(self.path)
+            if camera is None:
+                self.send_error(404, "Нет такой камеры")
+                return
+            hub = camera.hub
+            self.send_response(200)
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            self.send_header("Cache-Control", "no-cache, no-store")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            # зависший клиент не держит поток вечно
+            self.connection.settimeout(10)
+
+            hub.add_client()
+            seq = 0
+            try:
+                while True:
+                    seq, part = hub.wait_next(seq, timeout=5.0)
+                    if part is None:
+                        continue  # камера молчит — ждём дальше
+                    self.wfile.write(part)
+                    self.wfile.flush()
+            except OSError:
+                pass  # браузер закрыл вкладку или не успевает читать
+            finally:
+                hub.remove_client()
+
         def log_message(self, format, *args):
             # глушим стандартный http.server лог
             return
 
-    server = HTTPServer(("0.0.0.0", HTTP_PORT), Handler)
+    # у каждого клиента свой поток — зрители не задерживают друг друга
+    server = ThreadingHTTPServer(("0.0.0.0", HTTP_PORT), Handler)
+    server.daemon_threads = True
     log(f"🌐 Веб-сервер запущен: http://localhost:{HTTP_PORT}")
+    readiness.mark("web")
     server.serve_forever()
 
 
@@ -425,33 +1829,82 @@ def web_loop():
 #  ЗАПУСК
 # ============================================================
 
-def main():
-    # первая попытка подключения к ПЛК (если не получится – потоки всё равно стартуют)
-    connect_plc()
+def monitor_loop():
+    """
+    Контроль раз в секунду: флаг bStartGrab и отчёт имитации ПЛК по линиям;
+    раз в CAPACITY_REPORT_S — пропускная способность линий.
+    """
+    ticks = 0
+    cpu_t0, cpu_0 = time.monotonic(), time.process_time()
+    while True:
+        time.sleep(1)
+        ticks += 1
+        for line in lines:
+            # для контроля можно периодически смотреть состояние флага
+            val = line.plc.read("bStartGrab")
+            line.log(f"bStartGrab = {val}")
+            if line.plc.sim is not None and ticks % 10 == 0:
+                line.log(line.plc.sim.report())
+        if CAPACITY_REPORT_S > 0 and ticks % CAPACITY_REPORT_S == 0:
+            # загрузка CPU процессом (доля всех ядер); в PROCESS_MODE анализ идёт в другом процессе
+            now, cpu = time.monotonic(), time.process_time()
+            load = None if process_role is not None else (cpu - cpu_0) / (now - cpu_t0) / (os.cpu_count() or 1)
+            cpu_t0, cpu_0 = now, cpu
+            report_capacity(load)
 
-    t_web = threading.Thread(target=web_loop, daemon=True)
-    t_cam = threading.Thread(target=camera_loop, daemon=True)
-    t_plc = threading.Thread(target=plc_logic_loop, daemon=True)
 
-    t_web.start()
-    t_cam.start()
-    t_plc.start()
+def main():
+    global analysis_pool, history, param_store, reference, classifier, lines
+
+    problems = lines_problems()
+    if problems:
+        log(f"❌ Ошибка в LINES: {'; '.join(problems)}")
+        return
+    if PROCESS_MODE and len(LINES) > 1:
+        log("⚠ Многопроцессный режим — только для одной линии, линии запускаются потоками")
+    elif PROCESS_MODE:
+        run_processes()
+        return
+
+    lines = build_lines()
+    if len(lines) > 1:
+        readiness.required = Readiness.lines_required(lines)
+        log("🏭 Линий: " + "; ".join(f"{line.name} (ПЛК {line.plc.url}, камеры "
+                                    f"{', '.join(str(c.source) for c in line.cameras)})" for line in lines))
+
+    # потоки OpenCV и пул анализа задаём явно, до старта рабочих потоков
+    pool_size = analysis_pool_size()
+    analysis_pool = configure_threads(CV_THREADS, pool_size)
+    log(f"🧵 Потоков OpenCV: {CV_THREADS}, пул анализа: {pool_size}")
+    reference = load_reference()
+    classifier = load_classifier()
+
+    history = InspectionHistory(HISTORY_SIZE, HISTORY_THUMB_WIDTH)
+    param_store = load_params()
+    log(f"🎛 Параметры детектора: версия {param_store.get()[0]}")
+    events.emit("start", frame_source=FRAME_SOURCE, plc_simulate=PLC_SIMULATE,
+                params_version=param_store.get()[0], lines=[line.name for line in lines])
+
+    # веб, камеры и ПЛК поднимаются параллельно: подключение к ПЛК (с импортом
+    # opcua) идёт в своём потоке и не задерживает камеры; готовность — readiness
+    threading.Thread(target=web_loop, daemon=True).start()
+    for line in lines:
+        for camera in line.cameras:
+            threading.Thread(target=camera.loop, daemon=True, name=f"camera {camera.name}").start()
+        threading.Thread(target=line.worker_loop, daemon=True, name=f"analysis {line.name}").start()
+        threading.Thread(target=line.logic_loop, daemon=True, name=f"plc {line.name}").start()
 
     log("▶ Главный цикл запущен. Нажми Ctrl+C для выхода.")
     try:
-        while True:
-            time.sleep(1)
-            # для контроля можно периодически смотреть состояние флага
-            val = safe_read("bStartGrab")
-            log(f"bStartGrab = {val}")
+        monitor_loop()
     except KeyboardInterrupt:
         log("⏹ Остановка программы...")
-        with plc_lock:
-            if plc_client is not None:
-                try:
-                    plc_client.disconnect()
-                except Exception:
-                    pass
+        for line in lines:
+            line.plc.disconnect()
+        events.emit("stop")
+        events.close()
+        tracer.close()
+        logger.close()  # дописать очередь лога на диск
 
 
 if __name__ == "__main__":
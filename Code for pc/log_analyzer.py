@@ -0,0 +1,345 @@
+"""
+log_analyzer.py
+Разбор логов рабочей программы за один проход.
+
+- Понимает оба формата: события halva_events.jsonl (EventLog)
+  и старый текстовый halva_log.txt ([0:00:10.208] ✅ Камера подключена),
+  включая сводки «— повторено N раз» асинхронного лога
+- Перезапуски программы определяются по событию start (JSONL) или по сбросу
+  времени от старта (текст); префикс роли «[plc] » многопроцессного режима
+  пропускается
+- Несколько линий: связь каждой линии/камеры (поле line/camera события или
+  префикс «[line1] » строки) отслеживается отдельно, счётчики — общие
+- Считает: время работы, изделия в час, результаты, перцентили времени цикла,
+  число переподключений ПЛК и камеры, интервалы между ними и длительность простоев
+- Файл читается построчно, в памяти только числа для перцентилей
+- Файлы передаются по порядку (старые → новые) и одного вида:
+  текст и JSONL одного и того же периода вместе дадут двойной счёт
+
+Запуск:
+    python log_analyzer.py halva_log.txt
+    python log_analyzer.py halva_events.1.jsonl halva_events.jsonl --json
+"""
+
+import argparse
+import json
+import re
+import sys
+from array import array
+
+import numpy as np
+
+# ---------- НАСТРОЙКИ ----------
+
+STORM_INTERVAL_S = 10.0     # переподключения чаще этого считаем «штормом»
+REORDER_S = 1.0             # шаг времени назад меньше этого — не перезапуск, а строки разных процессов
+
+# Ошибка изделия в текстовом логе по первому символу сообщения
+ERROR_KINDS = {"⏱": "timeout", "🌫": "quality"}
+
+LINE_RE = re.compile(r"^\[(?:(\d+) days?, )?(\d+):(\d\d):(\d\d)(?:\.(\d+))?\] (?:\[([\w/.-]+)\] )?(.*)$")
+REPEAT_RE = re.compile(r"^(.*) — повторено (\d+) раз за \d+ с$")
+RESULT_RE = re.compile(r"Результат анализа отправлен в ПЛК: (-?\d+)(?: \((\d+) мс\))?")
+
+# Текстовые сообщения старого формата → (вид события, подсистема, состояние)
+LEGACY_PATTERNS = [
+    ("📷 Новый объект под камерой", ("trigger", None, None)),
+    ("✅ Результат анализа отправлен в ПЛК", ("result", None, None)),
+    ("⏱ Превышен бюджет анализа", ("result_error", None, None)),
+    ("❌ Нет кадра с камеры для анализа", ("result_error", None, None)),
+    ("🌫 Нет годного кадра", ("result_error", None, None)),
+    ("✅ ПЛК: подключение по OPC UA выполнено", ("conn", "plc", "up")),
+    ("🔄 ПЛК: связь с ПЛК восстановлена", ("conn", "plc", "reconnect")),
+    ("⚠ Не удалось подключиться к ПЛК", ("conn", "plc", "fail")),
+    ("⚠ Подключились к ПЛК, но не удалось", ("conn", "plc", "probe_fail")),
+    ("⚠ Ошибка чтения", ("conn", "plc", "down")),
+    ("⚠ Ошибка записи", ("conn", "plc", "down")),
+    ("✅ Камера подключена", ("conn", "camera", "up")),
+    ("❌ Камера не обнаружена", ("conn", "camera", "fail")),
+    ("⚠ Не удалось прочитать кадр", ("conn", "camera", "down")),
+]
+
+
+def percentiles(values) -> dict:
+    """Медиана, p95, p99 и максимум (пусто — пустой словарь)."""
+    if len(values) == 0:
+        return {}
+    a = np.frombuffer(values, dtype=np.float64) if isinstance(values, array) else np.asarray(values)
+    return {"n": int(len(a)), "p50": round(float(np.percentile(a, 50)), 3),
+            "p95": round(float(np.percentile(a, 95)), 3), "p99": round(float(np.percentile(a, 99)), 3),
+            "max": round(float(a.max()), 3)}
+
+
+class Subsystem:
+    """
+    Связь одной подсистемы (plc / camera) в пределах запуска.
+    Состояние — отдельно по каждому ПЛК/камере (key: линия или камера), счётчики — общие.
+    """
+
+    def __init__(self):
+        self.connects = 0           # первые подключения в запусках
+        self.reconnects = 0
+        self.failures = 0           # неудачные попытки подключения
+        self.losses = 0             # потери связи в работе
+        self.intervals = array("d") # между переподключениями, с
+        self.outages = array("d")   # от потери/ошибки до восстановления, с
+        self.storms = 0             # переподключений чаще STORM_INTERVAL_S
+        self.reset()
+
+    def reset(self):
+        """Новый запуск программы: состояние связи неизвестно."""
+        self.links = {}             # key -> {"connected_once", "last_up", "down_since", "undo"}
+
+    def event(self, t: float, state: str, count: int = 1, reconnect: bool | None = None, key=None):
+        link = self.links.setdefault(key, {"connected_once": False, "last_up": None, "down_since": None,
+                                           "undo": None})
+        undo, link["undo"] = link["undo"], None
+        if state == "probe_fail":
+            # старые логи писали «связь восстановлена» до пробного чтения узлов:
+            # сразу следом за ним неудача пробы — это не подключение, а неудачная попытка
+            if undo is not None:
+                self._revert(link, undo)
+            state = "fail"
+        if state in ("fail", "down"):
+            if state == "fail":
+                self.failures += count
+            else:
+                self.losses += count
+            if link["down_since"] is None:
+                link["down_since"] = t
+            return
+
+        # up / reconnect
+        undo = {"count": count, "reconnect": False, "interval": False, "storm": False, "outage": False,
+                "prev": {k: link[k] for k in ("connected_once", "last_up", "down_since")}}
+        if reconnect is None:
+            reconnect = state == "reconnect" or link["connected_once"]
+        if reconnect:
+            self.reconnects += count
+            undo["reconnect"] = True
+            if link["last_up"] is not None and count == 1:
+                interval = t - link["last_up"]
+                self.intervals.append(interval)
+                undo["interval"] = True
+                if interval < STORM_INTERVAL_S:
+                    self.storms += 1
+                    undo["storm"] = True
+        else:
+            self.connects += count
+        if link["down_since"] is not None:
+            self.outages.append(t - link["down_since"])
+            undo["outage"] = True
+            link["down_since"] = None
+        link["connected_once"] = True
+        link["last_up"] = t
+        link["undo"] = undo
+
+    def _revert(self, link: dict, undo: dict):
+        """Отменить последнее подключение (см. probe_fail)."""
+        if undo["reconnect"]:
+            self.reconnects -= undo["count"]
+        else:
+            self.connects -= undo["count"]
+        if undo["interval"]:
+            self.intervals.pop()
+        if undo["storm"]:
+            self.storms -= 1
+        if undo["outage"]:
+            self.outages.pop()
+        link.update(undo["prev"])
+
+    def summary(self) -> dict:
+        return {"connects": self.connects, "reconnects": self.reconnects, "failures": self.failures,
+                "losses": self.losses, "storms": self.storms,
+                "reconnect_interval_s": percentiles(self.intervals),
+                "outage_s": percentiles(self.outages)}
+
+
+class LogAnalyzer:
+    """Потоковый разбор: feed(строка) для каждой строки, затем report()."""
+
+    def __init__(self):
+        self.sessions = 0
+        self.uptime = 0.0           # сумма длительностей запусков, с
+        self.session_start = None   # время от старта (текст) или unix-время (JSONL) начала запуска
+        self.session_last = None
+        self.products = 0
+        self.results = {}
+        self.errors = {}
+        self.cycle_ms = array("d")
+        self.trigger_t = None
+        self.lines = 0
+        self.bad_lines = 0
+        self.subsystems = {"plc": Subsystem(), "camera": Subsystem()}
+
+    # ---------- запуски ----------
+
+    def _new_session(self, t: float):
+        self._close_session()
+        self.sessions += 1
+        self.session_start = self.session_last = t
+        self.trigger_t = None
+        for sub in self.subsystems.values():
+            sub.reset()
+
+    def _close_session(self):
+        if self.session_start is not None:
+            self.uptime += self.session_last - self.session_start
+        self.session_start = None
+
+    # ---------- разбор строк ----------
+
+    def feed(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        self.lines += 1
+        if line.startswith("{"):
+            self._feed_event(line)
+        else:
+            self._feed_text(line)
+
+    def _feed_event(self, line: str):
+        try:
+            ev = json.loads(line)
+            t, kind = float(ev["t"]), ev["ev"]
+        except Exception:
+            self.bad_lines += 1
+            return
+
+        # события разных потоков/процессов могут идти с небольшим отставанием
+        if kind == "start" or self.session_start is None or t < self.session_last - REORDER_S:
+            # для JSONL начало запуска — t минус время от старта
+            self._new_session(t - float(ev.get("up", 0.0)))
+        self.session_last = max(self.session_last, t)
+
+        if kind == "trigger":
+            self.products += 1
+        elif kind == "result":
+            self._result(ev.get("result", 0), ev.get("error", 0), ev.get("cycle_ms"))
+        elif kind == "conn" and ev.get("subsystem") in self.subsystems:
+            self.subsystems[ev["subsystem"]].event(t, ev.get("state", ""), reconnect=ev.get("reconnect"),
+                                                   key=ev.get("camera") or ev.get("line"))
+        elif kind == "stop":
+            self._close_session()
+
+    def _feed_text(self, line: str):
+        m = LINE_RE.match(line)
+        if m is None:
+            self.bad_lines += 1
+            return
+        days, h, mnt, sec, frac, tag, message = m.groups()
+        t = int(days or 0) * 86400 + int(h) * 3600 + int(mnt) * 60 + int(sec) + float("0." + (frac or "0"))
+
+        count = 1
+        rep = REPEAT_RE.match(message)
+        if rep is not None:
+            message, count = rep.group(1), int(rep.group(2))
+
+        kind = sub = state = None
+        for prefix, info in LEGACY_PATTERNS:
+            if message.startswith(prefix):
+                kind, sub, state = info
+                break
+
+        # каждый запуск пишет время от своего старта: сброс времени — новый запуск
+        # (строки дочерних процессов PROCESS_MODE могут идти с небольшим отставанием)
+        if self.session_start is None or t < self.session_last - REORDER_S:
+            self._new_session(0.0)
+        self.session_last = max(self.session_last, t)
+        if kind is None:
+            return
+
+        if kind == "trigger":
+            self.products += count
+            self.trigger_t = t
+        elif kind == "result":
+            r = RESULT_RE.search(message)
+            code, ms = (int(r.group(1)), r.group(2)) if r else (0, None)
+            if ms is None and self.trigger_t is not None:
+                ms = (t - self.trigger_t) * 1000  # старый лог без мс — по времени строк
+            for _ in range(count):
+                self._result(code, 0, None if ms is None else float(ms))
+            self.trigger_t = None
+        elif kind == "result_error":
+            for _ in range(count):
+                self._result(0, ERROR_KINDS.get(message[0], "no_frame"), None)
+            self.trigger_t = None
+        elif kind == "conn":
+            self.subsystems[sub].event(t, state, count, key=tag)
+
+    def _result(self, code, error, cycle_ms):
+        self.results[code] = self.results.get(code, 0) + 1
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+        if cycle_ms is not None:
+            self.cycle_ms.append(float(cycle_ms))
+
+    # ---------- итог ----------
+
+    def report(self) -> dict:
+        self._close_session()
+        hours = self.uptime / 3600
+        return {
+            "lines": self.lines,
+            "bad_lines": self.bad_lines,
+            "sessions": self.sessions,
+            "uptime_s": round(self.uptime, 1),
+            "products": self.products,
+            "products_per_hour": round(self.products / hours, 1) if hours > 0 else None,
+            "results": {str(k): v for k, v in sorted(self.results.items(), key=lambda kv: str(kv[0]))},
+            "errors": {str(k): v for k, v in self.errors.items()},
+            "cycle_ms": percentiles(self.cycle_ms),
+            "subsystems": {name: sub.summary() for name, sub in self.subsystems.items()},
+        }
+
+
+def format_report(r: dict) -> str:
+    def pct(p: dict, unit: str) -> str:
+        if not p:
+            return "—"
+        return (f"n={p['n']}, p50 {p['p50']} {unit}, p95 {p['p95']} {unit}, "
+                f"p99 {p['p99']} {unit}, макс {p['max']} {unit}")
+
+    hours = r["uptime_s"] / 3600
+    lines = [
+        f"Строк: {r['lines']} (не разобрано {r['bad_lines']}), запусков программы: {r['sessions']}",
+        f"Время работы: {hours:.2f} ч",
+        f"Изделий: {r['products']}, в час: {r['products_per_hour'] if r['products_per_hour'] is not None else '—'}",
+        f"Результаты: {r['results']}" + (f", ошибки: {r['errors']}" if r["errors"] else ""),
+        f"Время цикла: {pct(r['cycle_ms'], 'мс')}",
+    ]
+    names = {"plc": "ПЛК", "camera": "Камера"}
+    for name, s in r["subsystems"].items():
+        lines.append(f"{names.get(name, name)}: подключений {s['connects']}, переподключений {s['reconnects']} "
+                     f"(чаще {STORM_INTERVAL_S:.0f} с: {s['storms']}), неудачных попыток {s['failures']}, "
+                     f"потерь связи {s['losses']}")
+        lines.append(f"   интервал между переподключениями: {pct(s['reconnect_interval_s'], 'с')}")
+        lines.append(f"   простой до восстановления: {pct(s['outage_s'], 'с')}")
+    return "\n".join(lines)
+
+
+# ---------- ОСНОВНАЯ ЛОГИКА ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор логов рабочей программы халвы")
+    parser.add_argument("files", nargs="+", help="halva_log.txt и/или halva_events.jsonl (по порядку)")
+    parser.add_argument("--json", action="store_true", help="вывести итог в JSON")
+    args = parser.parse_args()
+
+    analyzer = LogAnalyzer()
+    for path in args.files:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                analyzer.feed(line)
+
+    report = analyzer.report()
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+    else:
+        print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# модули программы лежат рядом с папкой tests (не пакет)
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+from halva_log import AsyncLogger, EventLog  # noqa: E402
+
+
+def load_prog():
+    """«itog prog.py» — имя с пробелом, обычным import не загрузить."""
+    module = sys.modules.get("itog_prog")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("itog_prog", os.path.join(HERE, "itog prog.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["itog_prog"] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def prog(tmp_path, monkeypatch):
+    """Основная программа с логом и событиями во временной папке (не в halva_log.txt рядом с программой)."""
+    module = load_prog()
+    logger = AsyncLogger(str(tmp_path / "halva_log.txt"), module.START_TIME, console=False)
+    events = EventLog(str(tmp_path / "halva_events.jsonl"), module.START_TIME)
+    monkeypatch.setattr(module, "logger", logger)
+    monkeypatch.setattr(module, "events", events)
+    yield module
+    logger.close()
+    events.close()
@@ -0,0 +1,75 @@
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import numpy as np
+import pytest
+
+from halva_bus import READER_TIMEOUT_S, Channel, FrameRing
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(f"halva_test_{os.getpid()}", 3, (4, 6, 3), create=True)
+    yield ring
+    ring.close()
+
+
+def frame(h: int, w: int, value: int) -> np.ndarray:
+    return np.full((h, w, 3), value, np.uint8) + np.arange(w, dtype=np.uint8)[None, :, None]
+
+
+def test_write_read_round_trip(ring):
+    img = frame(4, 5, 10)
+
+    seq = ring.write(img, 100.5, 100.75)
+
+    assert seq == 1 and ring.latest_seq() == 1
+    latest_seq, view, ts, t_recv = ring.latest()
+    assert latest_seq == 1 and (ts, t_recv) == (100.5, 100.75)
+    np.testing.assert_array_equal(view, img)
+    np.testing.assert_array_equal(ring.copy(seq), img)
+    assert ring.valid(seq)
+
+
+def test_overwritten_slot_is_invalid(ring):
+    seqs = [ring.write(frame(2, 2, i), i, i) for i in range(4)]
+
+    assert seqs == [1, 2, 3, 4]
+    # слотов 3 — кадр 1 уже перезаписан кадром 4
+    assert not ring.valid(1) and ring.view(1) == (None, None, None) and ring.copy(1) is None
+    np.testing.assert_array_equal(ring.copy(4), frame(2, 2, 3))
+
+
+def test_oversize_frame_is_not_written(ring):
+    ring.write(frame(4, 6, 1), 1.0, 1.0)
+
+    assert ring.write(frame(5, 6, 2), 2.0, 2.0) == 0
+    assert ring.write(frame(4, 6, 3).astype(np.uint16), 3.0, 3.0) == 0
+    assert ring.latest_seq() == 1
+    np.testing.assert_array_equal(ring.latest()[1], frame(4, 6, 1))
+
+
+def test_channel_round_trip_and_timeout():
+    channel = Channel(mp.get_context("spawn"))
+    channel.put({"seq": 1})
+
+    assert channel.get(timeout=2) == {"seq": 1}
+    with pytest.raises(queue.Empty):
+        channel.get(timeout=0.05)
+    assert channel.reader_alive()
+
+
+def test_channel_drops_records_for_dead_reader():
+    channel = Channel(mp.get_context("spawn"))
+    channel.last_read.value = time.time() - READER_TIMEOUT_S - 1     # читатель упал и не ждёт
+
+    for i in range(3):
+        assert channel.put(i)
+    deadline = time.monotonic() + 2
+    while channel.dropped < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert not channel.reader_alive() and channel.dropped == 3
+    assert not channel.reader.poll(0.05)
@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+import pytest
+
+from halva_classifier import FEATURE_NAMES, product_features
+from halva_detector import DEFAULT_PARAMS, AnalysisTimeout, Deadline
+
+
+def features_for_hue(hue: int) -> dict:
+    """Признаки одного эллипса, залитого цветом с тоном hue (OpenCV, 0..179)."""
+    hsv = np.full((200, 200, 3), (hue, 200, 200), np.uint8)
+    img = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    result = {"ellipses": [(100, 100, 60, 40, 0)],
+              "defects": {"area": np.zeros(0, np.int32), "ellipse": np.zeros(0, np.int32)}}
+    return dict(zip(FEATURE_NAMES, product_features(img, result, DEFAULT_PARAMS)[0]))
+
+
+def test_hue_features_wrap_around():
+    # красный по обе стороны нуля: H = 178 и H = 2 — соседние тона, а не противоположные
+    low, high, cyan = features_for_hue(2), features_for_hue(178), features_for_hue(90)
+
+    assert abs(low["h_cos"] - high["h_cos"]) < 0.01
+    assert abs(low["h_sin"] + high["h_sin"]) < 0.2
+    assert cyan["h_cos"] < -0.9
+    assert low["h_spread"] < 0.05
+
+
+def test_features_respect_deadline():
+    img = np.zeros((200, 200, 3), np.uint8)
+    result = {"ellipses": [(100, 100, 60, 40, 0)],
+              "defects": {"area": np.zeros(0, np.int32), "ellipse": np.zeros(0, np.int32)}}
+    expired = Deadline(0.001, start=0.0)
+
+    with pytest.raises(AnalysisTimeout) as e:
+        product_features(img, result, DEFAULT_PARAMS, expired)
+    assert e.value.stage == "features"
@@ -0,0 +1,133 @@
+import cv2
+import numpy as np
+
+from halva_detector import (
+    DEFAULT_PARAMS, DEFAULT_QUALITY_LIMITS, MIN_SPOT_AREA, analyze_product, compare_ellipses, configure_threads,
+    detection_zones, extract_defects, frame_quality, hsv_bounds, locate_ellipses, pick_best_frame,
+    white_mask_outside_ellipses,
+)
+
+
+def synthetic_crop(params: dict, axes=((120, 95), (110, 100), (125, 90), (115, 105)),
+                   background: int = 20) -> np.ndarray:
+    """Обрезанный кадр: светлые эллипсы изделий в зонах детекции на тёмном фоне."""
+    img = np.full((params['Zone Height'], params['Zone Width'], 3), background, np.uint8)
+    for (zx, zy), (ax, ay), angle in zip(detection_zones(params), axes, (0, 20, 45, 70)):
+        cv2.ellipse(img, (zx, zy), (ax, ay), angle, 0, 360, (150, 190, 210), -1)
+    return img
+
+
+def full_frame(params: dict, crop: np.ndarray) -> np.ndarray:
+    """Кадр камеры с обрезанной зоной crop на своём месте."""
+    frame = np.zeros((params['Zone Y'] + params['Zone Height'], params['Zone X'] + params['Zone Width'], 3),
+                     np.uint8)
+    frame[params['Zone Y']:, params['Zone X']:] = crop
+    return frame
+
+
+def test_pyramid_matches_full_resolution():
+    params = DEFAULT_PARAMS
+    img = synthetic_crop(params)
+    lower, upper = hsv_bounds(params)
+    args = (lower, upper, detection_zones(params), params['Zone Radius'])
+
+    full = locate_ellipses(img, *args, scale=1)
+    pyramid = locate_ellipses(img, *args, scale=4)
+
+    assert len(full) == 3
+    cmp = compare_ellipses(full, pyramid)
+    assert cmp["matched"] == 3 and cmp["extra"] == 0
+    assert cmp["center_err_max"] <= 2.0
+    assert cmp["axis_err_max"] <= 3
+
+
+def test_spot_area_is_contour_area():
+    """Порог MIN_SPOT_AREA — по площади контура, как в настроечной программе, а не по числу пикселей."""
+    img = np.full((60, 120, 3), 200, np.uint8)
+    img[10:14, 10:14] = 0        # 16 пикселей, контур 3 x 3 = 9 — не пятно
+    img[10:15, 40:45] = 0        # 25 пикселей, контур 4 x 4 = 16 — пятно
+    img[30:32, 60:110] = 0       # 100 пикселей, контур 1 x 49 = 49 — пятно
+    img[40:41, 10:60] = 0        # линия в пиксель: контур нулевой площади — не пятно
+    lower, upper = np.array([0, 0, 0], np.uint8), np.array([180, 255, 60], np.uint8)
+
+    defects = extract_defects(img, lower, upper)
+
+    assert sorted(defects["area"].tolist()) == [16, 49]
+    contours, _ = cv2.findContours(cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), lower, upper),
+                                   cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    expected = sorted(int(a) for a in map(cv2.contourArea, contours) if a > MIN_SPOT_AREA)
+    assert sorted(defects["area"].tolist()) == expected
+
+
+def test_black_spot_same_on_runtime_and_tuning_paths():
+    params = DEFAULT_PARAMS | {"LVBlack": 0}
+    img = np.full((300, 400, 3), (150, 190, 210), np.uint8)
+    ellipses = [(100, 150, 80, 60, 30), (300, 150, 70, 70, 0)]
+    img[144:156, 94:106] = 0            # совсем чёрное пятно внутри изделия
+    img[10:30, 180:200] = 0             # и вне изделий — не считается ни там, ни там
+    black_min, black_max = hsv_bounds(params, 'Black')
+
+    runtime = extract_defects(img, black_min, black_max, ellipses)
+    tuning = extract_defects(white_mask_outside_ellipses(img, ellipses), black_min, black_max)
+
+    assert runtime["area"].tolist() == tuning["area"].tolist() == [121]
+    assert runtime["bbox"].tolist() == tuning["bbox"].tolist() == [[94, 144, 12, 12]]
+
+
+def test_pool_gives_same_defects_as_sequential():
+    params = DEFAULT_PARAMS
+    crop = synthetic_crop(params, background=0)         # чёрный фон не попадает в пятна по LVBlack
+    for zx, zy in detection_zones(params):
+        crop[zy - 20:zy - 10, zx + 15:zx + 25] = 40     # по пятну в каждом изделии
+    frame = full_frame(params, crop)
+
+    assert configure_threads(1, 0) is None
+    pool = configure_threads(1, 4)
+    try:
+        parallel = analyze_product(frame, params, pool=pool)
+    finally:
+        pool.shutdown()
+    sequential = analyze_product(frame, params)
+
+    assert parallel["ellipses"] == sequential["ellipses"]
+    assert len(sequential["defects"]["area"]) == len(sequential["ellipses"]) > 0
+    for key in sequential["defects"]:
+        assert sorted(map(str, parallel["defects"][key].tolist())) == \
+            sorted(map(str, sequential["defects"][key].tolist()))
+
+
+def test_quality_gate_rejects_blur_exposure_and_empty_frames():
+    params, limits = DEFAULT_PARAMS, DEFAULT_QUALITY_LIMITS
+    sharp = synthetic_crop(params)
+    frames = {
+        "sharp": sharp,
+        "blurred": cv2.GaussianBlur(sharp, (31, 31), 0),
+        "overexposed": np.full_like(sharp, 255),
+        "empty": np.full_like(sharp, 20),
+    }
+
+    best, qualities = pick_best_frame([full_frame(params, f) for f in frames.values()], params, limits)
+
+    assert best == 0
+    problems = {name: [p.split(":")[0] for p in q["problems"]] for name, q in zip(frames, qualities)}
+    assert problems["sharp"] == [] and qualities[0]["zones"] == 4
+    assert problems["blurred"] == ["смаз"]
+    assert {"экспозиция", "пересвет"} <= set(problems["overexposed"])
+    assert "нет изделия" in problems["empty"]
+
+
+def test_best_frame_prefers_covered_zones_then_sharpness():
+    params = DEFAULT_PARAMS
+    limits = DEFAULT_QUALITY_LIMITS | {"min_sharpness": 0.0, "min_brightness": 0.0}   # годны все кадры
+    whole = synthetic_crop(params)
+    half = synthetic_crop(params, axes=((120, 95), (110, 100)))   # изделие вошло в кадр наполовину
+    half[1::8] = half[2::8] = 0                                    # и резче
+    frames = [full_frame(params, half), full_frame(params, cv2.GaussianBlur(whole, (9, 9), 0)),
+              full_frame(params, whole)]
+
+    best, qualities = pick_best_frame(frames, params, limits)
+
+    assert [q["zones"] for q in qualities] == [2, 4, 4]
+    assert qualities[0]["sharpness"] > qualities[2]["sharpness"] > qualities[1]["sharpness"]
+    assert best == 2
+    assert frame_quality(frames[2], params) == {k: v for k, v in qualities[2].items() if k != "problems"}
@@ -0,0 +1,56 @@
+import queue
+import time
+
+import cv2
+import numpy as np
+
+from halva_detector import DEFAULT_PARAMS, empty_defects
+from halva_history import MAX_SPOTS_PER_ENTRY, InspectionHistory
+
+
+def test_ring_keeps_last_entries_newest_first():
+    history = InspectionHistory(size=3)
+    for seq in range(1, 6):
+        history.add(seq, verdict=1, error=0, t_trigger=float(seq), t_frame=None)
+
+    assert [e["seq"] for e in history.list()] == [5, 4, 3]
+    assert [e["seq"] for e in history.list(since=3)] == [5, 4]
+    assert sorted(history.entries) == [3, 4, 5] and history.thumb(1) is None
+
+
+def test_entry_measurements_and_thumbnail():
+    params = DEFAULT_PARAMS
+    history = InspectionHistory(size=10, thumb_width=100)
+    n = MAX_SPOTS_PER_ENTRY + 5
+    defects = {
+        "area": np.arange(1, n + 1, dtype=np.int32),
+        "bbox": np.zeros((n, 4), np.int32),
+        "centroid": np.zeros((n, 2)),
+        "ellipse": np.zeros(n, np.int32),
+        "zone": np.zeros(n, np.int32),
+    }
+    result = {"ellipses": [(100, 100, 50, 40, 0)], "defects": defects, "timings": {"defects": 0.0123}}
+    frame = np.full((params['Zone Y'] + params['Zone Height'], params['Zone X'] + params['Zone Width'], 3),
+                    128, np.uint8)
+
+    history.add(7, verdict=2, error=0, t_trigger=1.0, t_frame=1.5, frame=frame, params=params, result=result)
+    deadline = time.monotonic() + 5
+    while history.thumb(7) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    entry = history.list()[0]
+    assert (entry["spots"], entry["max_area"], len(entry["defects"])) == (n, n, MAX_SPOTS_PER_ENTRY)
+    assert entry["timings_ms"] == {"defects": 12.3} and entry["has_thumb"]
+    thumb = cv2.imdecode(np.frombuffer(history.thumb(7), np.uint8), cv2.IMREAD_COLOR)
+    assert thumb.shape[1] == 100
+
+
+def test_full_render_queue_drops_thumbnails_not_entries():
+    history = InspectionHistory(size=10)
+    # поток отрисовки ждёт на старой очереди, новая уже полна — он «не успевает»
+    history.jobs = queue.Queue(maxsize=1)
+    history.jobs.put_nowait("занято")
+    history.add(1, 1, 0, 1.0, 1.0, frame=np.zeros((8, 8, 3), np.uint8), params=DEFAULT_PARAMS,
+                result={"ellipses": [], "defects": empty_defects()})
+
+    assert history.dropped_thumbs == 1 and [e["seq"] for e in history.list()] == [1]
@@ -0,0 +1,88 @@
+import json
+import os
+import queue
+import re
+
+from halva_log import AsyncLogger, EventLog, ForwardLogger
+
+
+def feed(logger: AsyncLogger, items: list[tuple]) -> list[str]:
+    """Прогнать записи через логику фонового потока, без потока и файла."""
+    lines = []
+    for t, message in items:
+        lines.extend(logger._lines((t, message, None, True)))
+    return lines
+
+
+def occurrences(lines: list[str], message: str) -> int:
+    """Сколько раз сообщение встретилось по строкам лога (со сводками «повторено N раз»)."""
+    total = 0
+    for line in lines:
+        m = re.search(re.escape(message) + r"( — повторено (\d+) раз)?", line)
+        if m:
+            total += int(m.group(2)) if m.group(2) else 1
+    return total
+
+
+def test_dedup_counts_every_occurrence(tmp_path):
+    logger = AsyncLogger(str(tmp_path / "log.txt"), start_time=0.0, console=False, dedup_window=10)
+    times = [0, 1, 2, 3, 12, 13, 30]    # окно истекает между сводками и перед последним сообщением
+    lines = feed(logger, [(t, "⚠ нет кадра") for t in times])
+    logger._periodic(100, lines, force=True)
+
+    assert occurrences(lines, "⚠ нет кадра") == len(times)
+    assert sum(" — повторено" not in line for line in lines) == 3
+
+
+def test_periodic_summary_for_expired_window(tmp_path):
+    logger = AsyncLogger(str(tmp_path / "log.txt"), start_time=0.0, console=False, dedup_window=10)
+    lines = feed(logger, [(t, "🔄 переподключение") for t in range(5)])
+    logger._periodic(11, lines)
+
+    assert lines[-1].endswith("🔄 переподключение — повторено 4 раз за 11 с")
+    assert not logger.repeats
+
+
+def test_rotation_keeps_backups(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    events = EventLog(path, start_time=0.0, max_bytes=100, rotate_s=0, backups=2)
+    for i in range(6):
+        events._write([events._record(i, "result", {"seq": i, "pad": "x" * 80})])
+    events.file.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["events.1.jsonl", "events.2.jsonl", "events.jsonl"]
+    with open(path, encoding="utf-8") as f:
+        assert json.loads(f.read())["seq"] == 5
+    with open(str(tmp_path / "events.2.jsonl"), encoding="utf-8") as f:
+        assert json.loads(f.read())["seq"] == 3
+
+
+def test_queue_overflow_is_reported_once(tmp_path):
+    logger = AsyncLogger(str(tmp_path / "log.txt"), start_time=0.0, console=False)
+    logger.dropped = 5                  # столько строк не влезло в очередь
+
+    lines = []
+    logger._periodic(65, lines)
+    logger._periodic(66, lines)
+
+    assert lines == ["[0:01:05] ⚠ Лог: очередь переполнена, потеряно строк: 5"]
+    assert logger.dropped == 0
+
+
+def test_forward_logger_reports_lost_lines():
+    q = queue.Queue(maxsize=2)
+    forward = ForwardLogger(q, "camera")
+    forward.log("первая")
+    forward.log("вторая")
+    forward.log("третья")                 # очередь полна — потеряна
+    forward.emit("frame", seq=1)          # и это тоже
+    assert forward.dropped == 2
+
+    q.get_nowait()
+    q.get_nowait()
+    forward.log("четвёртая")
+
+    items = [q.get_nowait(), q.get_nowait()]
+    assert [item[2] for item in items] == [
+        "[camera] четвёртая", "[camera] ⚠ Лог: очередь пересылки переполнена, потеряно записей: 2"]
+    assert forward.dropped == 0
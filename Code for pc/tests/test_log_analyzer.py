@@ -0,0 +1,76 @@
+import json
+
+from log_analyzer import LogAnalyzer
+
+
+def analyze(lines: list[str]) -> dict:
+    analyzer = LogAnalyzer()
+    for line in lines:
+        analyzer.feed(line)
+    return analyzer.report()
+
+
+def test_failed_node_probe_is_not_a_reconnect():
+    # старый лог: «связь восстановлена» писалась до пробного чтения узлов
+    report = analyze([
+        "[0:00:01.000] ✅ ПЛК: подключение по OPC UA выполнено",
+        "[0:00:05.000] ⚠ Ошибка чтения узла",
+        "[0:00:06.000] 🔄 ПЛК: связь с ПЛК восстановлена",
+        "[0:00:06.100] ⚠ Подключились к ПЛК, но не удалось прочитать узлы",
+        "[0:00:09.000] 🔄 ПЛК: связь с ПЛК восстановлена",
+    ])
+
+    plc = report["subsystems"]["plc"]
+    assert (plc["connects"], plc["reconnects"], plc["failures"], plc["losses"]) == (1, 1, 1, 1)
+    # простой — от потери связи до настоящего восстановления
+    assert plc["outage_s"]["max"] == 4.0
+    assert plc["reconnect_interval_s"]["n"] == 1 and plc["storms"] == 1
+
+
+def test_legacy_text_log_with_repeats_and_restart():
+    report = analyze([
+        "[0:00:00.500] 🚀 Запуск",
+        "[0:00:10.000] 📷 Новый объект под камерой",
+        "[0:00:10.250] ✅ Результат анализа отправлен в ПЛК: 1",
+        "[0:00:11.000] 📷 Новый объект под камерой",
+        "[0:00:11.040] ✅ Результат анализа отправлен в ПЛК: 2 (40 мс)",
+        "[0:00:12.000] [analysis] ⏱ Превышен бюджет анализа — повторено 3 раз за 10 с",
+        "мусор",
+        # перезапуск: время от старта сбросилось
+        "[0:00:01.000] ✅ Камера подключена",
+        "[0:00:30.000] ⚠ Не удалось прочитать кадр",
+        "[0:00:31.000] ✅ Камера подключена",
+    ])
+
+    assert (report["lines"], report["bad_lines"], report["sessions"]) == (10, 1, 2)
+    assert report["uptime_s"] == 12.0 + 31.0        # текстовый запуск отсчитывается от 0
+    assert report["results"] == {"0": 3, "1": 1, "2": 1} and report["errors"] == {"timeout": 3}
+    assert report["cycle_ms"]["n"] == 2 and report["cycle_ms"]["max"] == 250.0
+    camera = report["subsystems"]["camera"]
+    assert (camera["connects"], camera["reconnects"], camera["losses"]) == (1, 1, 1)
+    assert camera["outage_s"]["max"] == 1.0
+
+
+def test_jsonl_events_track_each_line_separately():
+    def ev(t, kind, **fields):
+        return json.dumps({"t": t, "ev": kind} | fields)
+
+    report = analyze([
+        ev(1000.0, "start", up=0.5),
+        ev(1001.0, "conn", subsystem="plc", state="up", line="line1"),
+        ev(1001.5, "conn", subsystem="plc", state="up", line="line2"),
+        ev(1002.0, "trigger"),
+        ev(1002.1, "result", result=1, cycle_ms=100.0),
+        ev(1003.0, "conn", subsystem="plc", state="down", line="line1"),
+        ev(1005.0, "conn", subsystem="plc", state="up", line="line1"),
+        ev(1006.0, "result", result=0, error=3),
+        '{"t": "обрезано',
+        ev(1010.0, "stop"),
+    ])
+
+    assert report["sessions"] == 1 and report["uptime_s"] == 10.5 and report["bad_lines"] == 1
+    assert report["products"] == 1 and report["results"] == {"0": 1, "1": 1} and report["errors"] == {"3": 1}
+    plc = report["subsystems"]["plc"]
+    # line2 подключилась впервые — не переподключение line1
+    assert (plc["connects"], plc["reconnects"], plc["losses"]) == (2, 1, 1)
+    assert plc["outage_s"]["max"] == 2.0 and plc["reconnect_interval_s"]["max"] == 4.0
@@ -0,0 +1,63 @@
+import json
+import math
+
+import pytest
+
+import halva_metrics
+from halva_metrics import Counter, Gauge, Histogram, render_json, render_prometheus
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Свой реестр на тест: метрики модулей программы в выдачу не попадают."""
+    monkeypatch.setattr(halva_metrics, "_registry", [])
+
+
+def test_label_values_are_escaped():
+    c = Counter("halva_test_total", "Тест", ("line",))
+    c.inc(line='a"b\\c\nd')
+    c.inc(2, line="plain")
+
+    text = render_prometheus()
+
+    assert 'halva_test_total{line="a\\"b\\\\c\\nd"} 1' in text.splitlines()
+    assert 'halva_test_total{line="plain"} 2' in text.splitlines()
+    assert "# TYPE halva_test_total counter" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("halva_test_seconds", "Тест", ("op",), buckets=(0.01, 0.1))
+    for v in (0.005, 0.05, 0.05, 3.0):
+        h.observe(v, op="read")
+
+    lines = [line for line in render_prometheus().splitlines() if line.startswith("halva_test_seconds")]
+
+    assert lines == [
+        'halva_test_seconds_bucket{op="read",le="0.01"} 1',
+        'halva_test_seconds_bucket{op="read",le="0.1"} 3',
+        'halva_test_seconds_bucket{op="read",le="+Inf"} 4',
+        'halva_test_seconds_sum{op="read"} 3.105',
+        'halva_test_seconds_count{op="read"} 4',
+    ]
+
+
+def test_json_percentiles_never_exceed_max():
+    h = Histogram("halva_test_seconds", "Тест", buckets=(0.01, 0.1, 1.0))
+    g = Gauge("halva_test_gauge", "Тест", ("subsystem",))
+    for _ in range(100):
+        h.observe(0.02)
+    g.set(1.5, subsystem="plc")
+    g.set(0.5, subsystem="plc")
+
+    data = json.loads(render_json())
+
+    stats = data["halva_test_seconds"]["value"]
+    assert stats["count"] == 100 and stats["max"] == 0.02
+    assert 0.01 <= stats["p50"] <= stats["p99"] <= 0.02
+    assert data["halva_test_gauge"] == {"subsystem=plc": 0.5}
+    assert data["uptime_s"] >= 0
+
+
+def test_empty_overflow_bucket_quantile_is_nan():
+    h = Histogram("halva_test_seconds", "Тест", buckets=(1.0,))
+    assert math.isnan(h._quantile([0, 0], 0, 0.5))
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from halva_detector import DEFAULT_PARAMS
+from halva_params import ParamStore, read_params_file
+
+
+def read_history(store: ParamStore) -> list[dict]:
+    with open(store.history_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_initial_version_is_journaled(tmp_path):
+    store = ParamStore(DEFAULT_PARAMS, str(tmp_path / "params.json"))
+
+    assert store.get()[0] == 1 and store.load_error is None
+    assert [(r["version"], r["source"]) for r in read_history(store)] == [(1, "initial")]
+    # при следующем запуске та же версия подхватывается из файла, журнал не растёт
+    again = ParamStore(DEFAULT_PARAMS, store.path)
+    assert again.get() == store.get()
+    assert len(read_history(again)) == 1
+
+
+def test_update_bumps_version_only_on_change(tmp_path):
+    store = ParamStore(DEFAULT_PARAMS, str(tmp_path / "params.json"))
+    params = dict(DEFAULT_PARAMS) | {"LH": DEFAULT_PARAMS["LH"] + 1}
+
+    assert store.update(params, source="test") == (2, {"LH": params["LH"]}, [])
+    assert store.update(params, source="test") == (2, {}, [])
+    assert [r["version"] for r in read_history(store)] == [1, 2]
+
+    version, changed, errors = store.update(dict(params) | {"LH": -1})
+    assert version is None and errors and store.get()[0] == 2
+
+
+def test_corrupt_file_falls_back_after_last_journaled_version(tmp_path):
+    store = ParamStore(DEFAULT_PARAMS, str(tmp_path / "params.json"))
+    params = dict(DEFAULT_PARAMS) | {"LH": DEFAULT_PARAMS["LH"] + 1}
+    store.update(params)
+    with open(store.path, "w", encoding="utf-8") as f:
+        f.write("{ обрезанный файл")
+
+    restarted = ParamStore(DEFAULT_PARAMS, store.path)
+
+    assert restarted.load_error
+    assert restarted.get()[0] == 3 and dict(restarted.get()[1]) == DEFAULT_PARAMS
+    last = read_history(restarted)[-1]
+    assert (last["version"], last["source"], last["changed"]) == (3, "fallback", {"LH": DEFAULT_PARAMS["LH"]})
+
+
+def test_read_params_file_never_writes(tmp_path):
+    path = str(tmp_path / "params.json")
+    with pytest.raises(OSError):
+        read_params_file(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 7, "params": {"LH": -1}}, f)
+    with pytest.raises(ValueError):
+        read_params_file(path)
+    assert os.listdir(tmp_path) == ["params.json"]
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 7, "params": {"LH": DEFAULT_PARAMS["LH"] + 1}}, f)
+    assert read_params_file(path) == (7, dict(DEFAULT_PARAMS) | {"LH": DEFAULT_PARAMS["LH"] + 1})
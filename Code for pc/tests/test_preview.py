@@ -0,0 +1,113 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def test_one_publish_reaches_every_stream_client(prog):
+    hub = prog.JpegHub()
+    got = []
+
+    def client():
+        hub.add_client()
+        try:
+            got.append(hub.wait_next(0, timeout=2))
+        finally:
+            hub.remove_client()
+    clients = [threading.Thread(target=client) for _ in range(3)]
+    for c in clients:
+        c.start()
+    deadline = time.monotonic() + 2
+    while hub.viewers() < 3 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert hub.viewers() == 3
+
+    hub.publish(b"JPEG")
+    for c in clients:
+        c.join()
+
+    part = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: 4\r\n\r\nJPEG\r\n"
+    assert got == [(1, part)] * 3
+    # один и тот же объект: кадр оформлен в multipart один раз на всех
+    assert all(p is got[0][1] for _, p in got)
+    assert hub.viewers() == 0
+
+
+def test_slow_client_skips_to_latest_frame(prog):
+    hub = prog.JpegHub()
+    for jpeg in (b"1", b"2", b"3"):
+        hub.publish(jpeg)
+
+    seq, part = hub.wait_next(0, timeout=0)
+    assert seq == 3 and part.endswith(b"\r\n\r\n3\r\n")
+    assert hub.wait_next(seq, timeout=0.01) == (3, None)
+
+
+def test_snapshot_counts_as_viewer_and_waits_for_fresh_frame(prog):
+    hub = prog.JpegHub()
+    assert hub.viewers() == 0
+
+    threading.Timer(0.05, hub.publish, args=(b"fresh",)).start()
+    assert hub.snapshot(timeout=2) == b"fresh"
+    assert hub.viewers() == 1
+    # свежий кадр отдаётся сразу, без ожидания
+    t0 = time.monotonic()
+    assert hub.snapshot(timeout=2) == b"fresh"
+    assert time.monotonic() - t0 < 0.5
+
+
+def idle_second(preview, cpu_s: float = 0.0):
+    """Сдвинуть окно adapt() на секунду назад; cpu_s — сколько CPU процесс «потратил» за неё."""
+    preview.t_adapt = time.monotonic() - 1.0
+    preview.cpu_adapt = time.process_time() - cpu_s
+
+
+def test_preview_is_not_encoded_without_viewers(prog):
+    preview = prog.PreviewControl()
+    assert not preview.due(0)
+    assert preview.due(1)
+
+    preview.last_encode = time.monotonic()
+    assert not preview.due(1)              # интервал 1 / fps ещё не выдержан
+    preview.last_encode -= 1.0 / preview.fps
+    assert preview.due(1)
+
+
+def test_quality_drops_with_viewers_and_recovers(prog):
+    preview = prog.PreviewControl()
+    q_min, q_max = prog.PREVIEW_QUALITY
+
+    idle_second(preview)
+    preview.adapt(5)
+    assert preview.quality == q_max - 5 * 4 and preview.fps == prog.PREVIEW_FPS[1]
+
+    idle_second(preview)
+    preview.adapt(1)
+    assert preview.quality == q_max - 5 * 4 + 5      # качество растёт постепенно
+
+    preview.adapt(1)                                 # раньше чем через секунду — без изменений
+    assert preview.quality == q_max - 5 * 4 + 5
+
+
+def test_cpu_overload_halves_fps_down_to_minimum(prog):
+    preview = prog.PreviewControl()
+    busy = 2 * prog.PREVIEW_CPU_HIGH * (prog.os.cpu_count() or 1)
+
+    for _ in range(3):
+        idle_second(preview, cpu_s=busy)
+        preview.adapt(1)
+
+    assert preview.fps == prog.PREVIEW_FPS[0]
+    assert preview.quality == prog.PREVIEW_QUALITY[1] - 30
+
+
+def test_encode_scales_frame(prog):
+    preview = prog.PreviewControl()
+    frame = np.full((120, 160, 3), 128, np.uint8)
+
+    jpeg = preview.encode(frame)
+
+    img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    assert img.shape[:2] == (round(120 * prog.PREVIEW_SCALE), round(160 * prog.PREVIEW_SCALE))
+    assert preview.frames == 1 and not preview.due(1)
@@ -0,0 +1,78 @@
+import json
+
+
+def read_lines(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_ready_once_every_required_subsystem_marked(prog):
+    readiness = prog.Readiness()
+    readiness.required = ("web", "camera", "plc")
+
+    readiness.mark("web")
+    readiness.mark("camera")
+    state = readiness.state()
+    assert not state["ready"] and state["ready_s"] is None and state["waiting"] == ["plc"]
+    assert readiness.waiting(("web", "plc", "first_frame")) == ["plc", "first_frame"]
+
+    readiness.mark("plc")
+    first = readiness.times["plc"]
+    readiness.mark("plc")                      # повторно — после переподключения — не считается
+    state = readiness.state()
+    assert state["ready"] and state["waiting"] == [] and readiness.times["plc"] == first
+    assert state["ready_s"] == round(first, 3) and set(state["subsystems"]) == {"web", "camera", "plc"}
+
+
+def test_ready_is_logged_and_emitted_once(prog):
+    readiness = prog.Readiness()
+    readiness.required = ("web", "plc")
+    for name in ("web", "opcua_import", "plc", "web"):
+        readiness.mark(name)
+    prog.logger.close()
+    prog.events.close()
+
+    lines = read_lines(prog.logger.path)
+    assert sum("🚦 Готово:" in line for line in lines) == 3
+    assert sum("🚀 Программа готова к проверке" in line for line in lines) == 1
+    ready = [e for e in map(json.loads, read_lines(prog.events.path)) if e["ev"] == "ready"]
+    assert len(ready) == 1 and set(ready[0]) >= {"total_s", "web", "plc"}
+    assert 'halva_startup_seconds{subsystem="all"}' in prog.render_prometheus()
+
+
+LINES = [
+    {"name": "line1", "plc_url": "opc.tcp://10.0.0.1:4840", "cameras": [0]},
+    {"name": "line2", "plc_url": "opc.tcp://10.0.0.2:4840", "cameras": [1, 2]},
+]
+
+
+def test_each_line_reports_its_own_readiness(prog, monkeypatch):
+    monkeypatch.setattr(prog, "LINES", LINES)
+    monkeypatch.setattr(prog, "readiness", prog.Readiness())
+    assert prog.lines_problems() == []
+    line1, line2 = prog.build_lines()
+    prog.readiness.required = prog.Readiness.lines_required([line1, line2])
+
+    assert prog.Readiness.line_required(line2) == (
+        "plc line2", "camera line2/0", "first_frame line2/0", "camera line2/1", "first_frame line2/1")
+    for name in ("web", "opcua_import", *prog.Readiness.line_required(line1), "plc line2", "camera line2/0"):
+        prog.readiness.mark(name)
+
+    assert line1.status()["ready"] and line1.status()["waiting"] == []
+    assert not line2.status()["ready"]
+    assert line2.status()["waiting"] == ["first_frame line2/0", "camera line2/1", "first_frame line2/1"]
+    assert prog.readiness.state()["waiting"] == line2.status()["waiting"]
+
+
+def test_single_line_status_has_no_readiness_fields(prog, monkeypatch):
+    monkeypatch.setattr(prog, "LINES", [])
+    (line,) = prog.build_lines()
+
+    assert line.suffix == "" and line.cameras[0].suffix == ""
+    assert "ready" not in line.status() and "waiting" not in line.status()
+
+
+def test_lines_config_problems(prog, monkeypatch):
+    monkeypatch.setattr(prog, "LINES", [LINES[0], {"name": "line1", "plc_url": "", "cameras": [3]}])
+
+    assert prog.lines_problems() == ["линия 2: не задано plc_url", "имена линий повторяются"]
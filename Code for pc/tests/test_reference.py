@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+from halva_detector import MIN_SPOT_AREA
+from halva_reference import PATCH_SIZE, REFERENCE_LEVEL, ReferenceModel, align_patch, patch_transform
+
+ELLIPSE = (200, 150, 80, 60, 30)
+
+
+def product(spot: int = 0) -> np.ndarray:
+    """Ровное изделие (эллипс) на тёмном фоне, по желанию — чёрный квадрат spot x spot в центре."""
+    img = np.full((300, 400, 3), 20, np.uint8)
+    cx, cy, ax, ay, angle = ELLIPSE
+    cv2.ellipse(img, (cx, cy), (ax, ay), angle, 0, 360, (128, 128, 128), -1)
+    if spot:
+        img[cy - spot // 2:cy - spot // 2 + spot, cx - spot // 2:cx - spot // 2 + spot] = 0
+    return img
+
+
+def flat_model() -> ReferenceModel:
+    mean = np.full((PATCH_SIZE, PATCH_SIZE), REFERENCE_LEVEL, np.float32)
+    return ReferenceModel(mean, np.zeros_like(mean))
+
+
+def test_patch_transform_maps_circle_onto_ellipse():
+    m = patch_transform(ELLIPSE)
+    c = (PATCH_SIZE - 1) / 2
+    center = m @ [c, c, 1]
+    edge = m @ [c + PATCH_SIZE / 2, c, 1]     # конец большой оси круга -> конец оси ax эллипса
+
+    np.testing.assert_allclose(center, ELLIPSE[:2], atol=1e-6)
+    assert abs(np.hypot(*(edge - center)) - ELLIPSE[2]) < 1e-6
+
+
+def test_aligned_product_is_flat():
+    patch, _ = align_patch(product(), ELLIPSE)
+    model = flat_model()
+
+    assert cv2.countNonZero(model.deviation_mask(product(), ELLIPSE)[0]) == 0
+    assert abs(cv2.mean(patch, mask=model.inside)[0] - 128) < 1
+
+
+def test_spot_area_uses_contour_area_in_frame_pixels():
+    defects = flat_model().extract_defects(product(spot=20), [ELLIPSE], [ELLIPSE[:2]], 50)
+
+    assert len(defects["area"]) == 1
+    # площадь контура квадрата 20x20 — 19 x 19 = 361; пересчёт через круг даёт погрешность сетки
+    assert abs(int(defects["area"][0]) - 361) <= 40
+    np.testing.assert_allclose(defects["centroid"][0], (ELLIPSE[0] - 0.5, ELLIPSE[1] - 0.5), atol=1.5)
+    assert defects["ellipse"].tolist() == [0] and defects["zone"].tolist() == [0]
+
+
+def test_small_spot_below_threshold():
+    # квадрат 3x3: площадь контура 4 — меньше MIN_SPOT_AREA, как и у пятен по порогам HSV
+    defects = flat_model().extract_defects(product(spot=3), [ELLIPSE], [ELLIPSE[:2]], 50)
+
+    assert MIN_SPOT_AREA >= 4 and len(defects["area"]) == 0
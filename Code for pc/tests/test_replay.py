@@ -0,0 +1,88 @@
+import time
+
+import cv2
+import numpy as np
+
+from halva_replay import ReplaySource, SimulatedPlc
+
+
+def record(folder, n: int, bad=(), timestamps=None):
+    """Папка кадров 0.png ... как у «Запись кадров.py»; bad — номера испорченных файлов."""
+    for i in range(n):
+        path = str(folder / f"{i}.png")
+        if i in bad:
+            with open(path, "wb") as f:
+                f.write(b"not a png")
+        else:
+            cv2.imwrite(path, np.full((4, 4, 3), i, np.uint8))
+    if timestamps is not None:
+        with open(folder / "timestamps.csv", "w", encoding="utf-8") as f:
+            f.write("frame,timestamp\n" + "".join(f"{i}.png,{t}\n" for i, t in enumerate(timestamps)))
+
+
+def read_all(src: ReplaySource, limit: int = 100) -> list[int]:
+    values = []
+    for _ in range(limit):
+        ok, frame = src.read()
+        if not ok:
+            break
+        values.append(int(frame[0, 0, 0]))
+    return values
+
+
+def test_bad_frame_is_skipped_not_end_of_replay(tmp_path):
+    record(tmp_path, 5, bad={1, 3})
+    skipped = []
+    src = ReplaySource(str(tmp_path), fps=0, loop=False, on_skip=skipped.append)
+
+    assert read_all(src) == [0, 2, 4]
+    assert src.finished and not src.isOpened()
+    assert [p.rsplit("/", 1)[-1] for p in skipped] == ["1.png", "3.png"]
+
+
+def test_loop_rewinds_and_all_bad_folder_ends(tmp_path):
+    record(tmp_path, 3)
+    assert read_all(ReplaySource(str(tmp_path), fps=0, loop=True), limit=7) == [0, 1, 2, 0, 1, 2, 0]
+
+    bad = tmp_path / "bad"
+    bad.mkdir()
+    record(bad, 2, bad={0, 1})
+    src = ReplaySource(str(bad), fps=0, loop=True)
+    assert read_all(src) == [] and src.finished and src.skipped == 2
+
+
+def test_pacing_by_recorded_timestamps(tmp_path):
+    record(tmp_path, 3, timestamps=[1000.0, 1000.05, 1000.15])
+    src = ReplaySource(str(tmp_path), fps=None, loop=False)
+
+    t0 = time.monotonic()
+    stamps = []
+    while src.read()[0]:
+        stamps.append(src.timestamp)
+
+    assert stamps == [1000.0, 1000.05, 1000.15]
+    assert time.monotonic() - t0 >= 0.14
+
+
+def test_fixed_fps_pacing(tmp_path):
+    record(tmp_path, 5)
+    src = ReplaySource(str(tmp_path), fps=50, loop=False)
+
+    t0 = time.monotonic()
+    assert len(read_all(src)) == 5
+    assert time.monotonic() - t0 >= 4 / 50 - 0.005
+
+
+def test_simulated_plc_cycle():
+    frame = [1, time.time()]
+    plc = SimulatedPlc(lambda: tuple(frame))
+    node = plc.get_node("ns=4;s=|var|PLC.Application.TargetVars.bNewProduct")
+
+    assert node.get_value() is True
+    plc.set("iPcResult", 2)
+    plc.set("bStartGrab", False)
+    # тот же кадр — нового изделия нет
+    assert node.get_value() is False
+    frame[0] = 2
+    assert node.get_value() is True
+    assert plc.products == 1 and plc.results == {2: 1}
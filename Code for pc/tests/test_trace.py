@@ -0,0 +1,56 @@
+import json
+import threading
+
+from halva_trace import Tracer
+
+
+def read_events(path: str) -> list[dict]:
+    """Файл Chrome Trace без закрывающей скобки — дописываем её, как это делает просмотрщик."""
+    with open(path, encoding="utf-8") as f:
+        return json.loads(f.read().rstrip().rstrip(",") + "]")
+
+
+def test_trace_export_with_span_threads(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.json"), sample_rate=1.0)
+    trace = tracer.begin("product", seq=7)
+    with tracer.span("copy frame"):
+        pass
+
+    def pool_worker():
+        tracer.attach(trace)
+        with tracer.span("defects"):
+            pass
+        tracer.attach(None)
+    worker = threading.Thread(target=pool_worker)
+    worker.start()
+    worker.join()
+    assert tracer.end(trace, result=1)
+    tracer.close()
+
+    events = {e["name"]: e for e in read_events(tracer.path)}
+    assert set(events) == {"product", "copy frame", "defects"}
+    assert events["product"]["args"]["seq"] == 7 and events["product"]["args"]["result"] == 1
+    assert events["copy frame"]["tid"] == events["product"]["tid"] == threading.get_native_id()
+    assert events["defects"]["tid"] == worker.native_id
+    assert {e["args"]["trace_id"] for e in events.values()} == {trace.trace_id}
+
+
+def test_spans_after_end_are_dropped(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.json"), sample_rate=1.0)
+    trace = tracer.begin("product")
+    tracer.end(trace)
+    # поток пула, доработавший после дедлайна
+    trace.add("late", 0.0, 1.0)
+    tracer.close()
+
+    assert [e["name"] for e in read_events(tracer.path)] == ["product"]
+
+
+def test_fast_product_outside_sample_is_not_written(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.json"), slow_ms=10_000)
+    trace = tracer.begin("product")
+    with tracer.span("copy frame"):
+        pass
+
+    assert not tracer.end(trace)
+    assert tracer.written == 0 and tracer.active() is None
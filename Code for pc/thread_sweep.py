@@ -0,0 +1,85 @@
+"""
+thread_sweep.py
+Подбор числа потоков для анализа изделий на конкретном ПК.
+
+- Загружает кадры из папки (как настроечная программа)
+- Для каждой пары (потоки OpenCV, размер пула) прогоняет analyze_product
+- Печатает медиану и 95-й перцентиль задержки и лучшую настройку,
+  которую затем вписывают в CV_THREADS / ANALYSIS_POOL_SIZE в itog prog.py
+
+Запуск:
+    python thread_sweep.py [папка_с_кадрами]
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from halva_detector import DEFAULT_PARAMS, PYRAMID_SCALE, analyze_product, configure_threads
+
+# ---------- НАСТРОЙКИ ----------
+
+IMAGE_FOLDER = "C:/Users/admin/Documents/foto1080/"  # Путь к изображениям
+MAX_IMAGES = 50               # сколько кадров брать
+REPEAT = 5                    # сколько раз прогонять каждый кадр
+CV_THREADS_LIST = [1, 2, 4]   # значения cv2.setNumThreads
+POOL_SIZES = [0, 1, 2, 3, 4]  # размер пула анализа (0 — последовательно)
+
+
+def load_frames(folder: str) -> list[np.ndarray]:
+    """Кадры 0.png, 1.png, ... из папки (до первого отсутствующего)."""
+    frames = []
+    for i in range(MAX_IMAGES):
+        img = cv2.imread(os.path.join(folder, f"{i}.png"))
+        if img is None:
+            break
+        frames.append(img)
+    return frames
+
+
+def measure(frames: list[np.ndarray], cv_threads: int, pool_size: int) -> np.ndarray:
+    """Задержки analyze_product (мс) для одной настройки потоков."""
+    pool = configure_threads(cv_threads, pool_size)
+    try:
+        # прогрев: первый вызов тянет инициализацию OpenCV и пула
+        analyze_product(frames[0], DEFAULT_PARAMS, PYRAMID_SCALE, pool)
+        times = []
+        for _ in range(REPEAT):
+            for frame in frames:
+                t0 = time.perf_counter()
+                analyze_product(frame, DEFAULT_PARAMS, PYRAMID_SCALE, pool)
+                times.append((time.perf_counter() - t0) * 1000)
+        return np.array(times)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else IMAGE_FOLDER
+    frames = load_frames(folder)
+    if not frames:
+        print(f"❌ В папке {folder} нет кадров 0.png, 1.png, ...")
+        sys.exit(1)
+
+    print(f"Кадров: {len(frames)}, повторов: {REPEAT}, CPU: {os.cpu_count()}")
+    print(f"{'cv2 потоков':>12} {'пул':>5} {'медиана, мс':>12} {'p95, мс':>9}")
+
+    best = None
+    for cv_threads in CV_THREADS_LIST:
+        for pool_size in POOL_SIZES:
+            t = measure(frames, cv_threads, pool_size)
+            med, p95 = float(np.median(t)), float(np.percentile(t, 95))
+            print(f"{cv_threads:>12} {pool_size:>5} {med:>12.2f} {p95:>9.2f}")
+            if best is None or p95 < best[2]:
+                best = (cv_threads, pool_size, p95)
+
+    print(f"\n✅ Лучшее по p95: CV_THREADS = {best[0]}, ANALYSIS_POOL_SIZE = {best[1]} "
+          f"({best[2]:.2f} мс)")
+
+
+if __name__ == "__main__":
+    main()
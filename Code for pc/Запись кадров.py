@@ -3,18 +3,26 @@ from opcua import ua
 import sys
 import numpy as np
 import cv2 
+import time
 
 cap = cv2.VideoCapture(1)
 cap.set(cv2.CAP_PROP_FPS, 24) # Частота кадров
 cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920) # Ширина кадров в видеопотоке.
 cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080) # Высота кадров в видеопотоке.
+folder = "C:/Users/L13 Yoga/Documents/foto1080/"
+# метки времени съёмки — для воспроизведения записи в исходном темпе (halva_replay.py)
+timestamps = open(folder + "timestamps.csv", "w", encoding="utf-8")
+timestamps.write("frame,timestamp\n")
 i = 0
 while i<1000:
         
-    filename = f"C:/Users/L13 Yoga/Documents/foto1080/{i}.png"
+    filename = f"{folder}{i}.png"
     ret, img = cap.read()
+    t = time.time()
     if ret:
         cv2.imwrite(filename, img)
+        timestamps.write(f"{i}.png,{t:.6f}\n")
     #cv2.imshow("camera", img)
     
-    i+=1
\ No newline at end of file
+    i+=1
+timestamps.close()
\ No newline at end of file